@@ -1,13 +1,15 @@
 from pycequeau.physiographic.base import Basin
 from pycequeau.meteo.meteo_netcdf import StationNetCDF
+from pycequeau.core import matlab
 import os
+import xarray as xr
 
 
 def main():
     # Create the project folder structure.
     # 1- Select folder where the meteo data is stored
     project_folder = "/home/erinconv/01-PhD/River"
-    # 2- Select the bassinVersant json file for this basin
+    # 2- Select the bassinVersant file for this basin (.json, .nc or .npz)
     bassinVersant_file = "/home/erinconv/01-PhD/River/results/bassinVersant.json"
     # 3- File list with all the raster and shapes
     files_list = ["Dem1.tif",
@@ -25,12 +27,19 @@ def main():
     # 5- Create the Meteo data object
     MeteoStations = StationNetCDF.charge_ERA_Meteo(basin,
                                                    os.path.join(project_folder,"meteo","ERA"))
-    # 6- Do the interpolation
-    dsi = MeteoStations.interpolation("nearest")
-    # 7- Construct the meteo structure for CEQUEAU
-    grid = MeteoStations.cequeau_grid(dsi,basin)
-    # 8- Save the netcdf with the meteo data
-    grid.to_netcdf(os.path.join(project_folder,"meteo","meteo_cequeau.nc"))
+    # 6- Interpolate the meteo data and save the netcdf in the CEQUEAU
+    # format, by blocks of one year. "nearest", "bilinear", "conservative"
+    # (area weighted, for the precipitation totals), "idw" and "thiessen"
+    # remap the data directly on the CEs with sparse weights
+    meteo_file = os.path.join(project_folder,"meteo","meteo_cequeau.nc")
+    MeteoStations.write_cequeau_grid(meteo_file, "nearest", block=365)
+    # For the operational (daily) updates, only the days after the last
+    # pasTemp of the file are remapped with the cached weights and appended:
+    # MeteoStations.update_cequeau_grid(meteo_file)
+    # 7- Save the meteo_grid structure for the MATLAB version of CEQUEAU. The
+    # file is read back and written by blocks of pasTemp
+    with xr.open_dataset(meteo_file) as grid:
+        matlab.write_meteo_grid(grid, os.path.join(project_folder,"meteo","meteo_cequeau.mat"))
     pass
 if __name__ == "__main__":
     main()
@@ -36,8 +36,8 @@ def main():
     params.set_fonte(snow_parameters,1)
     params.set_evapo(evapo_parameters,1)
     params.set_qualite(temperature_params)
-    # 8- Create the parameter structure
-    params.create_parameter_structure()
+    # 8- Create the parameter structure (json and MATLAB .mat)
+    params.create_parameter_structure(mat=True)
 
 
 
@@ -17,10 +17,15 @@ def main():
     basin = Basin(project_folder,
                   "Melezes",
                   files_list)
+    # 2.0 - (Optional) Compute the FAC from the DEM instead of using the
+    # FAC given in files_list
+    # basin.compute_flow_accumulation()
     # 2.1 - Select Fisnet dimensions
     basin.set_dimenssions(7500, 7500)
+    # 2.2 - Find the fishnet offset with the least small CPs
+    xoffset, yoffset = basin.optimize_offset()
     # 3 Create CE and CP fishnet
-    basin.create_CEfishnet()
+    basin.create_CEfishnet(xoffset, yoffset)
     basin.create_CPfishnet()
     # 4 - Remove the small CPs in the basin
     basin.polish_CPfishnet()
@@ -30,8 +35,11 @@ def main():
     basin.carreauxEntiers_struct()
     # 7 - Create carreux partiels structure
     basin.carreauxPartiels_struct()
-    # 8 - Create the bassinVersant structure
-    basin.create_bassinVersant_structure()
+    # 8 - Create the bassinVersant structure (json and MATLAB .mat, the
+    # binary can also be "nc" or "npz")
+    basin.create_bassinVersant_structure(binary="mat")
+    # 9 - Export the CE and CP fishnets as shapefiles
+    basin.export_fishnets()
 
 if __name__ == "__main__":
     main()
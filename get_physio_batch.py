@@ -0,0 +1,18 @@
+from pycequeau.physiographic.batch import build_basins
+import os
+
+
+def main():
+    # 1- Select the manifest with the basins to build. This is a csv or json
+    # file with the project folder, basin name, files and CE dimensions
+    manifest = "/home/erinconv/01-PhD/basins_manifest.csv"
+    # 2- Build all the basins in parallel
+    report = build_basins(manifest,
+                          max_workers=os.cpu_count(),
+                          report_file="/home/erinconv/01-PhD/basins_report.csv")
+    # 3- Show the basins that failed
+    print(report[report["status"] == "failed"][["basin_name", "stage", "error"]])
+
+
+if __name__ == "__main__":
+    main()
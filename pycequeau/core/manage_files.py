@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 import os
 import pandas as pd
 import numpy as np
@@ -10,11 +12,20 @@ from .units import (
 import sys
 
 
+# Default chunks of the meteo collections: one year of daily values
+__chunks__ = {"time": 365}
+
+
+def list_netCDF(files_path: str) -> list:
+    # List the .nc files whitin the folder
+    files_list = sorted(os.listdir(files_path))
+    return [os.path.join(files_path, i)
+            for i in files_list if i.endswith(".nc")]
+
+
 def dict_netCDF(files_path: str) -> dict:
     # List files whitin the folder
-    files_list = os.listdir(files_path)
-    filtered_list = [os.path.join(files_path, i)
-                     for i in files_list if i.endswith(".nc")]
+    filtered_list = list_netCDF(files_path)
     vars_dict = {}
     for i, file in enumerate(filtered_list):
         var_name = "var"+str(i)
@@ -23,71 +34,91 @@ def dict_netCDF(files_path: str) -> dict:
     return vars_dict
 
 
-def get_CORDEX_Dataset(vars_dict: dict) -> xr.Dataset:
-    """_summary_
+def open_netCDF_collection(files_path: str,
+                           chunks: dict = None) -> xr.Dataset:
+    """Open all the .nc files of a folder as a single lazy dataset. The
+    variables (one per file) are merged and the periods (several files of
+    the same variable) are concatenated along time in one operation. The
+    values are only read chunk by chunk when they are computed.
 
     Args:
-        vars_dict (dict): _description_
+        files_path (str): Folder with the .nc files
+        chunks (dict, optional): Dask chunks. Defaults to None
+        (__chunks__, one year of daily values).
 
     Returns:
-        xr.Dataset: _description_
+        xr.Dataset: Lazy dataset with all the variables
     """
-    keys = list(vars_dict.keys())
-    # Create the dataset
-    # dr1 = vars_dict.get(keys[0])
-    # dr2 = vars_dict.get(keys[1])
-    ds = xr.Dataset()
-    for var in keys:
-        # Get the var name
-        
-        # Check the data type to convert it to a commont data form
-        # if vars_dict.get(var)[nc_file_var].dtype == "float64":
-        #     # vars_dict.get(var)['lat'] = vars_dict.get(var)['lat'].astype(np.float32)
-        #     # vars_dict.get(var)['lon'] = vars_dict.get(var)['lon'].astype(np.float32)
-        #     ds = ds.merge(vars_dict.get(var).astype(np.float32))
-        # else:
-        #   ds = ds.merge(vars_dict.get(var))
-        # Fix units
-        dr = units_CORDEX(vars_dict.get(var))
-        nc_file_var =list(dr.keys())[0]
-        ds = ds.merge(dr)
-        # Put attributes
-        ds[nc_file_var].attrs = dr[nc_file_var].attrs
-    return ds
-
-    
-    pass
-
-
-def get_ERA_Dataset(vars_dict: dict) -> xr.Dataset:
-    """_summary_
+    return xr.open_mfdataset(list_netCDF(files_path),
+                             engine="netcdf4",
+                             combine="by_coords",
+                             chunks=__chunks__ if chunks is None else chunks,
+                             data_vars="minimal",
+                             coords="minimal",
+                             compat="override")
+
+
+def subset_latlon(ds: xr.Dataset,
+                  bounds: tuple,
+                  halo: int = 1) -> xr.Dataset:
+    """Window of a lat/lon dataset covering the given bounds. The window is
+    taken by position (isel) so it works with ascending and descending
+    axes, and on a lazy dataset only this window is read afterwards.
+
+    Args:
+        ds (xr.Dataset): Dataset with lat and lon dimensions
+        bounds (tuple): (lat_min, lat_max, lon_min, lon_max) in degrees
+        halo (int, optional): Extra cells on each side, needed by the
+        interpolation. Defaults to 1.
+
+    Returns:
+        xr.Dataset: Subset of the dataset
+    """
+    lat_min, lat_max, lon_min, lon_max = bounds
+    # Longitudes given in [0, 360)
+    if ds["lon"].values.max() > 180:
+        lon_min, lon_max = lon_min % 360, lon_max % 360
+    window = {}
+    for dim, low, high in (("lat", lat_min, lat_max), ("lon", lon_min, lon_max)):
+        axis = ds[dim].values
+        inside = np.flatnonzero((axis >= low) & (axis <= high))
+        if inside.size == 0:
+            # The bounds fall between two grid points: take the nearest one
+            inside = np.array([np.abs(axis - (low + high)/2).argmin()])
+        window[dim] = slice(max(inside[0] - halo, 0),
+                            min(inside[-1] + halo + 1, axis.size))
+    return ds.isel(window)
+
+
+def get_CORDEX_Dataset(vars_dict: dict | xr.Dataset) -> xr.Dataset:
+    """Convert the CORDEX variables to the CEQUEAU names and units
+
+    Args:
+        vars_dict (dict | xr.Dataset): Datasets of each file (dict_netCDF)
+        or the combined collection (open_netCDF_collection)
+
+    Returns:
+        xr.Dataset: Dataset with all the variables
+    """
+    if isinstance(vars_dict, xr.Dataset):
+        return units_CORDEX(vars_dict)
+    # Fix units of each file and merge them at once
+    return xr.merge([units_CORDEX(ds) for ds in vars_dict.values()],
+                    combine_attrs="drop_conflicts")
+
+
+def get_ERA_Dataset(vars_dict: dict | xr.Dataset) -> xr.Dataset:
+    """Convert the ERA variables to the CEQUEAU names and units
 
     Args:
-        vars_dict (dict): _description_
+        vars_dict (dict | xr.Dataset): Datasets of each file (dict_netCDF)
+        or the combined collection (open_netCDF_collection)
 
     Returns:
-        xr.Dataset: _description_
+        xr.Dataset: Dataset with all the variables
     """
-    keys = list(vars_dict.keys())
-    # Create the dataset
-    # dr1 = vars_dict.get(keys[0])
-    # dr2 = vars_dict.get(keys[1])
-    ds = xr.Dataset()
-    for var in keys:
-        # Get the var name
-        
-        # Check the data type to convert it to a commont data form
-        # if vars_dict.get(var)[nc_file_var].dtype == "float64":
-        #     # vars_dict.get(var)['lat'] = vars_dict.get(var)['lat'].astype(np.float32)
-        #     # vars_dict.get(var)['lon'] = vars_dict.get(var)['lon'].astype(np.float32)
-        #     ds = ds.merge(vars_dict.get(var).astype(np.float32))
-        # else:
-        #   ds = ds.merge(vars_dict.get(var))
-        # Fix units
-        dr = units_ERA(vars_dict.get(var))
-        nc_file_var =list(dr.keys())[0]
-        # print(dr)
-        ds = ds.merge(dr)
-        # Put attributes
-        ds[nc_file_var].attrs = dr[nc_file_var].attrs
-    return ds
+    if isinstance(vars_dict, xr.Dataset):
+        return units_ERA(vars_dict)
+    # Fix units of each file and merge them at once
+    return xr.merge([units_ERA(ds) for ds in vars_dict.values()],
+                    combine_attrs="drop_conflicts")
@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import time
+import h5py
+import numpy as np
+import xarray as xr
+from collections.abc import Mapping
+
+# MATLAB class of each numpy type
+__classes__ = {
+    np.dtype(np.float64): "double",
+    np.dtype(np.float32): "single",
+    np.dtype(np.int8): "int8",
+    np.dtype(np.int16): "int16",
+    np.dtype(np.int32): "int32",
+    np.dtype(np.int64): "int64",
+    np.dtype(np.uint8): "uint8",
+    np.dtype(np.uint16): "uint16",
+    np.dtype(np.uint32): "uint32",
+    np.dtype(np.uint64): "uint64",
+    np.dtype(bool): "logical",
+}
+# Fields of the meteo grid, in the order of matlab/functions/create_grid.m
+__meteo_fields__ = ["tMax", "tMin", "pTot", "rayonnement",
+                    "nebulosite", "pression", "vitesseVent"]
+
+
+class StructArray:
+    def __init__(self, fields: dict) -> None:
+        """1xN MATLAB struct array given by columns. Element k of each field
+        is column[k], so the rows of a 2D column (i.e. a zero padded list of
+        upstream CPs) become row vectors.
+
+        Args:
+            fields (dict): Field name -> column with one value per element
+        """
+        self.fields = fields
+        lengths = {len(column) for column in fields.values()}
+        if len(lengths) > 1:
+            raise ValueError("The fields of the struct array have different lengths")
+
+    def __len__(self) -> int:
+        return len(next(iter(self.fields.values()))) if self.fields else 0
+
+
+class _MatWriter:
+    def __init__(self, f: h5py.File, double: bool) -> None:
+        # The elements of the struct arrays are stored once in #refs# and
+        # the repeated values share the same reference
+        self.f = f
+        self.double = double
+        self._refs = None
+        self._shared = {}
+
+    @property
+    def refs(self) -> h5py.Group:
+        if self._refs is None:
+            self._refs = self.f.create_group("#refs#")
+        return self._refs
+
+    def write(self, group: h5py.Group, name: str, value) -> None:
+        if isinstance(value, StructArray):
+            self._write_struct_array(group, name, value)
+        elif isinstance(value, Mapping):
+            self._write_struct(group, name, value)
+        elif isinstance(value, str):
+            self._write_char(group, name, value)
+        else:
+            self._write_numeric(group, name, value)
+
+    def _write_struct(self, group: h5py.Group, name: str, value: Mapping) -> None:
+        if not value:
+            # Empty dictionaries (i.e. no barrage) are empty matrices
+            self._write_empty(group, name, "double")
+            return
+        sub = group.create_group(name)
+        _set_class(sub, "struct")
+        _set_fields(sub, list(value))
+        for key, item in value.items():
+            self.write(sub, key, item)
+
+    def _write_struct_array(self, group: h5py.Group, name: str, value: StructArray) -> None:
+        if len(value) == 0:
+            self._write_empty(group, name, "struct")
+            return
+        sub = group.create_group(name)
+        _set_class(sub, "struct")
+        _set_fields(sub, list(value.fields))
+        for key, column in value.fields.items():
+            column = np.asarray(column)
+            refs = [self._element(column[k]) for k in range(len(column))]
+            # HDF5 dimensions are the reverse of the MATLAB ones (1xN)
+            sub.create_dataset(key, data=np.array(refs, dtype=h5py.ref_dtype).reshape(-1, 1),
+                               dtype=h5py.ref_dtype)
+
+    def _element(self, value: np.ndarray) -> h5py.Reference:
+        data, matlab_class = self._numeric(value)
+        key = (data.dtype.str, data.shape, data.tobytes())
+        if key not in self._shared:
+            name = format(len(self._shared), "x")
+            self._write_array(self.refs, name, data, matlab_class)
+            self._shared[key] = self.refs[name].ref
+        return self._shared[key]
+
+    def _numeric(self, value) -> tuple:
+        # MATLAB matrix (at least 2D, vectors are row vectors) and class
+        if isinstance(value, (set, frozenset)):
+            value = sorted(value)
+        data = np.asarray(value)
+        if data.dtype == object:
+            data = data.astype(np.float64)
+        if data.dtype.kind in "iufb" and self.double and data.dtype != bool:
+            data = data.astype(np.float64)
+        if data.ndim == 0:
+            data = data.reshape(1, 1)
+        elif data.ndim == 1:
+            data = data.reshape(1, -1)
+        if data.dtype not in __classes__:
+            raise TypeError(f"The type {data.dtype} can not be written as MATLAB data")
+        return data, __classes__[data.dtype]
+
+    def _write_numeric(self, group: h5py.Group, name: str, value) -> None:
+        data, matlab_class = self._numeric(value)
+        self._write_array(group, name, data, matlab_class)
+
+    def _write_array(self, group: h5py.Group, name: str, data: np.ndarray, matlab_class: str) -> None:
+        if data.size == 0:
+            self._write_empty(group, name, matlab_class)
+            return
+        if data.dtype == bool:
+            data = data.astype(np.uint8)
+        # MATLAB is column major: the matrix is stored transposed
+        dset = group.create_dataset(name, data=np.ascontiguousarray(data.T))
+        _set_class(dset, matlab_class)
+        if matlab_class == "logical":
+            dset.attrs.create("MATLAB_int_decode", np.int32(1))
+
+    def _write_char(self, group: h5py.Group, name: str, value: str) -> None:
+        if not value:
+            self._write_empty(group, name, "char")
+            return
+        codes = np.frombuffer(value.encode("utf-16-le"), dtype=np.uint16)
+        dset = group.create_dataset(name, data=codes.reshape(-1, 1))
+        _set_class(dset, "char")
+        dset.attrs.create("MATLAB_int_decode", np.int32(2))
+
+    @staticmethod
+    def _write_empty(group: h5py.Group, name: str, matlab_class: str) -> None:
+        # Empty arrays store their (0x0) dimensions as data
+        dset = group.create_dataset(name, data=np.zeros(2, dtype=np.uint64))
+        _set_class(dset, matlab_class)
+        dset.attrs.create("MATLAB_empty", np.uint8(1))
+
+
+def _set_class(obj: h5py.HLObject, matlab_class: str) -> None:
+    obj.attrs.create("MATLAB_class", np.bytes_(matlab_class))
+
+
+def _set_fields(group: h5py.Group, names: list) -> None:
+    # Field names as variable length arrays of characters
+    dtype = h5py.vlen_dtype(np.dtype("S1"))
+    fields = np.empty(len(names), dtype=dtype)
+    for k, name in enumerate(names):
+        fields[k] = np.array(list(name), dtype="S1")
+    group.attrs.create("MATLAB_fields", fields, dtype=dtype)
+
+
+def _header() -> bytes:
+    # 128 bytes MATLAB header: text, subsystem offset, version and endian
+    text = ("MATLAB 7.3 MAT-file, Platform: GLNXA64, Created on: "
+            f"{time.strftime('%a %b %d %H:%M:%S %Y')} HDF5 schema 1.00 .")
+    return text.encode("ascii").ljust(116, b" ") + b"\x00"*8 + b"\x00\x02" + b"IM"
+
+
+def _write_header(path: str) -> None:
+    # The header goes in the userblock reserved when the file is created
+    with open(path, "r+b") as f:
+        f.write(_header())
+
+
+def write_mat(path: str, variables: dict, double: bool = True) -> None:
+    """Write variables as a MATLAB v7.3 (HDF5) .mat file, readable with load.
+    Dictionaries become structs, StructArray objects 1xN struct arrays,
+    strings char arrays and the numbers matrices (vectors as row vectors).
+
+    Args:
+        path (str): Output path
+        variables (dict): Variable name -> value
+        double (bool, optional): Write the numbers as double, as jsonlab
+        reads them. Defaults to True.
+    """
+    with h5py.File(path, "w", userblock_size=512) as f:
+        writer = _MatWriter(f, double)
+        for name, value in variables.items():
+            writer.write(f, name, value)
+    _write_header(path)
+
+
+def meteo_grid(grid: xr.Dataset) -> dict:
+    """Meteo structure used by the CEQUEAU engine: one (pasTemp x CE) matrix
+    per variable and the datenums as a column vector. This is the same as
+    matlab/functions/upload_meteo.m does with the CEQUEAU netCDF file.
+
+    Args:
+        grid (xr.Dataset): Meteo data in the CEQUEAU format (pasTemp, CEid)
+
+    Returns:
+        dict: MATLAB structure
+    """
+    structure = {}
+    for name in __meteo_fields__:
+        if name in grid:
+            structure[name] = grid[name].transpose("pasTemp", "CEid").values
+        else:
+            structure[name] = np.empty((0, 0), dtype=np.float64)
+    structure["t"] = grid["pasTemp"].values.reshape(-1, 1)
+    return structure
+
+
+def write_meteo_grid(grid: xr.Dataset, path: str, block: int = 365) -> None:
+    """Write the meteo_grid structure (see meteo_grid) as a .mat file. The
+    values keep their type (single), like when they are read from the
+    netCDF file. The matrices are written by blocks of pasTemp, so only one
+    block of the grid is in memory when it is read lazily from the file.
+
+    Args:
+        grid (xr.Dataset): Meteo data in the CEQUEAU format (pasTemp, CEid)
+        path (str): Output path
+        block (int, optional): Time steps per block. Defaults to 365.
+    """
+    steps = grid.sizes["pasTemp"]
+    with h5py.File(path, "w", userblock_size=512) as f:
+        writer = _MatWriter(f, double=False)
+        structure = f.create_group("meteo_grid")
+        _set_class(structure, "struct")
+        _set_fields(structure, __meteo_fields__ + ["t"])
+        for name in __meteo_fields__:
+            if name not in grid:
+                writer.write(structure, name, np.empty((0, 0), dtype=np.float64))
+                continue
+            da = grid[name].transpose("pasTemp", "CEid")
+            if steps == 0 or da.sizes["CEid"] == 0:
+                writer._write_empty(structure, name, __classes__[da.dtype])
+                continue
+            # MATLAB is column major: the (pasTemp x CE) matrix is stored as
+            # (CE, pasTemp) and each block fills a range of columns
+            dset = structure.create_dataset(name, shape=(da.sizes["CEid"], steps),
+                                            dtype=da.dtype,
+                                            chunks=(da.sizes["CEid"], min(block, steps)))
+            _set_class(dset, __classes__[da.dtype])
+            for start in range(0, steps, block):
+                dset[:, start:start+block] = da.isel(pasTemp=slice(start, start+block)).values.T
+        writer.write(structure, "t", grid["pasTemp"].values.reshape(-1, 1))
+    _write_header(path)
@@ -1,3 +1,117 @@
+from __future__ import annotations
+
+import os
+import netCDF4
+import numpy as np
 import xarray as xr
 import pandas as pd
 
+
+def create_meteo_file(path: str,
+                      grid: xr.Dataset,
+                      chunk_time: int = 365,
+                      complevel: int = 4) -> None:
+    """Create an empty CEQUEAU meteo file with the variables of the grid.
+    The pasTemp dimension is unlimited, so later periods can be appended,
+    and the variables are chunked (chunk_time, CE) and compressed.
+
+    Args:
+        path (str): Output path
+        grid (xr.Dataset): Meteo grid (pasTemp, CEid), only the CEs, the
+        variable names and the attributes are used
+        chunk_time (int, optional): Time steps per chunk. Defaults to 365.
+        complevel (int, optional): zlib compression level. Defaults to 4.
+    """
+    CEs = grid["CEid"].values
+    with netCDF4.Dataset(path, "w", format="NETCDF4") as nc:
+        nc.createDimension("pasTemp", None)
+        nc.createDimension("CEid", CEs.size)
+        var = nc.createVariable("pasTemp", np.float32, ("pasTemp",),
+                                chunksizes=(chunk_time,))
+        var.setncatts(grid["pasTemp"].attrs)
+        var = nc.createVariable("CEid", np.int32, ("CEid",))
+        var[:] = CEs
+        for var_name, da in grid.data_vars.items():
+            var = nc.createVariable(var_name, np.float32, ("pasTemp", "CEid"),
+                                    zlib=True, complevel=complevel,
+                                    chunksizes=(chunk_time, CEs.size),
+                                    fill_value=np.float32(np.nan))
+            var.setncatts({key: value for key, value in da.attrs.items()
+                           if key != "_FillValue"})
+        nc.setncatts(grid.attrs)
+
+
+def append_meteo(path: str, grid: xr.Dataset) -> None:
+    """Append a block of time steps at the end of a CEQUEAU meteo file
+
+    Args:
+        path (str): File created by create_meteo_file
+        grid (xr.Dataset): Block of the meteo grid (pasTemp, CEid)
+    """
+    with netCDF4.Dataset(path, "a") as nc:
+        if not np.array_equal(nc.variables["CEid"][:], grid["CEid"].values):
+            raise ValueError(f"The CEs of {path} are not the CEs of the grid")
+        start = nc.dimensions["pasTemp"].size
+        stop = start + grid.sizes["pasTemp"]
+        nc.variables["pasTemp"][start:stop] = grid["pasTemp"].values.astype(np.float32)
+        for var_name in grid.data_vars:
+            nc.variables[var_name][start:stop, :] = \
+                grid[var_name].transpose("pasTemp", "CEid").values.astype(np.float32)
+
+
+def write_meteo_stream(path: str,
+                       grid: xr.Dataset,
+                       block: int = 365,
+                       append: bool = False,
+                       complevel: int = 4) -> None:
+    """Write the CEQUEAU meteo grid by blocks of time steps. When the grid
+    is lazy (i.e. remapped with regrid), each block is read, converted and
+    remapped only when it is written, so the whole record is never in
+    memory.
+
+    Args:
+        path (str): Output path (.nc)
+        grid (xr.Dataset): Meteo grid (pasTemp, CEid)
+        block (int, optional): Time steps per block (and per chunk).
+        Defaults to 365.
+        append (bool, optional): Append to an existing file instead of
+        creating it. Defaults to False.
+        complevel (int, optional): zlib compression level. Defaults to 4.
+    """
+    if not (append and os.path.exists(path)):
+        create_meteo_file(path, grid, block, complevel)
+    for start in range(0, grid.sizes["pasTemp"], block):
+        chunk = grid.isel(pasTemp=slice(start, start + block)).compute()
+        append_meteo(path, chunk)
+
+
+def last_datenum(path: str) -> float | None:
+    """Last time step (datenum) of a CEQUEAU meteo file
+
+    Args:
+        path (str): CEQUEAU meteo file (.nc)
+
+    Returns:
+        float | None: Last pasTemp, None if the file has no time steps
+    """
+    with netCDF4.Dataset(path, "r") as nc:
+        size = nc.dimensions["pasTemp"].size
+        if size == 0:
+            return None
+        return float(nc.variables["pasTemp"][size - 1])
+
+
+def get_attribute(path: str, name: str, default=None):
+    """Global attribute of a netCDF file
+
+    Args:
+        path (str): netCDF file
+        name (str): Attribute name
+        default (optional): Value when the attribute is missing. Defaults to
+        None.
+
+    Returns:
+        Attribute value
+    """
+    with netCDF4.Dataset(path, "r") as nc:
+        return nc.getncattr(name) if name in nc.ncattrs() else default
@@ -1,6 +1,7 @@
 # from __future__ import annotations
 
-from pyproj import Transformer, Proj
+from functools import lru_cache
+from pyproj import Transformer, CRS
 import numpy as np
 import xarray as xr
 from osgeo import gdal, osr
@@ -13,27 +14,61 @@ def get_proj_code(ds: gdal.Dataset):
     return EPSG
 
 
+@lru_cache(maxsize=None)
 def get_transformer(source_crs: str,
-                    target_crs: str):
-    proj_source = Proj(source_crs, preserve_units=False)
-    proj_target = Proj(target_crs, preserve_units=False)
-    return Transformer.from_proj(proj_source, proj_target)
+                    target_crs: str,
+                    always_xy: bool = True) -> Transformer:
+    """Transformer between two CRS. The transformers are kept in a registry
+    keyed by (source, target, always_xy), so PROJ is only initialized once
+    for each pair.
+
+    Args:
+        source_crs (str): Source CRS (i.e. "EPSG:4326")
+        target_crs (str): Target CRS
+        always_xy (bool, optional): Use the x, y (lon, lat) axis order for
+        every CRS instead of the order of its definition. Defaults to True.
+
+    Returns:
+        Transformer: pyproj transformer
+    """
+    return Transformer.from_crs(CRS.from_user_input(source_crs),
+                                CRS.from_user_input(target_crs),
+                                always_xy=always_xy)
+
+
+def transform_points(x: np.ndarray,
+                     y: np.ndarray,
+                     source_crs: str,
+                     target_crs: str) -> tuple:
+    """Transform arrays of x, y (lon, lat) coordinates in a single call
+
+    Args:
+        x (np.ndarray): x or lon coordinates
+        y (np.ndarray): y or lat coordinates
+        source_crs (str): Source CRS
+        target_crs (str): Target CRS
+
+    Returns:
+        tuple: Transformed (x, y) arrays with the input shape
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    return get_transformer(source_crs, target_crs).transform(x, y)
 
 
 def latlon_to_utm(lon: list,
                   lat: list,
                   target: str) -> tuple:
+    # Returns the (easting, northing) coordinates
     transformer = get_transformer("EPSG:4326", target)
-    lat_utm, lon_utm = transformer.transform(lat, lon)
+    lat_utm, lon_utm = transformer.transform(lon, lat)
     return lat_utm, lon_utm
 
 
 def utm_to_latlon(x: list,
                   y: list,
                   source: str) -> tuple:
+    # The easting is given in y and the northing in x. Returns (lat, lon)
     transformer = get_transformer(source, "EPSG:4326")
-    lat_utm, lon_utm = transformer.transform(y, x)
-    return lat_utm, lon_utm
-
-
-
+    lon, lat = transformer.transform(y, x)
+    return lat, lon
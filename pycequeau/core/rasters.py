@@ -0,0 +1,326 @@
+from __future__ import annotations
+
+import os
+import json
+import hashlib
+import numpy as np
+from affine import Affine
+from osgeo import gdal, gdal_array
+
+# Rasters shared between processes. The keys are the source paths and the
+# values the memory mapped .npy files holding their first band.
+_shared = {}
+
+
+class RasterArray:
+    def __init__(self,
+                 array: np.ndarray,
+                 geotransform: tuple,
+                 projection: str,
+                 nodata: float = None) -> None:
+        """First band of a raster together with its georeference
+
+        The array can be a read-only memory map, so the functions using it
+        must not modify it in place.
+
+        Args:
+            array (np.ndarray): Raster values
+            geotransform (tuple): GDAL geotransform
+            projection (str): Projection as WKT
+            nodata (float, optional): No data value. Defaults to None.
+        """
+        self.array = array
+        self.geotransform = tuple(geotransform)
+        self.projection = projection
+        self.nodata = nodata
+
+    @property
+    def affine(self) -> Affine:
+        return Affine.from_gdal(*self.geotransform)
+
+    @property
+    def shape(self) -> tuple:
+        return self.array.shape
+
+    @property
+    def valid(self) -> np.ndarray:
+        """Mask of the cells with data"""
+        if self.nodata is None:
+            return np.ones(self.shape, dtype=bool)
+        return self.array != self.nodata
+
+    def window(self, xoff: int, yoff: int, xsize: int, ysize: int) -> RasterArray:
+        """Subset of the raster with the corresponding georeference"""
+        gt = self.geotransform
+        return RasterArray(self.array[yoff:yoff+ysize, xoff:xoff+xsize],
+                           (gt[0] + xoff*gt[1], gt[1], gt[2],
+                            gt[3] + yoff*gt[5], gt[4], gt[5]),
+                           self.projection,
+                           self.nodata)
+
+    def extent_window(self, extent: tuple, halo: int = 1) -> tuple:
+        """Pixel window (xoff, yoff, xsize, ysize) covering the given extent
+
+        Args:
+            extent (tuple): (xmin, xmax, ymin, ymax)
+            halo (int, optional): Extra pixels on each side. Defaults to 1.
+
+        Returns:
+            tuple: Pixel window clipped to the raster
+        """
+        xmin, xmax, ymin, ymax = extent
+        gt = self.geotransform
+        col_min = int(np.floor((xmin - gt[0])/gt[1])) - halo
+        col_max = int(np.ceil((xmax - gt[0])/gt[1])) + halo
+        row_min = int(np.floor((ymax - gt[3])/gt[5])) - halo
+        row_max = int(np.ceil((ymin - gt[3])/gt[5])) + halo
+        col_min, row_min = max(col_min, 0), max(row_min, 0)
+        col_max = min(col_max, self.shape[1])
+        row_max = min(row_max, self.shape[0])
+        return col_min, row_min, col_max - col_min, row_max - row_min
+
+    def same_grid(self, other: RasterArray) -> bool:
+        return (self.shape == other.shape and
+                np.allclose(self.geotransform, other.geotransform))
+
+    def resample(self, geotransform: tuple, shape: tuple) -> np.ndarray:
+        """Nearest neighbour values at the cell centres of another grid
+
+        Args:
+            geotransform (tuple): GDAL geotransform of the target grid
+            shape (tuple): Shape of the target grid
+
+        Returns:
+            np.ndarray: Values on the target grid (float64, nan out of the
+            raster and on the no data cells)
+        """
+        gt = self.geotransform
+        x = geotransform[0] + (np.arange(shape[1]) + 0.5)*geotransform[1]
+        y = geotransform[3] + (np.arange(shape[0]) + 0.5)*geotransform[5]
+        cols = np.floor((x - gt[0])/gt[1]).astype(np.int64)
+        rows = np.floor((y - gt[3])/gt[5]).astype(np.int64)
+        col_in = (cols >= 0) & (cols < self.shape[1])
+        row_in = (rows >= 0) & (rows < self.shape[0])
+        values = np.full(shape, np.nan)
+        values[np.ix_(row_in, col_in)] = self.array[np.ix_(rows[row_in], cols[col_in])]
+        if self.nodata is not None:
+            values[values == self.nodata] = np.nan
+        return values
+
+    def to_dataset(self, path: str = "", driver: str = "MEM",
+                   options: list = None) -> gdal.Dataset:
+        """Create a gdal dataset with the raster values
+
+        Args:
+            path (str, optional): Output path. Defaults to "".
+            driver (str, optional): GDAL driver. Defaults to "MEM".
+            options (list, optional): Creation options. Defaults to None.
+
+        Returns:
+            gdal.Dataset: Dataset with the same georeference
+        """
+        array = np.asarray(self.array)
+        dataset = gdal.GetDriverByName(driver).Create(
+            path, array.shape[1], array.shape[0], 1,
+            gdal_array.NumericTypeCodeToGDALTypeCode(array.dtype),
+            options=options or [])
+        dataset.SetGeoTransform(self.geotransform)
+        dataset.SetProjection(self.projection)
+        band = dataset.GetRasterBand(1)
+        if self.nodata is not None:
+            band.SetNoDataValue(float(self.nodata))
+        band.WriteArray(array)
+        band.FlushCache()
+        return dataset
+
+
+def read_raster(path: str, window: tuple = None) -> RasterArray:
+    """Read the first band of a raster file
+
+    Args:
+        path (str): Raster path
+        window (tuple, optional): Pixel window (xoff, yoff, xsize, ysize) to
+        read. Defaults to None (whole raster).
+
+    Returns:
+        RasterArray: Raster values and georeference
+    """
+    if path in _shared:
+        raster = open_shared_raster(_shared[path])
+        return raster if window is None else raster.window(*window)
+    dataset = gdal.Open(path, gdal.GA_ReadOnly)
+    band = dataset.GetRasterBand(1)
+    raster = RasterArray(None,
+                         dataset.GetGeoTransform(),
+                         dataset.GetProjection(),
+                         band.GetNoDataValue())
+    if window is None:
+        raster.array = band.ReadAsArray()
+        return raster
+    raster = raster.window(*window)
+    raster.array = band.ReadAsArray(*window)
+    return raster
+
+
+def raster_info(path: str) -> RasterArray:
+    """Georeference, shape and no data value of a raster without reading
+    its values. The shared rasters are described from their memory map, so
+    the source file is not opened again. The array is a read-only
+    placeholder of zeros.
+
+    Args:
+        path (str): Raster path
+
+    Returns:
+        RasterArray: Raster with a placeholder array
+    """
+    if path in _shared:
+        raster = open_shared_raster(_shared[path])
+        shape = raster.shape
+    else:
+        dataset = gdal.Open(path, gdal.GA_ReadOnly)
+        band = dataset.GetRasterBand(1)
+        raster = RasterArray(None,
+                             dataset.GetGeoTransform(),
+                             dataset.GetProjection(),
+                             band.GetNoDataValue())
+        shape = (dataset.RasterYSize, dataset.RasterXSize)
+    raster.array = np.broadcast_to(np.uint8(0), shape)
+    return raster
+
+
+def raster_window(path: str, extent: tuple, halo: int = 1) -> tuple:
+    """Pixel window of a raster file covering the given extent"""
+    return raster_info(path).extent_window(extent, halo)
+
+
+def write_raster(path: str,
+                 raster: RasterArray,
+                 driver: str = "GTiff",
+                 options: list = None) -> None:
+    """Write a raster with its georeference
+
+    Args:
+        path (str): Output path
+        raster (RasterArray): Raster to write
+        driver (str, optional): GDAL driver. Defaults to "GTiff".
+        options (list, optional): Creation options. Defaults to None.
+    """
+    if driver == "GTiff" and options is None:
+        options = ["COMPRESS=DEFLATE", "TILED=YES"]
+    dataset = raster.to_dataset(path, driver, options)
+    dataset.FlushCache()
+    dataset = None
+
+
+def share_raster(path: str, folder: str) -> str:
+    """Dump the raster as a .npy file that can be memory mapped by several
+    processes. The georeference is stored in a json file with the same name.
+    The file is only written once for each source raster.
+
+    Args:
+        path (str): Raster path
+        folder (str): Folder where the shared files are stored
+
+    Returns:
+        str: Path to the .npy file
+    """
+    key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(path))[0]
+    npy_path = os.path.join(folder, f"{name}_{key}.npy")
+    if os.path.exists(npy_path) and os.path.getmtime(npy_path) >= os.path.getmtime(path):
+        return npy_path
+    dataset = gdal.Open(path, gdal.GA_ReadOnly)
+    band = dataset.GetRasterBand(1)
+    np.save(npy_path, band.ReadAsArray())
+    with open(npy_path.replace(".npy", ".json"), "w") as outfile:
+        json.dump({"geotransform": dataset.GetGeoTransform(),
+                   "projection": dataset.GetProjection(),
+                   "nodata": band.GetNoDataValue()}, outfile)
+    return npy_path
+
+
+def open_shared_raster(npy_path: str) -> RasterArray:
+    """Open a raster dumped by share_raster as a read-only memory map
+
+    Args:
+        npy_path (str): Path to the .npy file
+
+    Returns:
+        RasterArray: Memory mapped raster
+    """
+    with open(npy_path.replace(".npy", ".json"), "r") as f:
+        meta = json.load(f)
+    return RasterArray(np.load(npy_path, mmap_mode="r"),
+                       meta["geotransform"],
+                       meta["projection"],
+                       meta["nodata"])
+
+
+def register_shared(sources: dict) -> None:
+    """Register the shared rasters in the current process. This is used as
+    initializer of the worker processes.
+
+    Args:
+        sources (dict): Source raster path -> .npy path
+    """
+    _shared.update(sources)
+
+
+class RasterCache:
+    def __init__(self) -> None:
+        """Keeps the rasters read by a Basin object so each one is read once.
+        The rasters shared between processes are memory maps, so getting
+        them does not load them."""
+        self._rasters = {}
+
+    def get(self, path: str) -> RasterArray:
+        """Whole raster, read the first time it is needed"""
+        if path not in self._rasters:
+            self._rasters[path] = read_raster(path)
+        return self._rasters[path]
+
+    def window(self, path: str, extent: tuple, halo: int = 1) -> RasterArray:
+        """Part of the raster covering the extent. Only the window is read,
+        unless the whole raster is already in the cache.
+
+        Args:
+            path (str): Raster path
+            extent (tuple): (xmin, xmax, ymin, ymax)
+            halo (int, optional): Extra pixels on each side. Defaults to 1.
+
+        Returns:
+            RasterArray: Window of the raster
+        """
+        if path in self._rasters:
+            raster = self._rasters[path]
+            return raster.window(*raster.extent_window(extent, halo))
+        return read_raster(path, raster_window(path, extent, halo))
+
+    def lazy(self, path: str) -> str | RasterArray:
+        """Raster for the functions that read it by feature windows (zonal
+        statistics, land cover): the raster when it is in the cache or
+        shared (memory map), otherwise the path so only the windows of the
+        features are read from the file.
+
+        Args:
+            path (str): Raster path
+
+        Returns:
+            str | RasterArray: Raster or raster path
+        """
+        if path in self._rasters or path in _shared:
+            return self.get(path)
+        return path
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._rasters
+
+    def add(self, path: str, raster: RasterArray) -> None:
+        self._rasters[path] = raster
+
+    def discard(self, path: str) -> None:
+        self._rasters.pop(path, None)
+
+    def clear(self) -> None:
+        self._rasters = {}
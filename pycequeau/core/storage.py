@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import os
+import shutil
+import geopandas as gpd
+from osgeo import gdal
+
+# Intermediate formats for the CE/CP fishnets. Each entry gives the file
+# extension and the driver used by geopandas to write it. The memory format
+# keeps the fishnets as GeoDataFrames and never touches the disk.
+__formats__ = {
+    "memory": ("", None),
+    "parquet": (".parquet", None),
+    "fgb": (".fgb", "FlatGeobuf"),
+    "gpkg": (".gpkg", "GPKG"),
+    "shp": (".shp", "ESRI Shapefile"),
+}
+# The bbox covering of GeoParquet is written from geopandas 1.0 and the
+# FlatGeobuf driver is available from GDAL 3.1
+_covering_bbox = int(gpd.__version__.split(".")[0]) >= 1
+_flatgeobuf = int(gdal.VersionInfo()) >= 3010000
+# Files of the fishnets exported with Basin.export_fishnets (or written by
+# the versions before the storage backend). They are read when the fishnet
+# is not in the storage, i.e. for the projects built with shapefiles.
+__exported__ = [".shp", ".gpkg", ".fgb"]
+# Sidecar files of a shapefile
+__shp_sidecars__ = [".shp", ".shx", ".dbf", ".prj", ".cpg"]
+
+
+def _remove_file(path: str) -> None:
+    # Remove a fishnet file with all the sidecars of a shapefile
+    if path.endswith(".shp"):
+        for ext in __shp_sidecars__:
+            sidecar = path[:-len(".shp")] + ext
+            if os.path.exists(sidecar):
+                os.remove(sidecar)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class FishnetStorage:
+    def __init__(self,
+                 folder: str,
+                 fmt: str = "parquet",
+                 spatial_index: bool = False) -> None:
+        """Storage backend for the intermediate fishnets of the Basin object
+
+        The fishnets are exchanged between the pipeline stages through this
+        object. The default format is GeoParquet, which keeps the full column
+        names and types and is much faster than shapefiles. FlatGeobuf and
+        GeoPackage are also available when a spatial index is needed. With the
+        "memory" format the fishnets are handed between stages as
+        GeoDataFrames and nothing is written.
+
+        The bbox covering of GeoParquet needs geopandas >= 1.0. With older
+        versions the parquet files are written without it. FlatGeobuf needs
+        GDAL >= 3.1.
+
+        When a fishnet is not in the storage, the exported fishnet
+        (geographic/<name>.shp, .gpkg or .fgb) is read instead, so the
+        projects built before the storage backend can still be used.
+
+        Args:
+            folder (str): Folder where the fishnets are stored
+            fmt (str, optional): Storage format. Defaults to "parquet".
+            spatial_index (bool, optional): Write a spatial index along the
+            fishnets (bbox covering for GeoParquet). Defaults to False.
+        """
+        if fmt not in __formats__:
+            raise ValueError(
+                f"Storage format {fmt} not supported. Use one of: {list(__formats__)}")
+        if fmt == "fgb" and not _flatgeobuf:
+            raise ValueError(
+                f"The fgb format needs GDAL >= 3.1 (installed: {gdal.__version__}). "
+                "Use the parquet or gpkg format instead")
+        self.folder = folder
+        self.fmt = fmt
+        self.spatial_index = spatial_index
+        # Fishnets kept when the memory format is used
+        self._fishnets = {}
+
+    @property
+    def in_memory(self) -> bool:
+        return self.fmt == "memory"
+
+    def path(self, name: str) -> str:
+        """Path of the stored fishnet
+
+        Args:
+            name (str): Fishnet name (i.e. CE_fishnet)
+
+        Returns:
+            str: Full path to the fishnet file
+        """
+        if self.in_memory:
+            return "memory:" + name
+        return os.path.join(self.folder, name + __formats__[self.fmt][0])
+
+    def _exported_path(self, name: str) -> str | None:
+        # First exported fishnet found in the storage folder
+        for ext in __exported__:
+            path = os.path.join(self.folder, name + ext)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def exists(self, name: str) -> bool:
+        if self.in_memory and name in self._fishnets:
+            return True
+        if not self.in_memory and os.path.exists(self.path(name)):
+            return True
+        return self._exported_path(name) is not None
+
+    def write(self, gdf: gpd.GeoDataFrame, name: str) -> None:
+        """Write the fishnet in the storage format
+
+        The index is not stored to keep the same behaviour as the shapefile
+        round trip, which always gives back a range index.
+
+        Args:
+            gdf (gpd.GeoDataFrame): Fishnet to store
+            name (str): Fishnet name
+        """
+        self.remove(name)
+        if self.in_memory:
+            self._fishnets[name] = gdf.reset_index(drop=True)
+            return
+        path = self.path(name)
+        if self.fmt == "parquet":
+            if self.spatial_index and _covering_bbox:
+                gdf.to_parquet(path, index=False, write_covering_bbox=True)
+            else:
+                gdf.to_parquet(path, index=False)
+        elif self.fmt == "fgb":
+            gdf.to_file(path, driver="FlatGeobuf",
+                        SPATIAL_INDEX="YES" if self.spatial_index else "NO")
+        else:
+            gdf.to_file(path, driver=__formats__[self.fmt][1])
+
+    def read(self, name: str) -> gpd.GeoDataFrame:
+        """Read the stored fishnet
+
+        Args:
+            name (str): Fishnet name
+
+        Returns:
+            gpd.GeoDataFrame: Stored fishnet
+        """
+        if self.in_memory and name in self._fishnets:
+            # The stages modify the fishnets in place, so a copy is returned
+            return self._fishnets[name].copy()
+        path = self.path(name)
+        if not self.in_memory and os.path.exists(path):
+            if self.fmt == "parquet":
+                return gpd.read_parquet(path)
+            return gpd.read_file(path)
+        # Fishnet exported by a previous run
+        path = self._exported_path(name)
+        if path is None:
+            raise FileNotFoundError(f"The fishnet {name} has not been created")
+        return gpd.read_file(path)
+
+    def remove(self, name: str) -> None:
+        if self.in_memory:
+            self._fishnets.pop(name, None)
+            return
+        _remove_file(self.path(name))
+
+    def export(self,
+               name: str,
+               out_path: str,
+               driver: str = "ESRI Shapefile") -> None:
+        """Export the stored fishnet in another format (i.e shapefile)
+
+        Args:
+            name (str): Fishnet name
+            out_path (str): Path of the exported file
+            driver (str, optional): OGR driver. Defaults to "ESRI Shapefile".
+        """
+        if os.path.abspath(out_path) == os.path.abspath(self.path(name)):
+            # The fishnet is already stored there (i.e. shp storage)
+            return
+        fishnet = self.read(name)
+        _remove_file(out_path)
+        fishnet.to_file(out_path, driver=driver)
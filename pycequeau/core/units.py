@@ -1,102 +1,92 @@
-from pyproj import Proj
+from __future__ import annotations
+
 import xarray as xr
 import numpy as np
-import pandas as pd
 
+# Conversion of the source variables to the CEQUEAU variables:
+# source name -> (CEQUEAU name, scale, offset, units, long name).
+# The values are converted as scale*x + offset.
+__ERA__ = {
+    # from m d-1 to mm d-1
+    "tp": ("pTot", 1e3, 0.0, "mm d-1", "Total precipitation"),
+    # from W m-2 to MJ m2 d-1
+    "ssr": ("rayonnement", 0.0864, 0.0, "MJ m-2 d-1", "Surface solar radiation"),
+    # from m s-1 to km h-1
+    "wind": ("vitesseVent", 3.6, 0.0, "km h-1", "Wind speed"),
+    "tcc": ("nebulosite", 1.0, 0.0, "0-1", "Cloud cover"),
+    # from Pa to mmHg
+    "vp": ("pression", 7.50062e-3, 0.0, "mmHg", "Vapor pressure"),
+    # from K to degC
+    "tmax": ("tMax", 1.0, -273.15, "C", "Maximum daily air temperature"),
+    "tmin": ("tMin", 1.0, -273.15, "C", "Minimum daily air temperature"),
+}
+__CORDEX__ = {
+    # from kg m-2 s-1 to mm d-1
+    "pr": ("pTot", 86400.0, 0.0, "mm d-1", "Total precipitation"),
+    # from W m-2 to MJ m2 d-1
+    "rsds": ("rayonnement", 0.0864, 0.0, "MJ m-2 d-1", "Surface solar radiation"),
+    # from m s-1 to km h-1
+    "sfcWind": ("vitesseVent", 3.6, 0.0, "km h-1", "Wind speed"),
+    # from % to 0-1
+    "clt": ("nebulosite", 0.01, 0.0, "0-1", "Cloud cover"),
+    # from Pa to mmHg
+    "vp": ("pression", 7.50062e-3, 0.0, "mmHg", "Vapor pressure"),
+    # from K to degC
+    "tasmax": ("tMax", 1.0, -273.15, "C", "Maximum daily air temperature"),
+    "tasmin": ("tMin", 1.0, -273.15, "C", "Minimum daily air temperature"),
+}
+
+
+def convert_variable(da: xr.DataArray,
+                     conversion: tuple) -> xr.DataArray:
+    """Convert a variable to the CEQUEAU units in float32. The operations
+    are xarray arithmetic, so a dask backed variable stays lazy and is
+    converted chunk by chunk when it is computed.
+
+    Args:
+        da (xr.DataArray): Source variable
+        conversion (tuple): (name, scale, offset, units, long name)
+
+    Returns:
+        xr.DataArray: Converted variable with the conversion in its attributes
+    """
+    name, scale, offset, units, long_name = conversion
+    converted = da.astype(np.float32)
+    if scale != 1.0:
+        converted = converted*np.float32(scale)
+    if offset != 0.0:
+        converted = converted + np.float32(offset)
+    converted.attrs = dict(units=units,
+                           long_name=long_name,
+                           source_name=da.name,
+                           source_units=da.attrs.get("units", ""),
+                           conversion=f"{scale}*x{offset:+}")
+    return converted.rename(name)
 
-def units_CORDEX(ds: xr.Dataset):
-    var_name = list(ds.keys())[0]
-    if var_name == "pr":
-        # from m d-1 to mm d-1
-        ds[var_name].attrs = dict(units="mm d-1",
-                                  long_name="Total precipitation")
-        # ds[var_name].values = 86400*ds[var_name].values
-        ds = ds.rename({var_name: "pTot"})
-    if var_name == "rsds":
-        # from W m-2 to MJ m2 d-1
-        ds[var_name].attrs = dict(units="MJ m-2 d-1",
-                                  long_name="Surface solar radiation")
-        # ds[var_name].values = 0.0864*ds[var_name].values
-        ds = ds.rename({var_name: "rayonnement"})
-    if var_name == "sfcWind":
-        # from m s-1 to km h-1
-        ds[var_name].attrs = dict(units="km h-1",
-                                  long_name="Wind speed")
-        # ds[var_name].values = 3.6*ds[var_name].values
-        ds = ds.rename({var_name: "vitesseVent"})
-    if var_name == "clt":
-        ds[var_name].attrs = dict(units="0-1",
-                                  long_name="Cloud cover")
-        ds[var_name].values = ds[var_name].values/100
-        ds = ds.rename({var_name: "nebulosite"})
-        
-    if var_name == "vp":
-        # from kPa to mmHg 7.50062
-        # ds[var_name] = ds[var_name].transpose("time","lat","lon")
-        ds[var_name].attrs = dict(units="mmHg",
-                                  long_name="Vapor pressure")
-        ds = ds.rename({var_name: "pression"})
-        # ds[var_name].attrs = dict(units="mmHg",
-        #                            long_name="Vapor pressure")
-        # ds[var_name].values = 7.50062e-3*ds[var_name].values
-    if var_name == "tasmin" or var_name == "tasmax":
-        # from K to degC
-        if var_name == "tasmax":
-            long_name = "Maximum daily air temperature"
-            ds = ds.rename({var_name: "tMax"})
-            var_name = "tMax"
-        else:
-            long_name = "Minimum daily air temperature"
-            ds = ds.rename({var_name: "tMin"})
-            var_name = "tMin"
-        ds[var_name].attrs = dict(units="C",
-                                  long_name=long_name)
-        # ds[var_name].values = ds[var_name].values - 273.15
-    return ds
 
+def convert_units(ds: xr.Dataset, registry: dict) -> xr.Dataset:
+    """Rename and convert the variables found in the registry. The other
+    variables are kept unchanged.
 
-def units_ERA(ds: xr.Dataset):
-    # List the variable names
-    var_name = list(ds.keys())[0]
-    if var_name == "tp":
-        # from m d-1 to mm d-1
-        ds[var_name].attrs = dict(units="mm d-1",
-                                  long_name="Total precipitation")
-        ds[var_name].values = 1e3*ds[var_name].values
-        ds = ds.rename({var_name: "pTot"})
-    if var_name == "ssr":
-        # from W m-2 to MJ m2 d-1
-        ds[var_name].attrs = dict(units="MJ m-2 d-1",
-                                  long_name="Surface solar radiation")
-        ds[var_name].values = 0.0864*ds[var_name].values
-        ds = ds.rename({var_name: "rayonnement"})
-    if var_name == "wind":
-        # from m s-1 to km h-1
-        ds[var_name].attrs = dict(units="km h-1",
-                                  long_name="Wind speed")
-        ds[var_name].values = 3.6*ds[var_name].values
-        ds = ds.rename({var_name: "vitesseVent"})
-    if var_name == "tcc":
-        ds[var_name].attrs = dict(units="0-1",
-                                  long_name="Cloud cover")
-        ds = ds.rename({var_name: "nebulosite"})
-    if var_name == "vp":
-        # from kPa to mmHg 7.50062
-        ds[var_name].attrs = dict(units="mmHg",
-                                  long_name="Vapor pressure")
-        ds[var_name].values = 7.50062e-3*ds[var_name].values
-        ds = ds.rename({var_name: "pression"})
-    if var_name == "tmax" or var_name == "tmin":
-        # from K to degC
-        if var_name == "tmax":
-            long_name = "Maximum daily air temperature"
-            ds = ds.rename({var_name: "tMax"})
-            var_name = "tMax"
+    Args:
+        ds (xr.Dataset): Source dataset
+        registry (dict): Conversions (i.e. __ERA__ or __CORDEX__)
+
+    Returns:
+        xr.Dataset: Dataset with the CEQUEAU variables
+    """
+    data_vars = {}
+    for var_name, da in ds.data_vars.items():
+        if var_name in registry:
+            data_vars[registry[var_name][0]] = convert_variable(da, registry[var_name])
         else:
-            long_name = "Minimum daily air temperature"
-            ds = ds.rename({var_name: "tMin"})
-            var_name = "tMin"
-        ds[var_name].attrs = dict(units="C",
-                                  long_name=long_name)
-        ds[var_name].values = ds[var_name].values - 273.15
-    return ds
+            data_vars[var_name] = da
+    return xr.Dataset(data_vars, coords=ds.coords, attrs=ds.attrs)
+
+
+def units_CORDEX(ds: xr.Dataset) -> xr.Dataset:
+    return convert_units(ds, __CORDEX__)
+
+
+def units_ERA(ds: xr.Dataset) -> xr.Dataset:
+    return convert_units(ds, __ERA__)
@@ -7,7 +7,11 @@ import pandas as pd
 import geopandas as gpd
 from shapely.geometry import Polygon, MultiPolygon
 from shapely.validation import make_valid
+from shapely import wkb
 from math import ceil
+import rasterstats as rs
+from pycequeau.core import rasters
+from pycequeau.core.rasters import RasterArray
 # from pycequeau.meteo.base import MeteoStation
 # from pycequeau.core import projections
 # from pycequeau.physiographic.base import Basin
@@ -55,20 +59,94 @@ def drop_duplicated_geometries(geoseries: gpd.GeoSeries):
 
 
 
-def rasterize_shp(grid_shp: str,
-                   ref_name: str,
+def gdf_to_ogr(gdf: gpd.GeoDataFrame,
+               fields: list) -> ogr.DataSource:
+    """Create an in-memory OGR datasource from a GeoDataFrame
+
+    Only the given fields are copied. This is used to rasterize the fishnets
+    with gdal without writing them to disk.
+
+    Args:
+        gdf (gpd.GeoDataFrame): Input geodataframe
+        fields (list): Numeric fields to copy in the OGR layer
+
+    Returns:
+        ogr.DataSource: In-memory datasource with one layer
+    """
+    srs = None
+    if gdf.crs is not None:
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(gdf.crs.to_wkt())
+    ds = ogr.GetDriverByName("MEMORY").CreateDataSource("")
+    lyr = ds.CreateLayer("layer", srs, ogr.wkbUnknown)
+    for field in fields:
+        lyr.CreateField(ogr.FieldDefn(field, ogr.OFTReal))
+    featureDefn = lyr.GetLayerDefn()
+    values = [gdf[field].values for field in fields]
+    for count, geometry in enumerate(gdf.geometry.values):
+        if geometry is None:
+            continue
+        feat = ogr.Feature(featureDefn)
+        feat.SetGeometry(ogr.CreateGeometryFromWkb(geometry.wkb))
+        for field, value in zip(fields, values):
+            if not pd.isnull(value[count]):
+                feat.SetField(field, float(value[count]))
+        lyr.CreateFeature(feat)
+        feat = None
+    return ds
+
+
+def layer_to_gdf(lyr: ogr.Layer) -> gpd.GeoDataFrame:
+    """Convert an OGR layer into a GeoDataFrame keeping all its fields
+
+    Args:
+        lyr (ogr.Layer): Input layer
+
+    Returns:
+        gpd.GeoDataFrame: Geodataframe with the layer fields and geometries
+    """
+    fields = [field.name for field in lyr.schema]
+    records = {field: [] for field in fields}
+    geometries = []
+    lyr.ResetReading()
+    for feat in lyr:
+        for field in fields:
+            records[field].append(feat.GetField(field))
+        geometries.append(wkb.loads(bytes(feat.GetGeometryRef().ExportToWkb())))
+    srs = lyr.GetSpatialRef()
+    crs = srs.ExportToWkt() if srs is not None else None
+    return gpd.GeoDataFrame(records, geometry=geometries, crs=crs)
+
+
+def _open_vector(grid_shp: str | gpd.GeoDataFrame,
+                 field: str) -> ogr.DataSource:
+    # The grids can be given as a file or as a geodataframe
+    if isinstance(grid_shp, gpd.GeoDataFrame):
+        return gdf_to_ogr(grid_shp, [field])
+    return ogr.Open(grid_shp, gdal.GA_ReadOnly)
+
+
+def _reference(ref_name: str | RasterArray) -> RasterArray:
+    # Georeference of the reference raster. The values are not read and the
+    # shared rasters are described from their memory map
+    if isinstance(ref_name, RasterArray):
+        return ref_name
+    return rasters.raster_info(ref_name)
+
+
+def rasterize_shp(grid_shp: str | gpd.GeoDataFrame,
+                   ref_name: str | RasterArray,
                    field: str)-> np.ndarray:
     # Get raster georeference info
-    raster = gdal.Open(ref_name, gdal.GA_ReadOnly)
-    transform = raster.GetGeoTransform()
+    raster = _reference(ref_name)
+    transform = raster.geotransform
     xOrigin = transform[0]
     yOrigin = transform[3]
     pixelWidth = transform[1]
     pixelHeight = -transform[5]
-    x_res = raster.RasterXSize
-    y_res = raster.RasterYSize
+    y_res, x_res = raster.shape
     # Get shp info
-    shp = ogr.Open(grid_shp,gdal.GA_ReadOnly)
+    shp = _open_vector(grid_shp, field)
     lyr = shp.GetLayer()
     proj = lyr.GetSpatialRef()
     xmin, xmax, ymin, ymax = lyr.GetExtent()
@@ -80,8 +158,8 @@ def rasterize_shp(grid_shp: str,
     # Create the raster in the memory
     grid_raster = gdal.GetDriverByName('MEM').Create(
         '', x_res, y_res, 1, gdal.GDT_Int32)
-    grid_raster.SetGeoTransform(raster.GetGeoTransform())
-    grid_raster.SetProjection(raster.GetProjection())
+    grid_raster.SetGeoTransform(raster.geotransform)
+    grid_raster.SetProjection(raster.projection)
     band = grid_raster.GetRasterBand(1)
     band.SetNoDataValue(0)
     gdal.RasterizeLayer(grid_raster, [1], lyr, options=[
@@ -90,20 +168,19 @@ def rasterize_shp(grid_shp: str,
     data_array = band.ReadAsArray()
     return data_array
 
-def rasterize_shp_as_byte(grid_shp: str,
-                   ref_name: str, field: str, 
+def rasterize_shp_as_byte(grid_shp: str | gpd.GeoDataFrame,
+                   ref_name: str | RasterArray, field: str, 
                    name: str) -> None:
     # Get raster georeference info
-    raster = gdal.Open(ref_name, gdal.GA_ReadOnly)
-    transform = raster.GetGeoTransform()
+    raster = _reference(ref_name)
+    transform = raster.geotransform
     xOrigin = transform[0]
     yOrigin = transform[3]
     pixelWidth = transform[1]
     pixelHeight = -transform[5]
-    x_res = raster.RasterXSize
-    y_res = raster.RasterYSize
+    y_res, x_res = raster.shape
     # Get shp info
-    shp = ogr.Open(grid_shp,gdal.GA_ReadOnly)
+    shp = _open_vector(grid_shp, field)
     lyr = shp.GetLayer()
     proj = lyr.GetSpatialRef()
     xmin, xmax, ymin, ymax = lyr.GetExtent()
@@ -115,8 +192,8 @@ def rasterize_shp_as_byte(grid_shp: str,
     # Create the raster in the memory
     grid_raster = gdal.GetDriverByName('GTiff').Create(
         name, x_res, y_res, 1, gdal.GDT_Byte)
-    grid_raster.SetGeoTransform(raster.GetGeoTransform())
-    grid_raster.SetProjection(raster.GetProjection())
+    grid_raster.SetGeoTransform(raster.geotransform)
+    grid_raster.SetProjection(raster.projection)
     band = grid_raster.GetRasterBand(1)
     band.SetNoDataValue(0)
     gdal.RasterizeLayer(grid_raster, [1], lyr, options=[
@@ -195,19 +272,44 @@ def regrid_CE(raster: gdal.Dataset,
     return mem_ds
 
 
+def zonal_stats(gdf: gpd.GeoDataFrame,
+                raster: str | RasterArray,
+                stats: list) -> list:
+    """Zonal statistics from a raster file or from an already read raster
+
+    Args:
+        gdf (gpd.GeoDataFrame): Zones
+        raster (str | RasterArray): Raster path or raster values
+        stats (list): Statistics to compute (i.e. ['max'])
+
+    Returns:
+        list: One dictionary of statistics per zone
+    """
+    if isinstance(raster, RasterArray):
+        return rs.zonal_stats(gdf, raster.array,
+                              affine=raster.affine,
+                              nodata=raster.nodata,
+                              stats=stats)
+    return rs.zonal_stats(gdf, raster, stats=stats)
+
+
 def rasterize_feature(gdf: gpd.GeoDataFrame,
-                      raster_name: str,
+                      raster_name: str | RasterArray,
                       att: str) -> np.ndarray:
     # Get raster georeference info
-    raster = gdal.Open(raster_name,gdal.GA_ReadOnly)
-    transform = raster.GetGeoTransform()
+    if isinstance(raster_name, RasterArray):
+        raster = None
+        transform = raster_name.geotransform
+        projection = raster_name.projection
+    else:
+        raster = gdal.Open(raster_name,gdal.GA_ReadOnly)
+        transform = raster.GetGeoTransform()
+        projection = raster.GetProjection()
     xOrigin = transform[0]
     yOrigin = transform[3]
     pixelWidth = transform[1]
     pixelHeight = -transform[5]
     # yOrigin1 = yOrigin + pixelHeight[5] * raster.RasterYSize
-    # Get no data value
-    no_data = raster.GetRasterBand(1).GetNoDataValue()
     # xmin, ymin, xmax, ymax = gdf.bounds
 
     # Specify offset and rows and columns to read
@@ -217,7 +319,7 @@ def rasterize_feature(gdf: gpd.GeoDataFrame,
     ycount = int((gdf['maxy'] - gdf['miny'])/pixelHeight)
 
     # Get the projection
-    proj = osr.SpatialReference(wkt=raster.GetProjection())
+    proj = osr.SpatialReference(wkt=projection)
     # create the spatial reference system, WGS84
     srs = osr.SpatialReference()
     epsg = int(proj.GetAttrValue('AUTHORITY', 1))
@@ -257,11 +359,24 @@ def rasterize_feature(gdf: gpd.GeoDataFrame,
     bandmask = target_ds.GetRasterBand(1)
     datamask = bandmask.ReadAsArray()
     
-    banddataraster = raster.GetRasterBand(1)
-    no_data = raster.GetRasterBand(1).GetNoDataValue()
-    # Mask array based on the nondata value
-    dataraster = banddataraster.ReadAsArray(
-        xoff, yoff, xcount, ycount)
+    # Read only the window of the feature, clipped to the raster. The cells
+    # of the window outside the raster are 0
+    if raster is None:
+        rows, cols = raster_name.shape
+    else:
+        rows, cols = raster.RasterYSize, raster.RasterXSize
+    row_min, row_max = max(yoff, 0), min(yoff + ycount, rows)
+    col_min, col_max = max(xoff, 0), min(xoff + xcount, cols)
+    dataraster = np.zeros((max(ycount, 0), max(xcount, 0)))
+    if row_max > row_min and col_max > col_min:
+        if raster is None:
+            part = raster_name.array[row_min:row_max, col_min:col_max]
+        else:
+            banddataraster = raster.GetRasterBand(1)
+            part = banddataraster.ReadAsArray(
+                col_min, row_min, col_max - col_min, row_max - row_min)
+        dataraster = dataraster.astype(part.dtype)
+        dataraster[row_min-yoff:row_max-yoff, col_min-xoff:col_max-xoff] = part
     # masked_dataraster = np.ma.masked_where(dataraster==no_data,dataraster)
     # Change 
     # np.set_printoptions(threshold=sys.maxsize)
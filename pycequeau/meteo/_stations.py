@@ -8,48 +8,61 @@ from pycequeau.core import projections
 from pycequeau.core import utils as u
 
 
+def gather_CE_values(da: xr.DataArray,
+                     rows: np.ndarray,
+                     cols: np.ndarray,
+                     out: np.ndarray = None) -> np.ndarray:
+    """Values of a (time, j, i) variable at the CE positions, selected for
+    all the CEs at once
+
+    Args:
+        da (xr.DataArray): Variable on the CE grid
+        rows (np.ndarray): Row (j - 10) of each CE
+        cols (np.ndarray): Column (i - 10) of each CE
+        out (np.ndarray, optional): (time, CE) float32 array to fill.
+        Defaults to None.
+
+    Returns:
+        np.ndarray: (time, CE) values in float32
+    """
+    _, row_dim, col_dim = da.dims
+    points = da.isel({row_dim: xr.DataArray(rows, dims="CEid"),
+                      col_dim: xr.DataArray(cols, dims="CEid")})
+    if out is None:
+        out = np.empty(points.shape, dtype=np.float32)
+    out[...] = points.values
+    return out
+
+
 def create_grid_var(ds: xr.Dataset,
                     rows: np.ndarray,
                     cols: np.ndarray,
                     CEs: np.ndarray,
                     var_name: str,
-                    datenum: list) -> xr.Dataset:
-    """_summary_
-    j, i,
+                    datenum: np.ndarray) -> xr.Dataset:
+    """Variable of the CEQUEAU meteo grid (pasTemp, CEid)
+
     Args:
-        ds (xr.Dataset): _description_
-        idx (np.ndarray): _description_
-        idy (np.ndarray): _description_
-        CEs (np.ndarray): _description_
-        var_name (str): _description_
-        datenum (list): _description_
+        ds (xr.Dataset): Dataset on the CE grid (time, j, i)
+        rows (np.ndarray): Row (j - 10) of each CE
+        cols (np.ndarray): Column (i - 10) of each CE
+        CEs (np.ndarray): CE ids
+        var_name (str): Variable name
+        datenum (np.ndarray): Datenum of each time step
 
     Returns:
-        xr.Dataset: _description_
+        xr.Dataset: Dataset with the variable
     """
-
-    dr = xr.Dataset(
+    return xr.Dataset(
         data_vars={
-            var_name: (
-                ["pasTemp", "CEid"], np.zeros(
-                    [len(datenum), len(CEs)]).astype(np.float32)
-            )
+            var_name: (["pasTemp", "CEid"],
+                       gather_CE_values(ds[var_name], rows, cols))
         },
         coords={
             "CEid": CEs.astype(np.int32),
             "pasTemp": datenum
         }
     )
-    # this is for getting the CE number
-    count = 0
-    for i,j in zip(cols,rows):
-        # Place the value in the new matrix
-        dr[var_name][:,count] = ds[var_name][:,j,i].values.astype(np.float32)
-        count += 1
-    # print(ds[var_name][:,i,j].values.astype(np.float32))
-    # print(dr[var_name][:,count].values)
-    # print(dr)
-    return dr
 
 
 def interpolation_netCDF(ds: xr.Dataset,
@@ -72,11 +85,12 @@ def interpolation_netCDF(ds: xr.Dataset,
         # correct = 360
         table["lon"] = table["lon"] + 360
 
-    # Create objective
-    i_res = CEregrid.ReadAsArray().shape[1]
-    j_res = CEregrid.ReadAsArray().shape[0]
-    i = np.linspace(0, i_res, i_res, dtype=np.int8)+10
-    j = np.linspace(0, j_res, j_res, dtype=np.int8)+10
+    # Create objective. The CE grid is read only once
+    CE_array = CEregrid.ReadAsArray()
+    i_res = CE_array.shape[1]
+    j_res = CE_array.shape[0]
+    i = np.linspace(0, i_res, i_res, dtype=np.int64)+10
+    j = np.linspace(0, j_res, j_res, dtype=np.int64)+10
     # ig, jg = np.meshgrid(i, j, indexing="ij")
     # Check whether the longitudes need to be corrected
     if ds["lon"].max() > 0:
@@ -92,18 +106,18 @@ def interpolation_netCDF(ds: xr.Dataset,
     ds = ds.isel(lat=slice(lat_min_idx-1, lat_max_idx),
                  lon=slice(lon_min_idx, lon_max_idx+1))
     # Create reference regridder
-    x = np.linspace(min(i), max(i), len(ds["lon"].values), dtype=np.int8)
-    y = np.linspace(min(j), max(j), len(ds["lat"].values), dtype=np.int8)
+    x = np.linspace(min(i), max(i), len(ds["lon"].values), dtype=np.int64)
+    y = np.linspace(min(j), max(j), len(ds["lat"].values), dtype=np.int64)
     ds = ds.assign_coords(lat=y)
     ds = ds.assign_coords(lon=x)
     # Create mask
     dsi = ds.interp(time=ds["time"], lat=j, lon=i, method=method)
     # mask interpolated dataset
-    dsi = dsi.where(CEregrid.ReadAsArray() > 0)
+    dsi = dsi.where(CE_array > 0)
     pp = np.array(dsi["pTot"])[0, :,:]
     dsi = dsi.rename(lat="j", lon="i")
     ds = ds.rename(lat="j", lon="i")
-    dsi = _appendCEgrid(dsi, CEregrid)
+    dsi = _appendCEgrid(dsi, CE_array)
     dsi = dsi.assign_attrs(
         interpolated=f"Interpolated using the method: {method} from xr.Dataset.interp function")
     return dsi
@@ -149,6 +163,26 @@ def get_netCDF_grids(ds: xr.DataArray,
     return xypair
 
 
+def get_latlon_bounds(watershed: ogr.DataSource) -> tuple:
+    """Lat/lon bounds of the watershed extent. The corners and the middle of
+    the edges are transformed since the edges are not straight in lat/lon.
+
+    Args:
+        watershed (ogr.DataSource): Watershed shp
+
+    Returns:
+        tuple: (lat_min, lat_max, lon_min, lon_max)
+    """
+    layer = watershed.GetLayer()
+    xmin, xmax, ymin, ymax = layer.GetExtent()
+    x, y = np.meshgrid([xmin, (xmin + xmax)/2, xmax],
+                       [ymin, (ymin + ymax)/2, ymax])
+    lon, lat = projections.transform_points(x.ravel(), y.ravel(),
+                                            layer.GetSpatialRef().ExportToWkt(),
+                                            "EPSG:4326")
+    return lat.min(), lat.max(), lon.min(), lon.max()
+
+
 def create_station_table(CEregrid: gdal.Dataset,
                          DEM: gdal.Dataset,
                          lat_utm: np.ndarray,
@@ -167,8 +201,9 @@ def create_station_table(CEregrid: gdal.Dataset,
     Returns:
         pd.DataFrame: _description_
     """
-    i_res = CEregrid.ReadAsArray().shape[1]
-    j_res = CEregrid.ReadAsArray().shape[0]
+    CE_array = CEregrid.ReadAsArray()
+    i_res = CE_array.shape[1]
+    j_res = CE_array.shape[0]
     i = np.linspace(0, i_res, i_res, dtype=int)
     j = np.linspace(0, j_res, j_res, dtype=int)
     # Get raster index
@@ -182,7 +217,7 @@ def create_station_table(CEregrid: gdal.Dataset,
         "j": j[row]+10,
         "lat": xy_pair[:, 1],
         "lon": xy_pair[:, 0],
-        "CEid": CEregrid.ReadAsArray()[row, col],
+        "CEid": CE_array[row, col],
         "altitude": u.get_altitude_point(DEM, lat_utm, lon_utm)
     }
     )
@@ -190,8 +225,8 @@ def create_station_table(CEregrid: gdal.Dataset,
 
 
 def _appendCEgrid(ds: xr.Dataset,
-                  CEregrid: gdal.Dataset) -> xr.DataArray:
-    grid = CEregrid.ReadAsArray().astype(np.float16)
+                  CE_array: np.ndarray) -> xr.DataArray:
+    grid = CE_array.astype(np.float16)
     grid[grid == 0] = np.nan
     dr = xr.Dataset({
         "CE": (
@@ -8,20 +8,21 @@ from osgeo import gdal, ogr
 from .base import Meteo
 from pycequeau.core import projections
 from pycequeau.core import manage_files
+from pycequeau.core import netcdf
 from pycequeau.physiographic.base import Basin
 from pycequeau.core import utils as u
+from pycequeau.meteo import regrid
 from ._stations import (
     interpolation_netCDF,
     create_station_table,
     get_netCDF_grids,
-    create_grid_var
+    get_latlon_bounds,
+    gather_CE_values
 )
 
-__methods__ = [
-    "Bilineal",
-    "Voroni polygons",
-    "Nearest neighbourgh"
-]
+# Methods of StationNetCDF.interpolation: the sparse remapping methods and
+# the xr.Dataset.interp methods on the CE grid
+__methods__ = list(regrid.__methods__) + ["linear"]
 # from ._retrieve_netcdf import ()
 
 
@@ -40,36 +41,81 @@ class StationNetCDF(Meteo):
         self.basin_struct.set_dimenssions(np.sqrt(CE_area), np.sqrt(CE_area))
 
     @classmethod
-    def charge_CORDEX_Meteo(cls,vars_path: str) -> StationNetCDF:
-        """_summary_
+    def _open_files(cls,
+                    bassinVersant: Basin,
+                    vars_path: str,
+                    chunks: dict,
+                    lazy: bool,
+                    halo: int) -> dict | xr.Dataset:
+        # Open the .nc files and keep only the window around the basin
+        # before the units are converted, so the rest is never read
+        if lazy:
+            vars_dict = manage_files.open_netCDF_collection(vars_path, chunks)
+        else:
+            vars_dict = manage_files.dict_netCDF(vars_path)
+        if halo is None:
+            return vars_dict
+        watershed = ogr.Open(bassinVersant._Basin, gdal.GA_ReadOnly)
+        bounds = get_latlon_bounds(watershed)
+        if lazy:
+            return manage_files.subset_latlon(vars_dict, bounds, halo)
+        return {name: manage_files.subset_latlon(ds, bounds, halo)
+                for name, ds in vars_dict.items()}
+
+    @classmethod
+    def charge_CORDEX_Meteo(cls,
+                            bassinVersant: Basin,
+                            vars_path: str,
+                            chunks: dict = None,
+                            lazy: bool = True,
+                            halo: int = 2) -> StationNetCDF:
+        """Create the meteo object from a folder of CORDEX .nc files
 
         Args:
-            vars_path (str): _description_
+            bassinVersant (Basin): Basin object
+            vars_path (str): Folder with the .nc files
+            chunks (dict, optional): Dask chunks. Defaults to None (one year
+            of daily values).
+            lazy (bool, optional): Open the files as a single lazy dataset.
+            Defaults to True.
+            halo (int, optional): Grid cells kept around the basin. Defaults
+            to 2. None keeps the whole grid.
 
         Returns:
-            StationNetCDF: _description_
+            StationNetCDF: Meteo object
         """
-        vars_dict = manage_files.dict_netCDF(vars_path)
+        vars_dict = cls._open_files(bassinVersant, vars_path, chunks, lazy, halo)
         ds = manage_files.get_CORDEX_Dataset(vars_dict)
         # Construct object
-        obj = cls(ds)
+        obj = cls(bassinVersant, ds)
         return obj
-        pass
-    
-    @ classmethod
-    def charge_ERA_Meteo(cls, bassinVersant: Basin , vars_path: str) -> StationNetCDF:
-        """_summary_
+
+    @classmethod
+    def charge_ERA_Meteo(cls,
+                         bassinVersant: Basin,
+                         vars_path: str,
+                         chunks: dict = None,
+                         lazy: bool = True,
+                         halo: int = 2) -> StationNetCDF:
+        """Create the meteo object from a folder of ERA .nc files
 
         Args:
-            vars_path (str): _description_
+            bassinVersant (Basin): Basin object
+            vars_path (str): Folder with the .nc files
+            chunks (dict, optional): Dask chunks. Defaults to None (one year
+            of daily values).
+            lazy (bool, optional): Open the files as a single lazy dataset.
+            Defaults to True.
+            halo (int, optional): Grid cells kept around the basin. Defaults
+            to 2. None keeps the whole grid.
 
         Returns:
-            StationNetCDF: _description_
+            StationNetCDF: Meteo object
         """
-        vars_dict = manage_files.dict_netCDF(vars_path)
+        vars_dict = cls._open_files(bassinVersant, vars_path, chunks, lazy, halo)
         ds = manage_files.get_ERA_Dataset(vars_dict)
         # Construct object
-        obj = cls(bassinVersant,ds)
+        obj = cls(bassinVersant, ds)
         return obj
 
     @classmethod
@@ -82,39 +128,111 @@ class StationNetCDF(Meteo):
         Returns:
             xr.Dataset: _description_
         """
-        # Get the var list
-        var_list = list(ds.keys())
+        # The remapped datasets are already given by CE
+        if "CEid" in ds.dims:
+            dr = ds.assign_coords(time=regrid.to_datenum(ds["time"].values))
+            return dr.rename(time="pasTemp").transpose("pasTemp", "CEid")
+        # Get the var list (without the CE variable)
+        var_list = [var_name for var_name in ds.data_vars if var_name != "CE"]
         # Get the CEs and the i,j values from the bassinVersant structure.
         CEs = np.array(basin_struct.bassinVersant["carreauxEntiers"]["CEid"])
         # Here we substract 10 to use this vector as index in the meteo dataset
-        i = np.array(basin_struct.bassinVersant["carreauxEntiers"]["i"]) - 10 #columns
-        j = np.array(basin_struct.bassinVersant["carreauxEntiers"]["j"]) - 10 #rows
-        
-        # Remove CE variable from the main dataset
-        var_list.remove("CE")
+        i = np.array(basin_struct.bassinVersant["carreauxEntiers"]["i"], dtype=np.int64) - 10 #columns
+        j = np.array(basin_struct.bassinVersant["carreauxEntiers"]["j"], dtype=np.int64) - 10 #rows
         # Convert date to datenum
-        datenum = np.array(list(pd.to_datetime(ds.time.values).map(
-            lambda x: 366.0 + x.toordinal())), dtype=np.float32)
-        # Create the dataset to store the variables in the CEQUEAU format
+        datenum = regrid.to_datenum(ds["time"].values)
+        # Fill a single (variable, time, CE) block with all the CEs of each
+        # variable at once
+        block = np.empty((len(var_list), datenum.size, CEs.size), dtype=np.float32)
         for var_num, var_name in enumerate(var_list):
-            if var_num == 0:
-                dr = create_grid_var(ds, j, i, CEs, var_name, datenum)
-            else:
-                dr = dr.merge(create_grid_var(
-                    ds, j, i, CEs, var_name, datenum))
-            dr[var_name].attrs = ds[var_name].attrs
-            # break
-        return dr
+            gather_CE_values(ds[var_name], j, i, out=block[var_num])
+        # Create the dataset to store the variables in the CEQUEAU format
+        return xr.Dataset(
+            data_vars={var_name: (["pasTemp", "CEid"], block[var_num], ds[var_name].attrs)
+                       for var_num, var_name in enumerate(var_list)},
+            coords={"CEid": CEs.astype(np.int32),
+                    "pasTemp": datenum})
+
+    def write_cequeau_grid(self,
+                           path: str,
+                           method: str = "nearest",
+                           block: int = 365,
+                           append: bool = False) -> None:
+        """Interpolate the meteo data and write the CEQUEAU meteo file by
+        blocks of time steps (read, convert, remap and write). With the
+        sparse remapping methods only one block is in memory at a time. The
+        method is stored in the remap_method attribute of the file.
+
+        Args:
+            path (str): Output path (.nc)
+            method (str, optional): Interpolation method. Defaults to
+            "nearest".
+            block (int, optional): Time steps per block. Defaults to 365.
+            append (bool, optional): Append to an existing file. Defaults to
+            False.
+        """
+        dsi = self.interpolation(method)
+        grid = self.cequeau_grid(dsi, self.basin_struct).assign_attrs(remap_method=method)
+        netcdf.write_meteo_stream(path, grid, block, append)
+
+    def update_cequeau_grid(self,
+                            path: str,
+                            method: str = None,
+                            block: int = 365) -> int:
+        """Append to the CEQUEAU meteo file only the time steps after its
+        last pasTemp. Only the new source time steps are read and they are
+        remapped with the cached weights, so a daily update does not
+        recompute the whole record. The file is written in full when it
+        does not exist yet. The new days are remapped with the method the
+        file was written with, so the record stays consistent.
+
+        Args:
+            path (str): CEQUEAU meteo file (.nc)
+            method (str, optional): Remapping method of regrid.__methods__.
+            Defaults to None (the remap_method of the file, "nearest" for a
+            new file).
+            block (int, optional): Time steps per block. Defaults to 365.
+
+        Returns:
+            int: Number of time steps appended
+        """
+        last = netcdf.last_datenum(path) if os.path.exists(path) else None
+        # Keep the method of the existing file
+        file_method = netcdf.get_attribute(path, "remap_method") if last is not None else None
+        if method is None:
+            method = file_method or "nearest"
+        elif file_method is not None and method != file_method:
+            raise ValueError(f"{path} was remapped with {file_method}, "
+                             f"it can not be updated with {method}")
+        if method not in regrid.__methods__:
+            raise ValueError(f"The incremental update needs a remapping method: "
+                             f"{list(regrid.__methods__)}")
+        if last is None:
+            self.write_cequeau_grid(path, method, block)
+            return self.ds.sizes["time"]
+        # Keep the source time steps after the last one of the file
+        new_steps = np.flatnonzero(regrid.to_datenum(self.ds["time"].values) > last)
+        if new_steps.size == 0:
+            return 0
+        dsi = regrid.remap(self.ds.isel(time=new_steps), self.basin_struct, method)
+        grid = self.cequeau_grid(dsi, self.basin_struct)
+        netcdf.write_meteo_stream(path, grid, block, append=True)
+        return int(new_steps.size)
 
     def interpolation(self, method: str) -> xr.DataArray:
-        """_summary_
+        """Interpolate the meteo data on the CEs. The methods of
+        regrid.__methods__ remap the data directly on the CEs with sparse
+        weights (time, CEid). The other methods are passed to
+        xr.Dataset.interp on the (j, i) CE grid.
 
         Args:
-            method (str): _description_
+            method (str): Remapping or interpolation method
 
         Returns:
-            xr.DataArray: _description_
+            xr.DataArray: Interpolated dataset
         """
+        if method in regrid.__methods__:
+            return regrid.remap(self.ds, self.basin_struct, method)
         # Get stations table
         self.stations_table()
         # TODO: Allow to choose btween different options
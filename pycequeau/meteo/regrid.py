@@ -0,0 +1,551 @@
+from __future__ import annotations
+
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import xarray as xr
+import geopandas as gpd
+from scipy import sparse
+from scipy.spatial import cKDTree
+from shapely.geometry import box, Polygon
+from pycequeau.core import projections
+from pycequeau.physiographic.base import Basin
+
+
+class CETargets:
+    def __init__(self,
+                 CEid: np.ndarray,
+                 x: np.ndarray,
+                 y: np.ndarray,
+                 dx: float,
+                 dy: float,
+                 crs: str,
+                 geotransform: tuple = None) -> None:
+        """Centres of the CEs where the meteo data is remapped
+
+        Args:
+            CEid (np.ndarray): CE ids, in the order of the bassinVersant
+            x (np.ndarray): x coordinate of the CE centres
+            y (np.ndarray): y coordinate of the CE centres
+            dx (float): CE size along x
+            dy (float): CE size along y
+            crs (str): CRS of the CE grid (WKT or EPSG code)
+            geotransform (tuple, optional): GDAL geotransform of the CE grid.
+            Defaults to None.
+        """
+        self.CEid = np.asarray(CEid)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.dx = abs(dx)
+        self.dy = abs(dy)
+        self.crs = crs
+        self.geotransform = geotransform
+        self._latlon = None
+
+    @classmethod
+    def from_basin(cls, basin: Basin) -> CETargets:
+        """CE centres from the i, j values of the bassinVersant structure and
+        the georeference of the CE grid
+
+        Args:
+            basin (Basin): Basin with the bassinVersant structure
+
+        Returns:
+            CETargets: CE centres
+        """
+        basin.create_CEgrid()
+        gt = basin._CEgrid.GetGeoTransform()
+        CEs = basin.bassinVersant["carreauxEntiers"]
+        # The i, j values are shifted by 10 (column, row of the CE grid)
+        cols = np.asarray(CEs["i"], dtype=np.int64) - 10
+        rows = np.asarray(CEs["j"], dtype=np.int64) - 10
+        return cls(np.asarray(CEs["CEid"]),
+                   gt[0] + (cols + 0.5)*gt[1],
+                   gt[3] + (rows + 0.5)*gt[5],
+                   gt[1], gt[5],
+                   basin._CEgrid.GetProjection(),
+                   gt)
+
+    def __len__(self) -> int:
+        return self.CEid.size
+
+    @property
+    def latlon(self) -> tuple:
+        """(lat, lon) of the CE centres"""
+        if self._latlon is None:
+            lon, lat = projections.transform_points(self.x, self.y,
+                                                    self.crs, "EPSG:4326")
+            self._latlon = (lat, lon)
+        return self._latlon
+
+
+def _source_lon(lon: np.ndarray, target_lon: np.ndarray) -> np.ndarray:
+    # Express the target longitudes in the convention of the source grid
+    if lon.max() > 180:
+        return target_lon % 360
+    return target_lon
+
+
+def _axis_neighbours(axis: np.ndarray, values: np.ndarray) -> tuple:
+    # Lower neighbour and linear fraction of each value along an axis. The
+    # axis can be descending. The values out of the axis are clamped.
+    order = np.argsort(axis)
+    sorted_axis = axis[order]
+    pos = np.searchsorted(sorted_axis, values) - 1
+    pos = np.clip(pos, 0, max(axis.size - 2, 0))
+    if axis.size == 1:
+        return order[pos], order[pos], np.zeros(values.size)
+    low, high = sorted_axis[pos], sorted_axis[pos + 1]
+    frac = np.clip((values - low)/(high - low), 0.0, 1.0)
+    return order[pos], order[pos + 1], frac
+
+
+def _grid_points(lat: np.ndarray,
+                 lon: np.ndarray,
+                 crs: str) -> np.ndarray:
+    # Grid points (lat*lon, 2) in the CRS of the CE grid. The point of
+    # row r and column c is r*lon.size + c, as the flattened grids
+    lat_grid, lon_grid = np.meshgrid(lat, lon, indexing="ij")
+    lon_grid = np.where(lon_grid > 180, lon_grid - 360, lon_grid)
+    x, y = projections.transform_points(lon_grid.ravel(), lat_grid.ravel(),
+                                        "EPSG:4326", crs)
+    return np.column_stack([x, y])
+
+
+def _targets_xy(targets: CETargets) -> np.ndarray:
+    return np.column_stack([targets.x, targets.y])
+
+
+def nearest_points(points: np.ndarray,
+                   targets: CETargets) -> sparse.csr_matrix:
+    """Weight of the nearest point (KD-tree) of each CE centre
+
+    Args:
+        points (np.ndarray): (points, 2) coordinates in the CE grid CRS
+        targets (CETargets): CE centres
+
+    Returns:
+        sparse.csr_matrix: (CE, points) weights
+    """
+    _, idx = cKDTree(points).query(_targets_xy(targets))
+    n = len(targets)
+    return sparse.csr_matrix((np.ones(n), (np.arange(n), idx)),
+                             shape=(n, len(points)))
+
+
+def idw_points(points: np.ndarray,
+               targets: CETargets,
+               k: int = 4,
+               power: float = 2.0) -> sparse.csr_matrix:
+    """Inverse distance weights of the k nearest points of each CE centre
+
+    Args:
+        points (np.ndarray): (points, 2) coordinates in the CE grid CRS
+        targets (CETargets): CE centres
+        k (int, optional): Number of points. Defaults to 4.
+        power (float, optional): Power of the distance. Defaults to 2.0.
+
+    Returns:
+        sparse.csr_matrix: (CE, points) weights
+    """
+    k = min(k, len(points))
+    dist, idx = cKDTree(points).query(_targets_xy(targets), k=k)
+    dist, idx = dist.reshape(len(targets), k), idx.reshape(len(targets), k)
+    # A point on the CE centre gets (almost) all the weight
+    weights = 1.0/np.maximum(dist, 1e-6)**power
+    weights /= weights.sum(axis=1, keepdims=True)
+    rows = np.repeat(np.arange(len(targets)), k)
+    return sparse.csr_matrix((weights.ravel(), (rows, idx.ravel())),
+                             shape=(len(targets), len(points)))
+
+
+def thiessen_points(points: np.ndarray,
+                    targets: CETargets,
+                    samples: int = 10) -> sparse.csr_matrix:
+    """Thiessen (Voronoi) polygon weights: the fraction of each CE square
+    closer to each point. The fractions are estimated on samples x samples
+    sub-cells of the CE square, each one assigned to its nearest point.
+
+    Args:
+        points (np.ndarray): (points, 2) coordinates in the CE grid CRS
+        targets (CETargets): CE centres
+        samples (int, optional): Sub-cells per CE side. Defaults to 10.
+
+    Returns:
+        sparse.csr_matrix: (CE, points) weights
+    """
+    offsets = (np.arange(samples) + 0.5)/samples - 0.5
+    ox, oy = np.meshgrid(offsets*targets.dx, offsets*targets.dy)
+    x = (targets.x[:, None] + ox.ravel()[None, :]).ravel()
+    y = (targets.y[:, None] + oy.ravel()[None, :]).ravel()
+    _, idx = cKDTree(points).query(np.column_stack([x, y]))
+    rows = np.repeat(np.arange(len(targets)), samples*samples)
+    # The repeated (CE, point) pairs are summed by the csr conversion
+    return sparse.coo_matrix((np.full(rows.size, 1.0/samples**2), (rows, idx)),
+                             shape=(len(targets), len(points))).tocsr()
+
+
+def nearest_weights(lat: np.ndarray,
+                    lon: np.ndarray,
+                    targets: CETargets) -> sparse.csr_matrix:
+    """Weights of the nearest grid point of each CE, with the distances
+    computed in the CE grid CRS
+
+    Args:
+        lat (np.ndarray): Latitudes of the source grid
+        lon (np.ndarray): Longitudes of the source grid
+        targets (CETargets): CE centres
+
+    Returns:
+        sparse.csr_matrix: (CE, lat*lon) weights
+    """
+    return nearest_points(_grid_points(lat, lon, targets.crs), targets)
+
+
+def idw_weights(lat: np.ndarray,
+                lon: np.ndarray,
+                targets: CETargets) -> sparse.csr_matrix:
+    """Inverse distance weights of the 4 nearest grid points of each CE
+
+    Args:
+        lat (np.ndarray): Latitudes of the source grid
+        lon (np.ndarray): Longitudes of the source grid
+        targets (CETargets): CE centres
+
+    Returns:
+        sparse.csr_matrix: (CE, lat*lon) weights
+    """
+    return idw_points(_grid_points(lat, lon, targets.crs), targets)
+
+
+def thiessen_weights(lat: np.ndarray,
+                     lon: np.ndarray,
+                     targets: CETargets) -> sparse.csr_matrix:
+    """Thiessen polygon weights of the grid points of each CE
+
+    Args:
+        lat (np.ndarray): Latitudes of the source grid
+        lon (np.ndarray): Longitudes of the source grid
+        targets (CETargets): CE centres
+
+    Returns:
+        sparse.csr_matrix: (CE, lat*lon) weights
+    """
+    return thiessen_points(_grid_points(lat, lon, targets.crs), targets)
+
+
+def bilinear_weights(lat: np.ndarray,
+                     lon: np.ndarray,
+                     targets: CETargets) -> sparse.csr_matrix:
+    """Bilinear weights of the four grid points around each CE
+
+    Args:
+        lat (np.ndarray): Latitudes of the source grid
+        lon (np.ndarray): Longitudes of the source grid
+        targets (CETargets): CE centres
+
+    Returns:
+        sparse.csr_matrix: (CE, lat*lon) weights
+    """
+    ce_lat, ce_lon = targets.latlon
+    ce_lon = _source_lon(lon, ce_lon)
+    r0, r1, fr = _axis_neighbours(lat, ce_lat)
+    c0, c1, fc = _axis_neighbours(lon, ce_lon)
+    n = len(targets)
+    ce = np.tile(np.arange(n), 4)
+    cells = np.concatenate([r0*lon.size + c0, r0*lon.size + c1,
+                            r1*lon.size + c0, r1*lon.size + c1])
+    weights = np.concatenate([(1 - fr)*(1 - fc), (1 - fr)*fc,
+                              fr*(1 - fc), fr*fc])
+    # Repeated cells (on the edges) are summed by the csr conversion
+    return sparse.coo_matrix((weights, (ce, cells)),
+                             shape=(n, lat.size*lon.size)).tocsr()
+
+
+def _cell_edges(axis: np.ndarray) -> np.ndarray:
+    # Edges of the grid cells centred on the axis values
+    if axis.size == 1:
+        return np.array([axis[0] - 0.5, axis[0] + 0.5])
+    middle = (axis[1:] + axis[:-1])/2
+    return np.concatenate([[2*axis[0] - middle[0]], middle, [2*axis[-1] - middle[-1]]])
+
+
+def _densified(edges: np.ndarray, segments: int) -> np.ndarray:
+    # Points along the edges with segments steps between two edges
+    steps = np.linspace(0, 1, segments, endpoint=False)
+    inner = edges[:-1, None] + np.diff(edges)[:, None]*steps
+    return np.append(inner.ravel(), edges[-1])
+
+
+def conservative_weights(lat: np.ndarray,
+                         lon: np.ndarray,
+                         targets: CETargets,
+                         segments: int = 16) -> sparse.csr_matrix:
+    """Area weights of the source cells overlapping each CE square. The
+    source cells are reprojected to the CRS of the CE grid and intersected
+    with the CE squares, so the weights are the overlap fractions and the
+    totals (i.e. precipitation) are conserved.
+
+    The meridians and parallels are curved in the CRS of the CE grid, so the
+    cell edges are densified before the reprojection. The neighbour cells
+    share the same edge points, so the reprojected cells tile the source
+    grid without gaps or overlaps. The weights of the CEs inside the source
+    grid are checked to sum to 1.
+
+    Args:
+        lat (np.ndarray): Latitudes of the source grid
+        lon (np.ndarray): Longitudes of the source grid
+        targets (CETargets): CE centres
+        segments (int, optional): Points per cell edge. Defaults to 16.
+
+    Returns:
+        sparse.csr_matrix: (CE, lat*lon) weights
+    """
+    lat_edges = _cell_edges(lat)
+    lon_edges = _cell_edges(lon)
+    lon_edges = np.where(lon_edges > 180, lon_edges - 360, lon_edges)
+    # Only the source cells around the CEs are intersected
+    ce_lat, ce_lon = targets.latlon
+    ce_lon = np.where(ce_lon > 180, ce_lon - 360, ce_lon)
+    lat_low, lat_high = np.minimum(lat_edges[:-1], lat_edges[1:]), np.maximum(lat_edges[:-1], lat_edges[1:])
+    lon_low, lon_high = np.minimum(lon_edges[:-1], lon_edges[1:]), np.maximum(lon_edges[:-1], lon_edges[1:])
+    margin_lat = np.abs(np.diff(lat_edges)).max()
+    margin_lon = np.abs(np.diff(lon_edges)).max()
+    rows = np.flatnonzero((lat_high >= ce_lat.min() - margin_lat) & (lat_low <= ce_lat.max() + margin_lat))
+    cols = np.flatnonzero((lon_high >= ce_lon.min() - margin_lon) & (lon_low <= ce_lon.max() + margin_lon))
+    # Reprojected parallels (one per lat edge) and meridians (one per lon
+    # edge) of the selected block of cells
+    block_lat = lat_edges[rows[0]:rows[-1]+2]
+    block_lon = lon_edges[cols[0]:cols[-1]+2]
+    lon_line, lat_line = _densified(block_lon, segments), _densified(block_lat, segments)
+    px, py = projections.transform_points(*np.meshgrid(lon_line, block_lat), "EPSG:4326", targets.crs)
+    mx, my = projections.transform_points(*np.meshgrid(block_lon, lat_line, indexing="ij"), "EPSG:4326", targets.crs)
+    parallels = np.stack([px, py], axis=-1)
+    meridians = np.stack([mx, my], axis=-1)
+    polygons = []
+    for a in range(rows.size):
+        lat_range = slice(a*segments, (a+1)*segments + 1)
+        for b in range(cols.size):
+            lon_range = slice(b*segments, (b+1)*segments + 1)
+            polygons.append(Polygon(np.concatenate([parallels[a, lon_range],
+                                                    meridians[b+1, lat_range],
+                                                    parallels[a+1, lon_range][::-1],
+                                                    meridians[b, lat_range][::-1]])))
+    rr, cc = np.meshgrid(rows, cols, indexing="ij")
+    cells = gpd.GeoDataFrame({"cell": (rr*lon.size + cc).ravel()},
+                             geometry=polygons, crs=targets.crs)
+    half_x, half_y = targets.dx/2, targets.dy/2
+    squares = gpd.GeoDataFrame(
+        {"ce": np.arange(len(targets))},
+        geometry=[box(x - half_x, y - half_y, x + half_x, y + half_y)
+                  for x, y in zip(targets.x, targets.y)],
+        crs=cells.crs)
+    overlap = gpd.overlay(squares, cells, how="intersection", keep_geom_type=True)
+    weights = overlap.geometry.area.values/(targets.dx*targets.dy)
+    weights = sparse.coo_matrix((weights, (overlap["ce"].values, overlap["cell"].values)),
+                                shape=(len(targets), lat.size*lon.size)).tocsr()
+    # The CEs inside the block of cells must be fully covered
+    domain = Polygon(np.concatenate([parallels[0], meridians[-1],
+                                     parallels[-1][::-1], meridians[0][::-1]]))
+    inside = squares.within(domain).values
+    total = np.asarray(weights.sum(axis=1)).ravel()
+    if not np.allclose(total[inside], 1.0, atol=1e-6):
+        raise ValueError("The conservative weights of the CEs inside the source "
+                         f"grid do not sum to 1 (min {total[inside].min()}, "
+                         f"max {total[inside].max()})")
+    return weights
+
+
+# Weight builders of each remapping method
+__methods__ = {"nearest": nearest_weights,
+               "bilinear": bilinear_weights,
+               "conservative": conservative_weights,
+               "idw": idw_weights,
+               "thiessen": thiessen_weights}
+# Version of the weights of each method. It is part of the cache key, so it
+# must be bumped whenever the weights of a method change, otherwise the
+# weights cached by the previous version are reused
+__weights_version__ = {"nearest": 2,
+                       "bilinear": 1,
+                       "conservative": 2,
+                       "idw": 1,
+                       "thiessen": 1}
+# Weight builders from scattered points (i.e. stations)
+__point_methods__ = {"nearest": nearest_points,
+                     "idw": idw_points,
+                     "thiessen": thiessen_points}
+
+
+def compute_weights(ds: xr.Dataset,
+                    targets: CETargets,
+                    method: str = "bilinear") -> sparse.csr_matrix:
+    """Sparse (CE, source cell) weights of a remapping method
+
+    Args:
+        ds (xr.Dataset): Source dataset with lat and lon dimensions
+        targets (CETargets): CE centres
+        method (str, optional): Key of __methods__. Defaults to "bilinear".
+
+    Returns:
+        sparse.csr_matrix: Weights, each row sums to 1
+    """
+    if method not in __methods__:
+        raise ValueError(f"Unknown remapping method {method}. "
+                         f"The methods are: {list(__methods__)}")
+    return __methods__[method](ds["lat"].values.astype(np.float64),
+                               ds["lon"].values.astype(np.float64),
+                               targets)
+
+
+def station_weights(x: np.ndarray,
+                    y: np.ndarray,
+                    targets: CETargets,
+                    method: str = "idw") -> sparse.csr_matrix:
+    """Sparse (CE, station) weights from stations given in the CE grid CRS
+
+    Args:
+        x (np.ndarray): x coordinates of the stations
+        y (np.ndarray): y coordinates of the stations
+        targets (CETargets): CE centres
+        method (str, optional): Key of __point_methods__. Defaults to "idw".
+
+    Returns:
+        sparse.csr_matrix: Weights, each row sums to 1
+    """
+    if method not in __point_methods__:
+        raise ValueError(f"Unknown method {method}. "
+                         f"The methods are: {list(__point_methods__)}")
+    return __point_methods__[method](np.column_stack([x, y]).astype(np.float64),
+                                     targets)
+
+
+def weights_key(ds: xr.Dataset,
+                targets: CETargets,
+                method: str) -> str:
+    """Fingerprint of the weights: the source lat/lon axes, the CE grid
+    (geotransform, CRS and CEs), the method and the version of its weights
+    (__weights_version__). Any dataset on the same grid gets the same key.
+
+    Args:
+        ds (xr.Dataset): Source dataset with lat and lon dimensions
+        targets (CETargets): CE centres
+        method (str): Remapping method
+
+    Returns:
+        str: Hexadecimal hash
+    """
+    sha = hashlib.sha1(f"{method}:v{__weights_version__.get(method, 0)}".encode())
+    for axis in ("lat", "lon"):
+        sha.update(np.ascontiguousarray(ds[axis].values, dtype=np.float64).tobytes())
+    sha.update(repr(targets.geotransform).encode())
+    sha.update(str(targets.crs).encode())
+    for values in (targets.CEid.astype(np.int64), targets.x, targets.y):
+        sha.update(np.ascontiguousarray(values).tobytes())
+    return sha.hexdigest()[:16]
+
+
+def cached_weights(ds: xr.Dataset,
+                   targets: CETargets,
+                   method: str,
+                   folder: str) -> sparse.csr_matrix:
+    """Weights read from the cache folder, or computed and stored there the
+    first time. The files are named <method>_<weights_key>.npz.
+
+    Args:
+        ds (xr.Dataset): Source dataset with lat and lon dimensions
+        targets (CETargets): CE centres
+        method (str): Key of __methods__
+        folder (str): Cache folder
+
+    Returns:
+        sparse.csr_matrix: Weights
+    """
+    path = os.path.join(folder, f"{method}_{weights_key(ds, targets, method)}.npz")
+    if os.path.exists(path):
+        return sparse.load_npz(path).tocsr()
+    weights = compute_weights(ds, targets, method)
+    os.makedirs(folder, exist_ok=True)
+    sparse.save_npz(path, weights)
+    return weights
+
+
+def _apply(values: np.ndarray, weights: sparse.csr_matrix) -> np.ndarray:
+    # (..., lat, lon) -> (..., CE). The weights are normalized by the valid
+    # source cells, so the CEs next to missing values (i.e. sea) only use
+    # the valid ones
+    shape = values.shape[:-2]
+    flat = values.reshape(-1, values.shape[-2]*values.shape[-1]).T
+    valid = np.isfinite(flat)
+    total = weights @ np.where(valid, flat, 0.0)
+    norm = weights @ valid.astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = np.where(norm > 0, total/norm, np.nan)
+    return result.T.reshape(shape + (weights.shape[0],)).astype(np.float32)
+
+
+def apply_weights(ds: xr.Dataset,
+                  weights: sparse.csr_matrix,
+                  targets: CETargets) -> xr.Dataset:
+    """Remap every variable with the precomputed weights. The product is
+    done by time chunk (apply_ufunc), so a lazy dataset stays lazy.
+
+    Args:
+        ds (xr.Dataset): Source dataset (time, lat, lon)
+        weights (sparse.csr_matrix): (CE, lat*lon) weights
+        targets (CETargets): CE centres
+
+    Returns:
+        xr.Dataset: Remapped dataset (time, CEid) in float32
+    """
+    data_vars = {}
+    for var_name, da in ds.data_vars.items():
+        if not {"lat", "lon"}.issubset(da.dims):
+            continue
+        remapped = xr.apply_ufunc(_apply, da, kwargs={"weights": weights},
+                                  input_core_dims=[["lat", "lon"]],
+                                  output_core_dims=[["CEid"]],
+                                  dask="parallelized",
+                                  output_dtypes=[np.float32],
+                                  dask_gufunc_kwargs={"output_sizes": {"CEid": len(targets)}})
+        data_vars[var_name] = remapped.assign_attrs(da.attrs)
+    return xr.Dataset(data_vars,
+                      coords={"time": ds["time"],
+                              "CEid": targets.CEid.astype(np.int32)})
+
+
+def to_datenum(time: np.ndarray) -> np.ndarray:
+    """MATLAB datenums (days, 366 + ordinal) of the days of a time axis"""
+    days = pd.to_datetime(time).values.astype("datetime64[D]").astype(np.int64)
+    # datenum(1970, 1, 1) = 719529
+    return (days + 719529).astype(np.float32)
+
+
+def remap(ds: xr.Dataset,
+          basin: Basin,
+          method: str = "bilinear",
+          weights: sparse.csr_matrix = None,
+          cache: bool = True) -> xr.Dataset:
+    """Remap a lat/lon meteo dataset directly on the CEs of the basin
+
+    Args:
+        ds (xr.Dataset): Source dataset (time, lat, lon)
+        basin (Basin): Basin with the bassinVersant structure
+        method (str, optional): Key of __methods__. Defaults to "bilinear".
+        weights (sparse.csr_matrix, optional): Weights computed beforehand.
+        Defaults to None.
+        cache (bool, optional): Keep the weights in project/meteo/weights and
+        reuse them for the datasets on the same grid. Defaults to True.
+
+    Returns:
+        xr.Dataset: Remapped dataset (time, CEid)
+    """
+    targets = CETargets.from_basin(basin)
+    if weights is None and cache:
+        weights = cached_weights(ds, targets, method,
+                                 os.path.join(basin._project_path, "meteo", "weights"))
+    elif weights is None:
+        weights = compute_weights(ds, targets, method)
+    dr = apply_weights(ds, weights, targets)
+    return dr.assign_attrs(
+        interpolated=f"Remapped with sparse {method} weights")
@@ -1,32 +1,33 @@
+from __future__ import annotations
+
 import numpy as np
 import pandas as pd
 import geopandas as gpd
 from shapely.geometry import Polygon
 from osgeo import gdal
 from pycequeau.core import utils as u
-import rasterstats as rs
-from math import ceil
+from pycequeau.core.rasters import RasterArray
+from pycequeau.physiographic.tables import min_dtype
 import itertools
 import sys
 
 
 def convert_coords_to_index(df: gpd.GeoDataFrame,
-                            dataset: gdal.Dataset) -> gpd.GeoDataFrame:
-    band = dataset.GetRasterBand(1)
-    cols = dataset.RasterXSize
-    rows = dataset.RasterYSize
-    df2 = pd.concat([df, pd.DataFrame(columns=["col_min", "row_min", "col_max", "row_max"],
-                                      index=df.index.values)], axis=1)
-    transform = dataset.GetGeoTransform()
+                            dataset: gdal.Dataset | RasterArray) -> gpd.GeoDataFrame:
+    df2 = df.copy()
+    if isinstance(dataset, RasterArray):
+        transform = dataset.geotransform
+    else:
+        transform = dataset.GetGeoTransform()
     xOrigin = transform[0]
     yOrigin = transform[3]
     pixelWidth = transform[1]
     pixelHeight = -transform[5]
-    for i in range(len(df)):
-        df2.at[i, "col_min"] = ceil((df["minx"].iloc[i] - xOrigin)/pixelWidth)
-        df2.at[i, "row_max"] = int((yOrigin - df["miny"].iloc[i])/pixelHeight)
-        df2.at[i, "col_max"] = ceil((df["maxx"].iloc[i]-xOrigin)/pixelWidth)
-        df2.at[i, "row_min"] = int((yOrigin - df["maxy"].iloc[i])/pixelHeight)
+    # Integer columns computed for all the features at once
+    df2["col_min"] = np.ceil((df["minx"].values - xOrigin)/pixelWidth).astype(np.int64)
+    df2["row_min"] = np.trunc((yOrigin - df["maxy"].values)/pixelHeight).astype(np.int64)
+    df2["col_max"] = np.ceil((df["maxx"].values - xOrigin)/pixelWidth).astype(np.int64)
+    df2["row_max"] = np.trunc((yOrigin - df["miny"].values)/pixelHeight).astype(np.int64)
     return df2
 
 
@@ -99,7 +100,7 @@ def identify_small_CPs(CE_fishnet: gpd.GeoDataFrame,
 
 def remove_border_CPs(CE_fishnet: gpd.GeoDataFrame,
                       CP_fishnet: gpd.GeoDataFrame,
-                      FAC: str) -> list:
+                      FAC: str | RasterArray) -> list:
     # Get the area of the CE grid
     CE_area = CE_fishnet.area[0]
     # Add the bounds for each polygon
@@ -121,7 +122,7 @@ def remove_border_CPs(CE_fishnet: gpd.GeoDataFrame,
         if CE_features.empty:
             continue
         # If there is not features to dissolve, get rid off
-        stats = rs.zonal_stats(CE_features, FAC, stats=['max'])
+        stats = u.zonal_stats(CE_features, FAC, ['max'])
         CP_fishnet.iloc[idx, columnsCP.index("maxFAC")] = [
             s['max'] for s in stats]
         # Update values
@@ -540,7 +541,7 @@ def force_4CP(CE_fishnet: gpd.GeoDataFrame,
 # Compute the mean altitude within each CE and CP
 def mean_altitudes(CE_fishnet: gpd.GeoDataFrame,
                    CP_fishnet: gpd.GeoDataFrame,
-                   DEM: str):
+                   DEM: str | RasterArray):
     # Add altitude column to each dataset
     CE_fishnet = CE_fishnet.reindex(columns=CE_fishnet.columns.tolist() + ['altitude'])
     CE_fishnet["altitude"] = None
@@ -548,9 +549,9 @@ def mean_altitudes(CE_fishnet: gpd.GeoDataFrame,
     CP_fishnet["altitude"] = None
 
     # Compute the zonal statistics
-    stats_CE = rs.zonal_stats(CE_fishnet, DEM, stats=['mean'])
+    stats_CE = u.zonal_stats(CE_fishnet, DEM, ['mean'])
     CE_fishnet.loc[:, "altitude"] = [s['mean'] for s in stats_CE]
-    stats_CP = rs.zonal_stats(CP_fishnet, DEM, stats=['mean'])
+    stats_CP = u.zonal_stats(CP_fishnet, DEM, ['mean'])
     CP_fishnet.loc[:, "altitude"] = [s['mean'] for s in stats_CP]
     return CP_fishnet, CE_fishnet
 
@@ -601,24 +602,28 @@ def mean_altitudes(CE_fishnet: gpd.GeoDataFrame,
 
 def routing_table(CP_fishnet: gpd.GeoDataFrame,
                   CE_fishnet: gpd.GeoDataFrame,
-                  FAC: str,
+                  FAC: str | RasterArray,
                   CP_array: np.ndarray,
                   CE_array: np.ndarray) -> tuple:
 
-    # Create dataframe to store the routing data
-    routing = pd.DataFrame(columns=["CPid", "inCPid", "inCPid2", "outlet_row",
-                                    "outlet_col", "inlet_row", "inlet_col"],
-                           index=CP_fishnet.index.values)
-    routing["CPid"] = CP_fishnet["CPid"]
-    routing.index = CP_fishnet.index.values
+    # Typed arrays to store the routing data. The routing dataframe is
+    # created once they are filled
+    nCPs = len(CP_fishnet)
+    inCPid = np.zeros(nCPs, dtype=np.int64)
+    outlet_rc = np.zeros((nCPs, 2), dtype=np.int64)
+    inlet_rc = np.zeros((nCPs, 2), dtype=np.int64)
     CP_fishnet = pd.concat([CP_fishnet,
                             CP_fishnet["geometry"].bounds], axis=1)
     CE_fishnet = pd.concat([CE_fishnet,
                             CE_fishnet["geometry"].bounds], axis=1)
-    # Get the FAC array
-    FAC_dataset = gdal.Open(FAC, gdal.GA_ReadOnly)
-    band = FAC_dataset.GetRasterBand(1)
-    FAC_array = band.ReadAsArray()
+    # Get the FAC array. A copy is made since the shared rasters are read-only
+    if isinstance(FAC, RasterArray):
+        FAC_dataset = FAC
+        FAC_array = np.array(FAC.array)
+    else:
+        FAC_dataset = gdal.Open(FAC, gdal.GA_ReadOnly)
+        band = FAC_dataset.GetRasterBand(1)
+        FAC_array = band.ReadAsArray()
     FAC_array[FAC_array < 0] = 0
     # Get the DIR array
     CP_fishnet = convert_coords_to_index(CP_fishnet, FAC_dataset)
@@ -630,7 +635,7 @@ def routing_table(CP_fishnet: gpd.GeoDataFrame,
     df2 = pd.DataFrame(CE_fishnet.drop(columns='geometry'))
     # Loop into each CE
     
-    for index, feat in CP_fishnet.iterrows():
+    for k, (index, feat) in enumerate(CP_fishnet.iterrows()):
         # Find the rows and cols where the CP value is stored
         # rows, cols = np.where(CP_array == feat["CPid"])
         # CP_fishnet.at[index,"row_min"] = np.amin(rows)
@@ -689,13 +694,18 @@ def routing_table(CP_fishnet: gpd.GeoDataFrame,
         inlet_row, inlet_col = np.unravel_index(
             np.argmax(subFAC*mask_FAC), subFAC.shape)
         # Add the CP where it discharges
-        routing.at[index, "inCPid"] = CP[inlet_row, inlet_col]
-        routing.at[index, "inCPid2"] = CP[inlet_row, inlet_col]
-        # Add the coordinates into the dataframe
-        routing.at[index, "outlet_col"] = outlet_col-1
-        routing.at[index, "outlet_row"] = outlet_row-1
-        routing.at[index, "inlet_row"] = inlet_row-1
-        routing.at[index, "inlet_col"] = inlet_col-1
+        inCPid[k] = CP[inlet_row, inlet_col]
+        # Add the coordinates
+        outlet_rc[k] = outlet_row-1, outlet_col-1
+        inlet_rc[k] = inlet_row-1, inlet_col-1
+    routing = pd.DataFrame({"CPid": CP_fishnet["CPid"].values.astype(np.int64),
+                            "inCPid": inCPid,
+                            "inCPid2": inCPid.copy(),
+                            "outlet_row": outlet_rc[:, 0],
+                            "outlet_col": outlet_rc[:, 1],
+                            "inlet_row": inlet_rc[:, 0],
+                            "inlet_col": inlet_rc[:, 1]},
+                           index=CP_fishnet.index.values)
     # Create the rouring table here
     rtable = pd.DataFrame(columns=["oldCPid", "newCPid", "upstreamCPs","oldupstreams"],
                           index=range(1,len(CP_fishnet)+1))
@@ -768,7 +778,8 @@ def get_downstream_CP(rtable: pd.DataFrame) -> pd.DataFrame:
     lists_len = [len(i)
                  for i in rtable["upstreamCPs"].values if isinstance(i, list)]
     # Create a zero array to store the values
-    list_upstream_array = np.zeros([len(rtable), max(lists_len)]).astype("uint16")
+    list_upstream_array = np.zeros([len(rtable), max(lists_len)],
+                                   dtype=min_dtype(len(rtable)))
     # Fill up the array using the lists in the main dataframe
     for i in range(len(rtable)):
         if isinstance(rtable.loc[i, "upstreamCPs"], list):
@@ -849,7 +860,7 @@ def cumulative_areas(CP_fishnet: gpd.GeoDataFrame,
         # Drop the downstream values
         temp_df = temp_df[~mask_df]
         # Get the unique values
-        temp_df = np.unique(temp_df).astype("uint16")
+        temp_df = np.unique(temp_df).astype(np.int64)
         party = CP_fishnet.loc[temp_df,"pctSurface"]
         sum = CP_fishnet.loc[temp_df,"pctSurface"].sum()
         upstreamCPs.append(temp_df.tolist())
@@ -1,18 +1,25 @@
 from __future__ import annotations
 
-from osgeo import gdal, ogr
+from osgeo import gdal, ogr, gdal_array
 import os
-import json
 from math import ceil,floor
 import pandas as pd
 import numpy as np
 from pycequeau.physiographic import carreauxEntiers as CEs
 from pycequeau.physiographic import carreauxPartiels as CPs
 from pycequeau.physiographic import CPfishnet as CPfs
+from pycequeau.physiographic import fragments as frag
+from pycequeau.physiographic import tables
+from pycequeau.physiographic import bassinVersant as bv
+from pycequeau.physiographic import flow
 from pycequeau.core import utils as u
 from pycequeau.core import projections as proj
+from pycequeau.core.storage import FishnetStorage
+from pycequeau.core import rasters
+from pycequeau.core.rasters import RasterArray, RasterCache
 import geopandas as gpd
 import sys
+import time
 
 
 class Basin:
@@ -20,26 +27,31 @@ class Basin:
                  project_folder: str,
                  basin_name: str,
                  file_list: list,
-                 *args) -> None:
+                 *args,
+                 storage: str = "parquet",
+                 spatial_index: bool = False) -> None:
         # Create project structure
         self._project_path = project_folder
         self.name = basin_name
         self._project_structure(project_folder, file_list)
+        # Intermediate storage of the fishnets between the pipeline stages
+        self._storage = FishnetStorage(os.path.join(self._project_path, "geographic"),
+                                       storage,
+                                       spatial_index)
+        # Rasters read by the pipeline stages. Each one is read only once
+        self._rasters = RasterCache()
         # Create here the fishnet
-        self._CEfishnet = os.path.join(
-            self._project_path, "geographic", "CE_fishnet.shp")
-        self._CPfishnet = os.path.join(
-            self._project_path, "geographic", "CP_fishnet.shp")
-        
+        self._CEfishnet = self._storage.path("CE_fishnet")
+        self._CPfishnet = self._storage.path("CP_fishnet")
+
         # Check if the bassin versant object is an input file 
         if len(args) == 1:
-            # Check if the provided file is an an actual json file
+            # The structure can be a json file or one of the binary exports
+            # (.nc, .npz). Only the entries that are used get decoded
             try:
-                # Open the json file file 
-                f = open(args[0],"r")
-                self.bassinVersant = json.loads(f.read())
-            except ValueError:
-                raise ValueError("Provided file is not a json file")
+                self.bassinVersant = bv.read_bassinVersant(args[0], lazy=True)
+            except (ValueError, OSError, KeyError):
+                raise ValueError("Provided file is not a bassinVersant file")
         # else:
         #     sys.exit("The number of args must be 1")
 
@@ -83,34 +95,304 @@ class Basin:
     def get_EPSG(self):
         return self._epsg
 
+    def get_basin_extent(self) -> tuple:
+        """Extent of the watershed shp (xmin, xmax, ymin, ymax)"""
+        watershed = ogr.Open(self._Basin, gdal.GA_ReadOnly)
+        return watershed.GetLayer().GetExtent()
+
+    def subbasin_labels(self) -> RasterArray:
+        """Rasterize the sub-basins on the FAC grid. The labels are the same
+        CATid values given in join_shps. The raster is kept in the raster
+        cache so it is computed only once for all the CE dimensions.
+
+        Returns:
+            RasterArray: Sub-basin labels
+        """
+        key = self._SubBasins + ":CATid"
+        if key not in self._rasters:
+            SubBasins = gpd.read_file(self._SubBasins)
+            SubBasins["CATid"] = range(1, len(SubBasins)+1)
+            FAC = rasters.raster_info(self._FAC)
+            labels = u.rasterize_shp(SubBasins, FAC, "CATid")
+            self._rasters.add(key, RasterArray(labels,
+                                               FAC.geotransform,
+                                               FAC.projection,
+                                               0))
+        return self._rasters.get(key)
+
+    def compute_flow_accumulation(self,
+                                  fac_name: str = "FAC_d8.tif",
+                                  epsilon: float = 1e-5,
+                                  halo: int = 1) -> RasterArray:
+        """Compute the flow direction and the flow accumulation from the DEM
+        instead of using a FAC raster computed beforehand (i.e. with GRASS).
+        Only the window of the DEM covering the watershed is read and the
+        flow is routed inside the watershed. The FAC is written in
+        geographic/ (in memory with the memory storage) with the georeference
+        of the DEM window and replaces the FAC given in the file list. The D8
+        directions are kept in the raster cache for the stream extraction.
+
+        Args:
+            fac_name (str, optional): Name of the FAC raster.
+            Defaults to "FAC_d8.tif".
+            epsilon (float, optional): Slope imposed on the filled
+            depressions. Defaults to 1e-5.
+            halo (int, optional): Extra DEM pixels read around the watershed.
+            Defaults to 1.
+
+        Returns:
+            RasterArray: Flow accumulation (number of cells)
+        """
+        # Read only the part of the DEM covering the watershed
+        DEM = self._rasters.window(self._DEM, self.get_basin_extent(), halo)
+        # Route the flow only inside the watershed
+        mask_ds = RasterArray(np.zeros(DEM.shape, dtype=np.uint8),
+                              DEM.geotransform, DEM.projection).to_dataset()
+        watershed = ogr.Open(self._Basin, gdal.GA_ReadOnly)
+        gdal.RasterizeLayer(mask_ds, [1], watershed.GetLayer(), burn_values=[1])
+        mask = mask_ds.GetRasterBand(1).ReadAsArray() > 0
+        watershed = mask_ds = None
+        D8, FAC = flow.compute_flow(DEM, mask, epsilon)
+        if self.in_memory:
+            self._FAC = "/vsimem/" + fac_name
+        else:
+            self._FAC = os.path.join(self._project_path, "geographic", fac_name)
+        rasters.write_raster(self._FAC, FAC)
+        # The labels were rasterized on the previous FAC grid
+        self._rasters.discard(self._SubBasins + ":CATid")
+        self._rasters.add(self._FAC, FAC)
+        self._rasters.add(self._FAC + ":D8", D8)
+        return FAC
+
+    def extract_streams(self, flow_th: float = 1000) -> RasterArray:
+        """Extract the stream network (FAC >= flow_th) and the D8 directions
+        used to trace the main channels. The directions computed by
+        compute_flow_accumulation are used when available. Otherwise they are
+        recovered from the FAC raster. The streams are written in geographic/
+        unless the basin is kept in memory.
+
+        Args:
+            flow_th (float, optional): Flow accumulation threshold (number of
+            cells). Defaults to 1000.
+
+        Returns:
+            RasterArray: Stream cells (1) on the FAC grid
+        """
+        FAC = self._rasters.get(self._FAC)
+        if self._FAC + ":D8" not in self._rasters:
+            self._rasters.add(self._FAC + ":D8",
+                              RasterArray(flow.direction_from_accumulation(np.abs(FAC.array), FAC.valid),
+                                          FAC.geotransform,
+                                          FAC.projection))
+        streams = flow.stream_network(np.where(FAC.valid, np.abs(FAC.array), 0), flow_th)
+        streams = RasterArray(streams.astype(np.uint8), FAC.geotransform,
+                              FAC.projection, 0)
+        self._rasters.add(self._FAC + ":streams", streams)
+        if not self.in_memory:
+            rasters.write_raster(os.path.join(self._project_path, "geographic", "streams.tif"),
+                                 streams)
+        return streams
+
+    def main_channels(self,
+                      CP_array: np.ndarray,
+                      flow_th: float = 1000) -> pd.DataFrame:
+        """Length and slope of the main channel of each CP. All the CPs are
+        traced at once over the stream cells.
+
+        Args:
+            CP_array (np.ndarray): CPid rasterized on the FAC grid
+            flow_th (float, optional): Flow accumulation threshold.
+            Defaults to 1000.
+
+        Returns:
+            pd.DataFrame: Channel length (m), drop (m) and slope (m/m) indexed
+            by CPid
+        """
+        self.extract_streams(flow_th)
+        FAC = self._rasters.get(self._FAC)
+        D8 = self._rasters.get(self._FAC + ":D8")
+        # Only the part of the DEM covering the FAC grid is read
+        gt = FAC.geotransform
+        DEM = self._rasters.window(self._DEM,
+                                   (gt[0], gt[0] + FAC.shape[1]*gt[1],
+                                    gt[3] + FAC.shape[0]*gt[5], gt[3]))
+        # The elevations are needed on the FAC grid
+        if DEM.same_grid(FAC):
+            elevation = np.where(DEM.valid, DEM.array, np.nan)
+        else:
+            elevation = DEM.resample(FAC.geotransform, FAC.shape)
+        return flow.main_channels(D8.array,
+                                  np.where(FAC.valid, np.abs(FAC.array), 0),
+                                  elevation,
+                                  CP_array,
+                                  FAC.geotransform,
+                                  flow_th)
+
+    def optimize_offset(self,
+                        area_th: float = 0.05,
+                        nx: int = 10,
+                        ny: int = 10) -> tuple:
+        """Find the fishnet offset that gives the least small CPs before
+        building the fishnet. The candidates are scored from the sub-basin
+        label raster, so no vector operation is done here. The scores of all
+        the candidates are stored in self.offset_scores.
+
+        Args:
+            area_th (float, optional): Small CP threshold as fraction of the
+            CE area. Defaults to 0.05.
+            nx (int, optional): Number of x offsets to test. Defaults to 10.
+            ny (int, optional): Number of y offsets to test. Defaults to 10.
+
+        Returns:
+            tuple: Best (xoffset, yoffset) to pass to create_CEfishnet. The
+            xoffset is in [0, dx) and the yoffset in (-dy, 0]
+        """
+        labels = self.subbasin_labels()
+        self.offset_scores = frag.score_offsets(labels.array,
+                                                labels.geotransform,
+                                                self.get_basin_extent(),
+                                                self._dx, self._dy,
+                                                area_th, nx, ny)
+        best = self.offset_scores.iloc[0]
+        return float(best["xoffset"]), float(best["yoffset"])
+
+    def sweep_dimenssions(self,
+                          dimensions: list,
+                          area_th: float = 0.05,
+                          flow_th: float = 1000,
+                          build: bool = True) -> pd.DataFrame:
+        """Build the CE and CP structures for several CE dimensions
+
+        The rasters (FAC, DEM, LC and the sub-basin labels) are read only once
+        and reused for all the dimensions. The statistics of the CE x sub-basin
+        fragments are computed from the label raster before any vector work.
+        The structures of each dimension are stored in self.sweep_results and
+        can be recovered with select_dimenssions.
+
+        Args:
+            dimensions (list): List of (dx, dy) or (dx, dy, xoffset, yoffset)
+            area_th (float, optional): Small CP threshold as fraction of the
+            CE area. Defaults to 0.05.
+            flow_th (float, optional): Flow accumulation threshold.
+            Defaults to 1000.
+            build (bool, optional): Run the whole pipeline for each dimension.
+            If False, only the fragment statistics are computed.
+            Defaults to True.
+
+        Returns:
+            pd.DataFrame: Number of CPs and small CPs statistics for each
+            dimension
+        """
+        labels = self.subbasin_labels()
+        extent = self.get_basin_extent()
+        if not hasattr(self, "sweep_results"):
+            self.sweep_results = {}
+        report = []
+        for dims in dimensions:
+            dx, dy, xoffset, yoffset = (list(dims) + [0.0, 0.0])[:4]
+            row = {"dx": dx, "dy": dy, "xoffset": xoffset, "yoffset": yoffset}
+            row.update(frag.fragment_statistics(labels.array, labels.geotransform,
+                                                extent, dx, dy, xoffset, yoffset,
+                                                area_th))
+            if build:
+                start = time.perf_counter()
+                self.set_dimenssions(dx, dy)
+                self.create_CEfishnet(xoffset, yoffset)
+                self.create_CPfishnet()
+                self.polish_CPfishnet(area_th)
+                self.CP_routing(flow_th)
+                self.carreauxEntiers_struct()
+                self.carreauxPartiels_struct()
+                pctSurface = self.carreauxPartiels["pctSurface"].astype(float)
+                row.update({"nbCE": len(self.carreauxEntiers),
+                            "nbCP": len(self.carreauxPartiels),
+                            "nbSmallCP": int(np.count_nonzero(pctSurface < area_th*100)),
+                            "minPctSurface": float(pctSurface.min()),
+                            "meanPctSurface": float(pctSurface.mean()),
+                            "time": time.perf_counter() - start})
+                self.sweep_results[(dx, dy, xoffset, yoffset)] = {
+                    "carreauxEntiers": self.carreauxEntiers,
+                    "carreauxPartiels": self.carreauxPartiels,
+                    "outlet_routes": self.outlet_routes,
+                    "rtable": self.rtable,
+                    "CEfishnet": self.CEfishnet,
+                    "CPfishnet": self.CPfishnet}
+            report.append(row)
+        return pd.DataFrame(report)
+
+    def select_dimenssions(self,
+                           dx: float,
+                           dy: float,
+                           xoffset: float = 0.0,
+                           yoffset: float = 0.0) -> None:
+        """Recover the structures built by sweep_dimenssions for the given
+        dimensions, so create_bassinVersant_structure can be called.
+        """
+        results = self.sweep_results[(dx, dy, xoffset, yoffset)]
+        self.set_dimenssions(dx, dy)
+        for name, value in results.items():
+            setattr(self, name, value)
+        self._write_fishnet(self.CEfishnet, "CE_fishnet")
+        self._write_fishnet(self.CPfishnet, "CP_fishnet")
+
     def _set_EPSG(self):
         self._epsg = proj.get_proj_code(self._DEM)
 
+    @property
+    def in_memory(self) -> bool:
+        """True when the pipeline runs without intermediate disk writes"""
+        return self._storage.in_memory
+
+    def _read_fishnet(self, name: str) -> gpd.GeoDataFrame:
+        return self._storage.read(name)
+
+    def _write_fishnet(self, gdf: gpd.GeoDataFrame, name: str) -> None:
+        self._storage.write(gdf, name)
+        # The label grid rasterized from the previous fishnet is outdated
+        self._rasters.discard(self._storage.path(name) + ":grid")
+        if name == "CP_fishnet":
+            self._CPgrid = None
+
+    def export_fishnets(self, driver: str = "ESRI Shapefile") -> None:
+        """Export the CE and CP fishnets from the intermediate storage.
+        This is meant to be the final step of the physiographic process.
+
+        Args:
+            driver (str, optional): OGR driver. Defaults to "ESRI Shapefile".
+        """
+        ext = {"ESRI Shapefile": ".shp", "GPKG": ".gpkg",
+               "FlatGeobuf": ".fgb", "GeoJSON": ".geojson"}[driver]
+        for name in ["CE_fishnet", "CP_fishnet"]:
+            out_path = os.path.join(
+                self._project_path, "geographic", name + ext)
+            self._storage.export(name, out_path, driver)
+
     @classmethod
     def _create_CEfishnet(cls,
                           basin: str,
                           dx: float,
                           dy: float,
-                          fishnet: str,
                           xoffset=0.0,
-                          yoffset=0.0) -> None:
+                          yoffset=0.0) -> gpd.GeoDataFrame:
         """_summary_
 
         Args:
             basin (str): _description_
             dx (float): _description_
             dy (float): _description_
-            fishnet (str): _description_
+
+        Returns:
+            gpd.GeoDataFrame: CE fishnet clipped to the basin
         """
         # Open the file from path
         watershed = ogr.Open(basin, gdal.GA_ReadOnly)
         lyr = watershed.GetLayer()
         xmin, xmax, ymin, ymax = lyr.GetExtent()
 
-        # get rows
-        rows = ceil((ymax-ymin)/dy)
-        # get columns
-        cols = ceil((xmax-xmin)/dx)
+        # get rows and columns (with an extra row/column when the offset
+        # moves the fishnet)
+        rows, cols = frag.fishnet_shape((xmin, xmax, ymin, ymax),
+                                        dx, dy, xoffset, yoffset)
 
         # start grid cell envelope
         ringXleftOrigin = xmin - xoffset
@@ -118,13 +400,11 @@ class Basin:
         ringYtopOrigin = ymax - yoffset
         ringYbottomOrigin = ymax - dy - yoffset
 
-        # create output file
-        outDriver = ogr.GetDriverByName('ESRI Shapefile')
-        if os.path.exists(fishnet):
-            os.remove(fishnet)
-        outDataSource = outDriver.CreateDataSource(fishnet)
+        # create output layer in memory
+        outDriver = ogr.GetDriverByName('MEMORY')
+        outDataSource = outDriver.CreateDataSource('')
         outLayer = outDataSource.CreateLayer(
-            fishnet, geom_type=ogr.wkbPolygon)
+            "CE_fishnet", lyr.GetSpatialRef(), geom_type=ogr.wkbPolygon)
         featureDefn = outLayer.GetLayerDefn()
         idField = ogr.FieldDefn("CEid", ogr.OFTInteger)
         outLayer.CreateField(idField)
@@ -167,17 +447,9 @@ class Basin:
             # new envelope for next poly
             ringXleftOrigin = ringXleftOrigin + dx
             ringXrightOrigin = ringXrightOrigin + dx
-        # Create prj file
-        proj = lyr.GetSpatialRef()
-        prj_path = fishnet.split(os.sep)
-        prj_file_name = fishnet.split(os.sep)[-1].replace(".shp", ".prj")
-        prj_path[-1] = prj_file_name
-        prj_path = os.sep.join(prj_path)
-        file = open(prj_path, 'w')
-        file.write(proj.ExportToWkt())
-        file.close()
         # Clean fishnet
         cls.clean_grids(basin, outDataSource)
+        return u.layer_to_gdf(outLayer)
 
     @classmethod
     def clean_grids(cls,
@@ -205,11 +477,10 @@ class Basin:
 
     @classmethod
     def join_shps(cls,
-                  CEfishnet: str,
-                  SubBasins: str,
-                  CPfishnet: str):
-        # Read in the shapefiles
-        gdf1 = gpd.read_file(CEfishnet)
+                  CEfishnet: gpd.GeoDataFrame,
+                  SubBasins: str) -> gpd.GeoDataFrame:
+        # Read in the subbasins
+        gdf1 = CEfishnet
         gdf2 = gpd.read_file(SubBasins)
         # Set the CAT Id in the subbasin dataset
         gdf2["CATid"] = range(1, len(gdf2)+1)
@@ -219,33 +490,20 @@ class Basin:
         gdf_union = gpd.overlay(gdf1, gdf2, how='union')
         # This is for rasterize it later
         gdf_union["CPid"] = range(1, len(gdf_union)+1)
-        if os.path.exists(CPfishnet):
-            os.remove(CPfishnet)
-        # Save the resulting GeoDataFrame as a shapefile
-        gdf_union.to_file(CPfishnet)
+        return gdf_union
 
     def create_CPfishnet(self):
-        # Check if the file already exist
-        if os.path.exists(self._CPfishnet):
-            os.remove(self._CPfishnet)
-
-        self.join_shps(self._CEfishnet,
-                    self._SubBasins,
-                    self._CPfishnet)
-        
-        
+        CPfishnet = self.join_shps(self._read_fishnet("CE_fishnet"),
+                                   self._SubBasins)
+        self._write_fishnet(CPfishnet, "CP_fishnet")
 
     def create_CEfishnet(self, xoffset = 0.0, yoffset = 0.0):
-        # Check if the file already exist
-        if os.path.exists(self._CEfishnet):
-            os.remove(self._CEfishnet)
-        
-        self._create_CEfishnet(self._Basin,
-                            self._dx,
-                            self._dy,
-                            self._CEfishnet,
-                            xoffset,
-                            yoffset)
+        CEfishnet = self._create_CEfishnet(self._Basin,
+                                           self._dx,
+                                           self._dy,
+                                           xoffset,
+                                           yoffset)
+        self._write_fishnet(CEfishnet, "CE_fishnet")
 
     def polish_CPfishnet(self, area_th=0.05):
         """_summary_
@@ -254,37 +512,36 @@ class Basin:
             area_th (float, optional): _description_. Defaults to 0.01.
             flow_th (float, optional): _description_. Defaults to 5e3.
         """
-        out_name = os.path.join(
-            self._project_path, "geographic", "CP_fishnet_test.shp")
         # Open fishnets as geodataframes
-        CEfishnet = gpd.read_file(self._CEfishnet)
-        CPfishnet = gpd.read_file(self._CPfishnet)
+        CEfishnet = self._read_fishnet("CE_fishnet")
+        CPfishnet = self._read_fishnet("CP_fishnet")
         # out_name = os.path.join(project_folder, "geographic", "CP_smallCP.shp")
         CPfishnet = CPfs.identify_small_CPs(CEfishnet, CPfishnet, area_th)
-        CPfishnet, CEfishnet = CPfs.remove_border_CPs(CEfishnet, CPfishnet, self._FAC)
+        CPfishnet, CEfishnet = CPfs.remove_border_CPs(CEfishnet, CPfishnet,
+                                                      self._rasters.get(self._FAC))
         CPfishnet = CPfs.remove_smallCP(CEfishnet,CPfishnet)
         CPfishnet = CPfs.dissolve_pixels(CEfishnet,CPfishnet,area_th)
         CPfishnet = CPfs.force_4CP(CEfishnet,CPfishnet,area_th)
         # Save the files with all the CP dissolved
-        CPfishnet.to_file(self._CPfishnet)
+        self._write_fishnet(CPfishnet, "CP_fishnet")
 
     def CP_routing(self, flow_th=1000):
         # Create the CP grid from the merged shp file
         # This has the same dimensions as the FAC file 
         # in order to compare them both to do the routing process
         # The CP grid is already processed and well polished
-        CP_array = u.rasterize_shp(self._CPfishnet,self._FAC,"CPid")
-        CE_array = u.rasterize_shp(self._CEfishnet,self._FAC,"CEid")
-
         # Open fishnets as geodataframes
-        CEfishnet = gpd.read_file(self._CEfishnet)
-        CPfishnet = gpd.read_file(self._CPfishnet)
+        CEfishnet = self._read_fishnet("CE_fishnet")
+        CPfishnet = self._read_fishnet("CP_fishnet")
+        CP_array = u.rasterize_shp(CPfishnet,self._FAC,"CPid")
+        CE_array = u.rasterize_shp(CEfishnet,self._FAC,"CEid")
+
         # Get the routing table. This table renames the CPs from the outlet
         # up to the last CP. Here the upstream CP are also identify for each
         # individual CP
         self.rtable, CPfishnet = CPfs.routing_table(CPfishnet,
                                                     CEfishnet,
-                                                    self._FAC,
+                                                    self._rasters.get(self._FAC),
                                                     CP_array,
                                                     CE_array)
         # Obtain the downstream CP based on the previous process
@@ -300,15 +557,21 @@ class Basin:
         # Compute cumulative percentage of surface area
         CPfishnet, upstreamCPs = CPfs.cumulative_areas(CPfishnet,CEfishnet,self.outlet_routes)
         # Compute the mean altitudes
-        CPfishnet, CEfishnet = CPfs.mean_altitudes(CEfishnet,CPfishnet,self._DEM)
+        CPfishnet, CEfishnet = CPfs.mean_altitudes(CEfishnet,CPfishnet,
+                                                   self._rasters.lazy(self._DEM))
+        # Main channel length and slope from the stream network
+        channels = self.main_channels(CP_array, flow_th)
+        CPfishnet["rivLength"] = CPfishnet["CPid"].map(channels["length"])
+        CPfishnet["rivSlope"] = CPfishnet["CPid"].map(channels["slope"])
         # Add the table to the structure
         # self.rtable = rtable
         # self.outlet_routes = outlet_routes
         # Export the tables as csv into the geographical information
         # self.rtable.to_csv(os.path.join(self._project_path, "geographic", "rtable.csv"),index=False)
         
-        np.savetxt("outlet_routes.csv",
-                   self.outlet_routes,delimiter=",",fmt="%1i")
+        if not self.in_memory:
+            np.savetxt(os.path.join(self._project_path, "geographic", "outlet_routes.csv"),
+                       self.outlet_routes,delimiter=",",fmt="%1i")
         # outlet_routes(,index=False)
         
         # Add rtable to the 
@@ -324,14 +587,15 @@ class Basin:
         self.CPfishnet = CPfishnet
         self.CEfishnet = CEfishnet
         # Save the files
-        CPfishnet.to_file(self._CPfishnet)
-        CEfishnet.to_file(self._CEfishnet)
+        self._write_fishnet(CPfishnet, "CP_fishnet")
+        self._write_fishnet(CEfishnet, "CE_fishnet")
 
     @classmethod
     def get_water_cover(cls,
                         shp_name: str,
                         shp_fishnet: gpd.GeoDataFrame,
-                        ref_raster: str, att: str)-> list:
+                        ref_raster: str, att: str,
+                        in_memory: bool = False)-> list:
         # Open the waterbody as geopandas
         waterBodies = gpd.read_file(shp_name)
         # Clip the water shp with the fishnet
@@ -339,16 +603,16 @@ class Basin:
         # Store the file in the folder
         # Create a new field to use it as reference raster attribute
         clip_shp_water["mask"] = 1
-        # Save to a temporary file
-        temp_shp_name = shp_name.replace(".shp","2.shp")
-        clip_shp_water.to_file(temp_shp_name)
-        # Save shp as rasterizd tiff
+        # Save shp as rasterizd tiff. The gdal virtual memory file system
+        # is used to avoid writing it when the basin is kept in memory
         temp_tif_name = shp_name.replace(".shp",".tif")
-        u.rasterize_shp_as_byte(temp_shp_name,ref_raster,"mask",temp_tif_name)
+        if in_memory:
+            temp_tif_name = "/vsimem/" + os.path.basename(temp_tif_name)
+        u.rasterize_shp_as_byte(clip_shp_water,ref_raster,"mask",temp_tif_name)
         # Get the x,y vaues of each shp feature
         bounds = shp_fishnet["geometry"].bounds
         shp_fishnet = pd.concat([shp_fishnet, bounds], axis=1)
-        ref_dataset = gdal.Open(ref_raster)
+        ref_dataset = rasters.raster_info(ref_raster)
         # * This function needs to have the index from 0 to len(df). So, here I fix this isssue.
         # !!Do not change the function since it is also used by other processes in the previous procedures.
         shp_fishnet.index = range(len(shp_fishnet))
@@ -364,20 +628,25 @@ class Basin:
             water.append(float(np.count_nonzero(raster_feature)/raster_feature.size*100.0))
         
         # Delete the temporary files
-        os.remove(shp_name.replace(".shp","2.shp"))
-        os.remove(shp_name.replace(".shp",".tif"))
+        if in_memory:
+            gdal.Unlink(temp_tif_name)
+        else:
+            os.remove(temp_tif_name)
         return water
 
 
     @classmethod
     def get_land_cover(cls,
                        gdf: gpd.GeoDataFrame,
-                       LC:str,att: str) -> tuple:
+                       LC: str | RasterArray,att: str) -> tuple:
         # Get the x,y vaues of each shp feature
         bounds = gdf["geometry"].bounds
         gdf = pd.concat([gdf, bounds], axis=1)
         # Open the reference dataset
-        LC_dataset = gdal.Open(LC)
+        if isinstance(LC, RasterArray):
+            LC_dataset = LC
+        else:
+            LC_dataset = rasters.raster_info(LC)
         # * This function needs to have the index from 0 to len(df). So, here I fix this isssue.
         # !!Do not change the function since it is also used by other processes in the previous procedures.
         gdf.index = range(len(gdf))
@@ -409,16 +678,18 @@ class Basin:
         # self.CEfishnet = CEfishnet
         # Get the landcover dataset
         pctForet, pctSolNu = self.get_land_cover(self.CEfishnet,
-                                        self._LC,
+                                        self._rasters.lazy(self._LC),
                                         "newCEid")
         # Get the lakes
         pctLacRiviere = self.get_water_cover(self._Waterbodies,
                              self.CEfishnet,
-                             self._DEM,"newCEid")
+                             self._DEM,"newCEid",
+                             self.in_memory)
         # Get the marshes
         pctMarais = self.get_water_cover(self._Wetlands,
                              self.CEfishnet,
-                             self._DEM,"newCEid")
+                             self._DEM,"newCEid",
+                             self.in_memory)
         # Scale the percentages to make sure that they all sum up 100%
         CE_shp = np.array(pctLacRiviere) + np.array(pctMarais)
         CE_tif = np.array(pctForet) + np.array(pctSolNu)
@@ -434,24 +705,17 @@ class Basin:
         # Place the values into the dataset
         self.CEfishnet["i"] = coordinates["i"].values
         self.CEfishnet["j"] = coordinates["j"].values
-        # Create the carreauxEntier dataset
-        self.carreauxEntiers = pd.DataFrame(columns=["CEid","i","j","pctLacRiviere",
-                                                     "pctForet","pctMarais","pctSolNu",
-                                                     "altitude"],
-                                       index=coordinates.index,
-                                       data=np.c_[coordinates["CEid"].values,
-                                                  coordinates["i"].values,
-                                                  coordinates["j"].values,
-                                                  np.array(pctLacRiviere).astype("float"),
-                                                  pctForet.astype("float"),
-                                                  np.array(pctMarais).astype("float"),
-                                                  pctSolNu.astype("float"),
-                                                  self.CEfishnet["altitude"].values])
-        # Change the values that must be integer types
-        self.carreauxEntiers["CEid"] = self.carreauxEntiers["CEid"].astype("uint16")
-        self.carreauxEntiers["i"] = self.carreauxEntiers["i"].astype("uint8")
-        self.carreauxEntiers["j"] = self.carreauxEntiers["j"].astype("uint8")
-        self.CEfishnet.to_file(self._CEfishnet)
+        # Create the carreauxEntier table. Each column gets its own type
+        self.carreauxEntiers = tables.CarreauxEntiers({
+            "CEid": coordinates["CEid"].values,
+            "i": coordinates["i"].values,
+            "j": coordinates["j"].values,
+            "pctLacRiviere": pctLacRiviere,
+            "pctForet": pctForet,
+            "pctMarais": pctMarais,
+            "pctSolNu": pctSolNu,
+            "altitude": self.CEfishnet["altitude"].values})
+        self._write_fishnet(self.CEfishnet, "CE_fishnet")
         # self.carreauxEntiers.to_csv("carreauxEntiers.csv")
 
     def carreauxPartiels_struct(self):
@@ -475,16 +739,18 @@ class Basin:
         codes = CPs.get_codes(self.CPfishnet)
         # Get the landcover dataset
         pctForet, pctSolNu = self.get_land_cover(self.CPfishnet,
-                                        self._LC,
+                                        self._rasters.lazy(self._LC),
                                         "newCPid")
         # Get the lakes
         pctLacRiviere = self.get_water_cover(self._Waterbodies,
                              self.CPfishnet,
-                             self._DEM,"newCPid")
+                             self._DEM,"newCPid",
+                             self.in_memory)
         # Get the marshes
         pctMarais = self.get_water_cover(self._Wetlands,
                              self.CPfishnet,
-                             self._DEM,"newCPid")
+                             self._DEM,"newCPid",
+                             self.in_memory)
         # Scale the percentages to make sure that they all sum up 100%
         CP_shp = np.array(pctLacRiviere) + np.array(pctMarais)
         CP_tif = np.array(pctForet) + np.array(pctSolNu)
@@ -503,49 +769,36 @@ class Basin:
         # Place the values into the dataset
         self.CPfishnet["i"] = coordinates["i"].values
         self.CPfishnet["j"] = coordinates["j"].values
-        # Create the carreauxPartiel dataset
-        self.carreauxPartiels = pd.DataFrame(columns=["CPid","i","j","code",
-                                                     "pctSurface","idCPAval","idCPsAmont",
-                                                     "CEid","pctEau","pctForet","pctMarais",
-                                                     "pctSolNu","altitudeMoy","profondeurMin",
-                                                     "longueurCoursEauPrincipal","largeurCoursEauPrincipal",
-                                                     "penteRiviere","cumulPctSuperficieCPAmont","cumulPctSuperficieLacsAmont",
-                                                     "cumulPctSuperficieMaraisAmont","cumulPctSuperficieForetAmont"],
-                                       index=coordinates.index,
-                                       data=np.c_[coordinates["CPid"].values,
-                                                  coordinates["i"].values,
-                                                  coordinates["j"].values,
-                                                  np.array(codes),
-                                                  self.CPfishnet["pctSurface"].values,
-                                                  self.rtable["downstreamCPs"].values,
-                                                  self.rtable["upstreamCPs"].values,
-                                                  self.CPfishnet["newCEid"].values,
-                                                  np.array(pctLacRiviere),
-                                                  pctForet,
-                                                  np.array(pctMarais),
-                                                  pctSolNu,
-                                                  self.CPfishnet["altitude"].values,
-                                                  geometry["profondeurMin"].values,
-                                                  geometry["longueurCoursEauPrincipal"].values,
-                                                  geometry["largeurCoursEauPrincipal"].values,
-                                                  geometry["penteRiviere"].values,
-                                                  self.CPfishnet["cumulPctSurf"].values,
-                                                  cumulates["cumulPctSuperficieLacsAmont"].values,
-                                                  cumulates["cumulPctSuperficieMaraisAmont"].values,
-                                                  cumulates["cumulPctSuperficieForetAmont"].values,
-                                                  ])
-        # Change the values that must be integer types
-        self.carreauxPartiels["CEid"] = np.array(self.carreauxPartiels["CEid"],dtype=np.int16)
-        self.carreauxPartiels["CPid"] = np.array(self.carreauxPartiels["CPid"],dtype=np.int16)
-        self.carreauxPartiels["idCPAval"] = np.array(self.carreauxPartiels["idCPAval"],dtype=np.int16)
-        self.carreauxPartiels["i"] = np.array(self.carreauxPartiels["i"],dtype=np.int8)
-        self.carreauxPartiels["j"] = np.array(self.carreauxPartiels["j"],dtype=np.int8)
-        self.carreauxPartiels["code"] = np.array(self.carreauxPartiels["code"],dtype=np.int8)
-        self.carreauxPartiels["penteRiviere"] = np.array(self.carreauxPartiels["penteRiviere"],dtype=np.float32)
+        # Create the carreauxPartiel table. The upstream CPs are stored as
+        # CSR arrays instead of one list per row
+        self.carreauxPartiels = tables.CarreauxPartiels({
+            "CPid": coordinates["CPid"].values,
+            "i": coordinates["i"].values,
+            "j": coordinates["j"].values,
+            "code": codes,
+            "pctSurface": self.CPfishnet["pctSurface"].values,
+            "idCPAval": self.rtable["downstreamCPs"].values,
+            "idCPsAmont": tables.RaggedArray.from_lists(self.rtable["upstreamCPs"].values),
+            "CEid": self.CPfishnet["newCEid"].values,
+            "pctEau": pctLacRiviere,
+            "pctForet": pctForet,
+            "pctMarais": pctMarais,
+            "pctSolNu": pctSolNu,
+            "altitudeMoy": self.CPfishnet["altitude"].values,
+            "profondeurMin": geometry["profondeurMin"].values,
+            "longueurCoursEauPrincipal": geometry["longueurCoursEauPrincipal"].values,
+            "largeurCoursEauPrincipal": geometry["largeurCoursEauPrincipal"].values,
+            "penteRiviere": geometry["penteRiviere"].values,
+            "cumulPctSuperficieCPAmont": self.CPfishnet["cumulPctSurf"].values,
+            "cumulPctSuperficieLacsAmont": cumulates["cumulPctSuperficieLacsAmont"].values,
+            "cumulPctSuperficieMaraisAmont": cumulates["cumulPctSuperficieMaraisAmont"].values,
+            "cumulPctSuperficieForetAmont": cumulates["cumulPctSuperficieForetAmont"].values})
         # self.carreauxPartiels.to_csv("carreauxPartiels.csv")
-        self.CPfishnet.to_file(self._CPfishnet)
+        self._write_fishnet(self.CPfishnet, "CP_fishnet")
 
-    def create_bassinVersant_structure(self):
+    def create_bassinVersant_structure(self,
+                                       binary: str = None,
+                                       compact: bool = False):
         # This structure will be stored as json format. This json format
         # will be easily translatet into .mat file for being read by Matlab
         # and also, will serve as one of the main input files in the OpenCEQUEAU
@@ -553,9 +806,6 @@ class Basin:
         # *Temporary lines to read the csv files.
         # self.carreauxEntiers = pd.read_csv("carreauxEntiers.csv",index_col=0)
         # self.carreauxPartiels = pd.read_csv("carreauxPartiels.csv",index_col=0)
-        # Get the column names from the carreux partiels and entiers structures
-        columns_CE = self.carreauxEntiers.columns.tolist()
-        columns_CP = self.carreauxPartiels.columns.tolist()
         # Create the dictionary structure
         self.bassinVersant = {
             "nbCpCheminLong": [],
@@ -565,77 +815,123 @@ class Basin:
             "carreauxEntiers": {},
             "carreauxPartiels": {}
         }
-        # Send the carreuxEntiers values
-        for CE_name in columns_CE:
-            self.bassinVersant["carreauxEntiers"].update({CE_name: self.carreauxEntiers[CE_name].values.tolist()})
-        # Send the carreuxPartiels values
-        for CP_name in columns_CP:
-            self.bassinVersant["carreauxPartiels"].update({CP_name: self.carreauxPartiels[CP_name].values.tolist()})
+        # Send the carreuxEntiers and carreuxPartiels tables. The columns
+        # are only converted to lists while they are written
+        self.bassinVersant["carreauxEntiers"] = self.carreauxEntiers
+        self.bassinVersant["carreauxPartiels"] = self.carreauxPartiels
         self.bassinVersant["superficieCE"] = self._dx*self._dy*1.0e-6
         self.bassinVersant["nomBassinVersant"] = self.name
-        self.bassinVersant["nbCpCheminLong"] = self.outlet_routes.shape[1] 
-        # Save the files in the results folder
-        with open(os.path.join(self._project_path, "results","bassinVersant.json"), "w") as outfile:
-            json.dump(self.bassinVersant, outfile,indent = 4)
-        pass
-
-    def create_CEgrid(self):
-        # Default no data value of the CAT raster
-        # ref_raster = gdal.Open(self._DEM,gdal.GA_ReadOnly)
-        CE_shp = ogr.Open(self._CEfishnet, gdal.GA_ReadOnly)
-        lyr = CE_shp.GetLayer()
-        # new_field = ogr.FieldDefn('CEid', ogr.OFTInteger)
-        # lyr.CreateField(new_field)
-        # for i, aa in enumerate(lyr):
-        #     feature = lyr.GetFeature(i)
-        #     feature.SetField("id2", i+1)
-        #     lyr.SetFeature(feature)
-        # Get the raster extent
-        # xmin, xmax, ymin, ymax, xpixel, ypixel = u.GetExtent(self._DEM)
-        # width = self._DEM.RasterXSize
-        # height = self._DEM.RasterYSize
-        # xmax = xmin + width*xpixel
-        # ymin = ymax + height*ypixel
+        self.bassinVersant["nbCpCheminLong"] = int(self.outlet_routes.shape[1])
+        # Save the files in the results folder. The json is streamed from
+        # the tables (indent=4 unless compact)
+        bv.write_json(self.bassinVersant,
+                      os.path.join(self._project_path, "results", "bassinVersant.json"),
+                      compact)
+        # Binary export (nc, npz or the MATLAB mat) of the same structure
+        if binary is not None:
+            bv.__writers__[binary](self.bassinVersant,
+                                   os.path.join(self._project_path, "results",
+                                                "bassinVersant." + binary))
+
+    def _rasterize_fishnet(self,
+                           name: str,
+                           field: str,
+                           scale: int = 1,
+                           in_memory: bool = None,
+                           tile: int = 256) -> gdal.Dataset:
+        """Rasterize the ids of a fishnet on the CE grid, refined by scale.
+        The grid starts at the bottom-left corner of the fishnet (positive
+        dy), as expected by find_grid_coordinates. The raster type is the
+        smallest unsigned integer that holds the ids and the GeoTIFF is
+        tiled, so GDAL rasterizes it block by block.
+
+        Args:
+            name (str): Fishnet name (CE_fishnet or CP_fishnet)
+            field (str): Id field
+            scale (int, optional): Cells per CE side. Defaults to 1.
+            in_memory (bool, optional): Create the raster with the MEM driver
+            instead of writing geographic/<name>.tif. Defaults to None
+            (same as the basin).
+            tile (int, optional): Tile size of the GeoTIFF (multiple of 16).
+            Defaults to 256.
+
+        Returns:
+            gdal.Dataset: Label raster (0 is no data)
+        """
+        fishnet = self._read_fishnet(name)
+        ogr_fishnet = u.gdf_to_ogr(fishnet, [field])
+        lyr = ogr_fishnet.GetLayer()
         proj = lyr.GetSpatialRef()
         xmin, xmax, ymin, ymax = lyr.GetExtent()
         # Get the resolution to the new raster
-        x_res = int((xmax-xmin)/self._dx)
-        y_res = int((ymax-ymin)/self._dy)
-        # Get dimenssions for the CEgrid rasters
-
-        # CEgrid path
-        path = os.path.join(self._project_path, "geographic", "CEgrid.tif")
-        self._CEgrid = gdal.GetDriverByName('GTiff').Create(
-            path, abs(x_res), abs(y_res), 1, gdal.GDT_Int32)
-        self._CEgrid.SetProjection(proj.ExportToWkt())
-        self._CEgrid.SetGeoTransform((xmin, self._dx, 0, ymin, 0, self._dy))
-        band = self._CEgrid.GetRasterBand(1)
+        x_res = abs(int((xmax-xmin)/self._dx))*scale
+        y_res = abs(int((ymax-ymin)/self._dy))*scale
+        # GDAL < 3.5 has no 64 bits raster type
+        dtype = tables.min_dtype(fishnet[field].fillna(0).values.astype(np.int64),
+                                 max_bits=32)
+        # Keep it in memory if no intermediate files are written
+        if self.in_memory if in_memory is None else in_memory:
+            path, driver, options = "", "MEM", []
+        else:
+            path = os.path.join(self._project_path, "geographic",
+                                name.replace("_fishnet", "grid") + ".tif")
+            driver = "GTiff"
+            options = ["TILED=YES", "COMPRESS=DEFLATE",
+                       f"BLOCKXSIZE={tile}", f"BLOCKYSIZE={tile}"]
+        grid = gdal.GetDriverByName(driver).Create(
+            path, x_res, y_res, 1,
+            gdal_array.NumericTypeCodeToGDALTypeCode(dtype), options=options)
+        grid.SetProjection(proj.ExportToWkt())
+        grid.SetGeoTransform((xmin, self._dx/scale, 0, ymin, 0, self._dy/scale))
+        band = grid.GetRasterBand(1)
         band.SetNoDataValue(0)
+        gdal.RasterizeLayer(grid, [1], lyr, options=[f"ATTRIBUTE={field}"])
         band.FlushCache()
-        gdal.RasterizeLayer(self._CEgrid, [1], lyr, options=["ATTRIBUTE=newCEid"])
-        data_array = band.ReadAsArray()
-        return data_array
-
-    def create_CPgrid(self):
-        # Default no data value of the CAT raster
-        nodata = self._CAT.GetRasterBand(1).GetNoDataValue()
-        lyr = self._CPfishnet.GetLayer()
-        proj = lyr.GetSpatialRef()
-        xmin, xmax, ymin, ymax = lyr.GetExtent()
-        # Get the resolution to the new raster
-        scale = 25
-        x_res = int((xmax-xmin)/self._dx)*scale
-        y_res = int((ymax-ymin)/self._dy)*scale
-        # Make the Union between the two shps
-        path = os.path.join(self._project_path, "geographic", "CPgrid.tif")
-        self._CPgrid = gdal.GetDriverByName('GTiff').Create(
-            path, abs(x_res), abs(y_res), 1, gdal.GDT_Int32)
-        # print(self._CPgrid)
-        # print(path)
-        print(abs(x_res), abs(y_res))
-        self._CPgrid.SetProjection(proj.ExportToWkt())
-        self._CPgrid.SetGeoTransform(
-            (xmin, self._dx/scale, 0, ymin, 0, self._dy/scale))
-        band = self._CPgrid.GetRasterBand(1)
-        band.SetNoDataValue(0)
-        gdal.RasterizeLayer(self._CPgrid, [1], lyr, options=["ATTRIBUTE=newCPid"])
+        return grid
+
+    def create_CEgrid(self, in_memory: bool = None) -> np.ndarray:
+        """Raster of the CE ids on the CE grid. It is rasterized once and
+        kept in the raster cache until the CE fishnet changes, so the meteo
+        interpolation and the CE structure share the same grid. The gdal
+        dataset is kept in self._CEgrid.
+
+        Args:
+            in_memory (bool, optional): Do not write geographic/CEgrid.tif.
+            Defaults to None (same as the basin).
+
+        Returns:
+            np.ndarray: CE ids (0 out of the basin)
+        """
+        key = self._CEfishnet + ":grid"
+        if key not in self._rasters:
+            self._CEgrid = self._rasterize_fishnet("CE_fishnet", "newCEid",
+                                                   in_memory=in_memory)
+            self._rasters.add(key, RasterArray(self._CEgrid.ReadAsArray(),
+                                               self._CEgrid.GetGeoTransform(),
+                                               self._CEgrid.GetProjection(),
+                                               0))
+        return self._rasters.get(key).array
+
+    def create_CPgrid(self,
+                      scale: int = 25,
+                      in_memory: bool = None,
+                      tile: int = 256) -> gdal.Dataset:
+        """Raster of the CP ids, scale times finer than the CE grid. The
+        raster is kept as a gdal dataset (self._CPgrid) until the CP fishnet
+        changes, so the callers can read it by windows instead of loading
+        the whole fine grid.
+
+        Args:
+            scale (int, optional): Cells per CE side. Defaults to 25.
+            in_memory (bool, optional): Do not write geographic/CPgrid.tif.
+            Defaults to None (same as the basin).
+            tile (int, optional): Tile size of the GeoTIFF. Defaults to 256.
+
+        Returns:
+            gdal.Dataset: CP ids (0 out of the basin)
+        """
+        grid = getattr(self, "_CPgrid", None)
+        if grid is None or not np.isclose(grid.GetGeoTransform()[1], self._dx/scale):
+            self._CPgrid = self._rasterize_fishnet("CP_fishnet", "newCPid", scale,
+                                                   in_memory, tile)
+        return self._CPgrid
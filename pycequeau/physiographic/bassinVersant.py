@@ -0,0 +1,446 @@
+from __future__ import annotations
+
+import os
+import re
+import json
+import mmap
+import netCDF4
+import numpy as np
+from collections.abc import Mapping
+from pycequeau.core import matlab
+from pycequeau.physiographic.tables import (
+    CarreauxEntiers,
+    CarreauxPartiels,
+    RaggedArray
+)
+
+# Scalar entries of the bassinVersant structure
+__scalars__ = ["nomBassinVersant", "superficieCE", "nbCpCheminLong"]
+# Tables of the bassinVersant structure and the dimension of their rows
+__tables__ = {"carreauxEntiers": (CarreauxEntiers, "CE"),
+              "carreauxPartiels": (CarreauxPartiels, "CP")}
+
+
+def _ragged_names(name: str) -> tuple:
+    # Names of the CSR arrays of a list column
+    return name, name + "_offsets"
+
+
+def write_netcdf(bassinVersant: dict, path: str) -> None:
+    """Write the bassinVersant structure as a NetCDF4 file. Each table is a
+    group with one typed variable per column. The list columns are stored
+    as CSR: the values and the offsets (0 based) where each row starts.
+    The file can be read with the MATLAB ncread/h5read functions.
+
+    Args:
+        bassinVersant (dict): Structure with the CE/CP tables
+        path (str): Output path
+    """
+    with netCDF4.Dataset(path, "w", format="NETCDF4") as nc:
+        nc.setncattr("nomBassinVersant", str(bassinVersant["nomBassinVersant"]))
+        nc.setncattr("superficieCE", float(bassinVersant["superficieCE"]))
+        nc.setncattr("nbCpCheminLong", int(bassinVersant["nbCpCheminLong"]))
+        nc.createGroup("barrage")
+        for table_name, (_, dim) in __tables__.items():
+            table = bassinVersant[table_name]
+            group = nc.createGroup(table_name)
+            group.createDimension(dim, len(table))
+            for name in table.columns:
+                column = table[name]
+                if isinstance(column, RaggedArray):
+                    values_name, offsets_name = _ragged_names(name)
+                    group.createDimension(values_name, column.values.size)
+                    group.createDimension(offsets_name, len(column) + 1)
+                    var = group.createVariable(values_name, column.values.dtype,
+                                               (values_name,), zlib=True)
+                    var[:] = column.values
+                    var.setncattr("ragged", f"row k is {name}[{offsets_name}[k]:{offsets_name}[k+1]]")
+                    var = group.createVariable(offsets_name, np.int64, (offsets_name,))
+                    var[:] = column.offsets
+                else:
+                    var = group.createVariable(name, column.dtype, (dim,), zlib=True)
+                    var[:] = column
+
+
+def write_npz(bassinVersant: dict, path: str) -> None:
+    """Write the bassinVersant structure as a compressed .npz file. The keys
+    are table.column and the list columns are stored as CSR
+    (table.column and table.column_offsets).
+
+    Args:
+        bassinVersant (dict): Structure with the CE/CP tables
+        path (str): Output path
+    """
+    arrays = {name: np.asarray(bassinVersant[name]) for name in __scalars__}
+    for table_name in __tables__:
+        table = bassinVersant[table_name]
+        for name in table.columns:
+            column = table[name]
+            if isinstance(column, RaggedArray):
+                values_name, offsets_name = _ragged_names(name)
+                arrays[f"{table_name}.{values_name}"] = column.values
+                arrays[f"{table_name}.{offsets_name}"] = column.offsets
+            else:
+                arrays[f"{table_name}.{name}"] = column
+    np.savez_compressed(path, **arrays)
+
+
+def write_mat(bassinVersant: dict, path: str) -> None:
+    """Write the bassinVersant structure as the bassin_struct variable of a
+    MATLAB v7.3 .mat file. The CE/CP tables are 1xN struct arrays (one
+    element per row, the upstream CPs as zero padded row vectors), the
+    layout fix_struct builds from the json file.
+
+    Args:
+        bassinVersant (dict): Structure with the CE/CP tables
+        path (str): Output path
+    """
+    bassin_struct = {}
+    for key, value in bassinVersant.items():
+        if key not in __tables__:
+            bassin_struct[key] = value
+            continue
+        fields = {}
+        for name in __tables__[key][0].__columns__:
+            column = value[name]
+            fields[name] = column.to_padded() if isinstance(column, RaggedArray) \
+                else np.asarray(column)
+        bassin_struct[key] = matlab.StructArray(fields)
+    matlab.write_mat(path, {"bassin_struct": bassin_struct})
+
+
+def _format_values(values: list) -> list:
+    # Same representation than the json module (NaN and Infinity included)
+    return [json.dumps(v) for v in values] if values and isinstance(values[0], float) \
+        else [str(v) for v in values]
+
+
+def _write_column(f,
+                  column: np.ndarray | RaggedArray,
+                  indent: str,
+                  level: int,
+                  chunk_size: int) -> None:
+    # Write one column as a json list. The values are converted by chunks so
+    # only chunk_size python objects exist at the same time
+    if len(column) == 0:
+        f.write("[]")
+        return
+    if indent is None:
+        sep, open_list, close_list, row_sep = ",", "[", "]", ","
+        inner_open, inner_close, inner_sep = "[", "]", ","
+    else:
+        pad = "\n" + indent*(level + 1)
+        sep, open_list, close_list = "," + pad, "[" + pad, "\n" + indent*level + "]"
+        inner_pad = "\n" + indent*(level + 2)
+        inner_open, inner_close = "[" + inner_pad, "\n" + indent*(level + 1) + "]"
+        inner_sep = "," + inner_pad
+        row_sep = sep
+    f.write(open_list)
+    if isinstance(column, RaggedArray):
+        # The lists are written zero padded to the longest one
+        lengths = column.lengths
+        width = max(int(lengths.max()) if lengths.size else 0, 1)
+        for start in range(0, len(column), chunk_size):
+            stop = min(start + chunk_size, len(column))
+            offsets = column.offsets[start:stop+1]
+            chunk = RaggedArray(column.values[offsets[0]:offsets[-1]],
+                                offsets - offsets[0]).to_padded(width)
+            rows = [inner_open + inner_sep.join(_format_values(row)) + inner_close
+                    for row in chunk.tolist()]
+            if start > 0:
+                f.write(row_sep)
+            f.write(row_sep.join(rows))
+    else:
+        for start in range(0, len(column), chunk_size):
+            if start > 0:
+                f.write(sep)
+            f.write(sep.join(_format_values(column[start:start+chunk_size].tolist())))
+    f.write(close_list)
+
+
+def write_json(bassinVersant: dict,
+               path: str,
+               compact: bool = False,
+               chunk_size: int = 65536) -> None:
+    """Write the bassinVersant structure as json, streaming the CE/CP columns
+    from their arrays. The output is the same as json.dump(indent=4) of the
+    dictionary of lists, but the lists are never built in memory.
+
+    Args:
+        bassinVersant (dict): Structure with the CE/CP tables
+        path (str): Output path
+        compact (bool, optional): Write without indentation nor spaces.
+        Defaults to False.
+        chunk_size (int, optional): Values converted at once.
+        Defaults to 65536.
+    """
+    indent = None if compact else " "*4
+    if compact:
+        nl = lambda level: ""
+        key_sep, item_sep = ":", ","
+    else:
+        nl = lambda level: "\n" + indent*level
+        key_sep, item_sep = ": ", ","
+    with open(path, "w") as f:
+        f.write("{")
+        for k, (key, value) in enumerate(bassinVersant.items()):
+            if k > 0:
+                f.write(item_sep)
+            f.write(nl(1) + json.dumps(key) + key_sep)
+            if key not in __tables__:
+                f.write(json.dumps(value, indent=indent,
+                                   separators=(item_sep, key_sep)).replace("\n", nl(1)))
+                continue
+            table = value
+            f.write("{")
+            for c, name in enumerate(table.columns):
+                if c > 0:
+                    f.write(item_sep)
+                f.write(nl(2) + json.dumps(name) + key_sep)
+                _write_column(f, table[name], indent, 2, chunk_size)
+            f.write(nl(1) + "}" if len(table.columns) else "}")
+        f.write(nl(0) + "}")
+
+
+def _read_netcdf(path: str) -> dict:
+    bassinVersant = {"barrage": {}}
+    with netCDF4.Dataset(path, "r") as nc:
+        nc.set_auto_mask(False)
+        for name in __scalars__:
+            bassinVersant[name] = nc.getncattr(name)
+        for table_name, (table_cls, _) in __tables__.items():
+            group = nc.groups[table_name]
+            data = {}
+            for name in table_cls.__columns__:
+                if name in table_cls.__ragged__:
+                    values_name, offsets_name = _ragged_names(name)
+                    data[name] = RaggedArray(group.variables[values_name][:],
+                                             group.variables[offsets_name][:])
+                else:
+                    data[name] = group.variables[name][:]
+            bassinVersant[table_name] = table_cls(data)
+    return bassinVersant
+
+
+def _read_npz(path: str) -> dict:
+    bassinVersant = {"barrage": {}}
+    with np.load(path) as npz:
+        for name in __scalars__:
+            bassinVersant[name] = npz[name].item()
+        for table_name, (table_cls, _) in __tables__.items():
+            data = {}
+            for name in table_cls.__columns__:
+                if name in table_cls.__ragged__:
+                    values_name, offsets_name = _ragged_names(name)
+                    data[name] = RaggedArray(npz[f"{table_name}.{values_name}"],
+                                             npz[f"{table_name}.{offsets_name}"])
+                else:
+                    data[name] = npz[f"{table_name}.{name}"]
+            bassinVersant[table_name] = table_cls(data)
+    return bassinVersant
+
+
+def _read_json(path: str) -> dict:
+    with open(path, "r") as f:
+        return json.loads(f.read())
+
+
+# Readers of each bassinVersant format
+__readers__ = {".json": _read_json,
+               ".nc": _read_netcdf,
+               ".npz": _read_npz}
+# Writers of the binary formats
+__writers__ = {"nc": write_netcdf,
+               "npz": write_npz,
+               "mat": write_mat}
+
+
+# Json tokens needed to find where a value ends: strings and brackets
+_tokens = re.compile(rb'"(?:[^"\\]|\\.)*"|[\[\]{}]')
+_string = re.compile(rb'"(?:[^"\\]|\\.)*"')
+_scalar = re.compile(rb'[^,}\]\s]+')
+_blank = re.compile(rb'[\s:,]*')
+_numeric_list = re.compile(rb'\[\s*[-0-9NI\]]')
+_nested_list = re.compile(rb'\[\s*\[\s*[-0-9NI\]]')
+_nested_end = re.compile(rb'\]\s*\]')
+
+
+def _value_end(buf, pos: int) -> int:
+    # End of the json value starting at pos. The numbers inside the lists
+    # are skipped by the regex engine, only the brackets are visited
+    char = buf[pos:pos+1]
+    if char == b'"':
+        return _string.match(buf, pos).end()
+    if char not in (b"[", b"{"):
+        return _scalar.match(buf, pos).end()
+    # The CE/CP columns are lists of numbers or lists of lists of numbers
+    # (idCPsAmont). Their end is found without visiting each bracket
+    if _numeric_list.match(buf, pos):
+        return buf.find(b"]", pos) + 1
+    if _nested_list.match(buf, pos):
+        return _nested_end.search(buf, pos).end()
+    depth = 0
+    for token in _tokens.finditer(buf, pos):
+        first = token.group()[:1]
+        if first in (b"[", b"{"):
+            depth += 1
+        elif first in (b"]", b"}"):
+            depth -= 1
+            if depth == 0:
+                return token.end()
+    raise ValueError("Unbalanced json value")
+
+
+def _index_object(buf, pos: int, nested: tuple = ()) -> tuple:
+    # Spans of the members of the json object starting at pos. The members
+    # listed in nested are indexed too, instead of being skipped
+    if buf[pos:pos+1] != b"{":
+        raise ValueError("Expected a json object")
+    spans = {}
+    members = {}
+    pos = _blank.match(buf, pos + 1).end()
+    while buf[pos:pos+1] != b"}":
+        key = _string.match(buf, pos)
+        if key is None:
+            raise ValueError("Expected a json key")
+        name = json.loads(key.group())
+        start = _blank.match(buf, key.end()).end()
+        if name in nested:
+            members[name], _, end = _index_object(buf, start)
+        else:
+            end = _value_end(buf, start)
+        spans[name] = (start, end)
+        pos = _blank.match(buf, end).end()
+    return spans, members, pos + 1
+
+
+class _LazySection(Mapping):
+    def __init__(self, loader, names: list) -> None:
+        # Columns of a CE/CP table decoded on first access
+        self._loader = loader
+        self._names = list(names)
+        self._values = {}
+
+    def __getitem__(self, name: str):
+        if name not in self._names:
+            raise KeyError(name)
+        if name not in self._values:
+            self._values[name] = self._loader(name)
+        return self._values[name]
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    @property
+    def columns(self) -> list:
+        return self._names
+
+
+class LazyBassinVersant(Mapping):
+    def __init__(self, path: str) -> None:
+        """bassinVersant structure that only decodes the accessed entries.
+        The json file is indexed once (start and end of each entry and of
+        each CE/CP column) and each column is decoded on first access. For
+        the .nc and .npz files only the accessed variables are read.
+        The entries are the same ones given by read_bassinVersant.
+
+        Args:
+            path (str): Path to the .json, .nc or .npz file
+        """
+        self.path = path
+        self._ext = os.path.splitext(path)[1].lower()
+        if self._ext not in __readers__:
+            raise ValueError(
+                f"bassinVersant format {self._ext} not supported. Use one of: {list(__readers__)}")
+        self._values = {}
+        if self._ext == ".json":
+            self._index_json()
+        else:
+            self._keys = __scalars__[:1] + ["barrage"] + __scalars__[1:] + list(__tables__)
+
+    def _index_json(self) -> None:
+        with open(self.path, "rb") as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = _blank.match(self._buf, 0).end()
+        self._spans, self._columns, _ = _index_object(self._buf, start,
+                                                      tuple(__tables__))
+        self._keys = list(self._spans)
+
+    def _decode(self, span: tuple):
+        return json.loads(self._buf[span[0]:span[1]])
+
+    def _read_column(self, table_name: str, name: str):
+        if self._ext == ".json":
+            return self._decode(self._columns[table_name][name])
+        table_cls = __tables__[table_name][0]
+        ragged = name in table_cls.__ragged__
+        values_name, offsets_name = _ragged_names(name)
+        if self._ext == ".nc":
+            with netCDF4.Dataset(self.path, "r") as nc:
+                nc.set_auto_mask(False)
+                group = nc.groups[table_name]
+                if ragged:
+                    return RaggedArray(group.variables[values_name][:],
+                                       group.variables[offsets_name][:])
+                return group.variables[name][:]
+        with np.load(self.path) as npz:
+            if ragged:
+                return RaggedArray(npz[f"{table_name}.{values_name}"],
+                                   npz[f"{table_name}.{offsets_name}"])
+            return npz[f"{table_name}.{name}"]
+
+    def _read_entry(self, key: str):
+        if key in __tables__:
+            if self._ext == ".json":
+                names = list(self._columns[key])
+            else:
+                names = list(__tables__[key][0].__columns__)
+            return _LazySection(lambda name: self._read_column(key, name), names)
+        if self._ext == ".json":
+            return self._decode(self._spans[key])
+        if key == "barrage":
+            return {}
+        if self._ext == ".nc":
+            with netCDF4.Dataset(self.path, "r") as nc:
+                return nc.getncattr(key)
+        with np.load(self.path) as npz:
+            return npz[key].item()
+
+    def __getitem__(self, key: str):
+        if key not in self._keys:
+            raise KeyError(key)
+        if key not in self._values:
+            self._values[key] = self._read_entry(key)
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+def read_bassinVersant(path: str, lazy: bool = False) -> dict | LazyBassinVersant:
+    """Read a bassinVersant structure. The json file gives the same lists
+    written by create_bassinVersant_structure. The binary files (.nc, .npz)
+    give the CE/CP tables, whose columns are indexed by name just like the
+    json dictionaries.
+
+    Args:
+        path (str): Path to the .json, .nc or .npz file
+        lazy (bool, optional): Only decode the entries when they are
+        accessed. Defaults to False.
+
+    Returns:
+        dict | LazyBassinVersant: bassinVersant structure
+    """
+    if lazy:
+        return LazyBassinVersant(path)
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in __readers__:
+        raise ValueError(
+            f"bassinVersant format {ext} not supported. Use one of: {list(__readers__)}")
+    return __readers__[ext](path)
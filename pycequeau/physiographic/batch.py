@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import traceback
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pycequeau.physiographic.base import Basin
+from pycequeau.core import rasters
+
+# Order of the files expected by the Basin object
+__files__ = ["DEM", "FAC", "LC", "Basin", "SubBasins", "Waterbodies", "Wetlands"]
+# Rasters shared between the worker processes
+__shared__ = ["DEM", "FAC", "LC"]
+
+
+def read_manifest(path: str) -> list:
+    """Read the manifest with the basins to build
+
+    The manifest is either a json file with a list of entries or a csv file
+    with one basin per row. Each entry contains:
+    project_folder, basin_name, the files (DEM, FAC, LC, Basin, SubBasins,
+    Waterbodies, Wetlands) or a "files" list in the json case, and the grid
+    dimensions dx and dy. Optional keys: xoffset, yoffset, area_th, flow_th
+    and storage.
+
+    Args:
+        path (str): Path to the manifest
+
+    Returns:
+        list: List of dictionaries, one per basin
+    """
+    if path.endswith(".json"):
+        with open(path, "r") as f:
+            manifest = json.load(f)
+    elif path.endswith(".csv"):
+        # The blank cells of the optional columns are read as NaN: drop them
+        # so the defaults of the stages are used
+        manifest = [{key: value for key, value in row.items() if pd.notna(value)}
+                    for row in pd.read_csv(path).to_dict(orient="records")]
+    else:
+        raise ValueError("The manifest must be a json or a csv file")
+    for entry in manifest:
+        if "files" not in entry:
+            entry["files"] = [entry.pop(name) for name in __files__]
+    return manifest
+
+
+def _source_path(entry: dict, position: int) -> str:
+    # Same path as the one used by Basin._set_files_paths
+    return os.path.join(entry["project_folder"], "geographic",
+                        entry["files"][position])
+
+
+def _init_worker(sources: dict) -> None:
+    rasters.register_shared(sources)
+
+
+def _run_basin(entry: dict) -> dict:
+    """Run the whole physiographic pipeline for one basin. The fishnets are
+    exported at the end, as in get_physio.py
+
+    Args:
+        entry (dict): Manifest entry
+
+    Returns:
+        dict: Report with the status and the time spent in each stage
+    """
+    report = {"basin_name": entry["basin_name"],
+              "project_folder": entry["project_folder"],
+              "status": "ok",
+              "stage": "",
+              "error": ""}
+    start = time.perf_counter()
+    try:
+        basin = Basin(entry["project_folder"],
+                      entry["basin_name"],
+                      entry["files"],
+                      storage=entry.get("storage", "memory"))
+        basin.set_dimenssions(entry["dx"], entry.get("dy", entry["dx"]))
+        stages = [
+            ("create_CEfishnet", lambda: basin.create_CEfishnet(entry.get("xoffset", 0.0),
+                                                                entry.get("yoffset", 0.0))),
+            ("create_CPfishnet", basin.create_CPfishnet),
+            ("polish_CPfishnet", lambda: basin.polish_CPfishnet(entry.get("area_th", 0.05))),
+            ("CP_routing", lambda: basin.CP_routing(entry.get("flow_th", 1000))),
+            ("carreauxEntiers_struct", basin.carreauxEntiers_struct),
+            ("carreauxPartiels_struct", basin.carreauxPartiels_struct),
+            ("create_bassinVersant_structure", basin.create_bassinVersant_structure),
+            # The CE and CP fishnets are kept in the project (they are not
+            # written with the memory storage), so the meteo stage can use
+            # the basin
+            ("export_fishnets", basin.export_fishnets)
+        ]
+        for stage, func in stages:
+            report["stage"] = stage
+            stage_start = time.perf_counter()
+            func()
+            report["time_" + stage] = time.perf_counter() - stage_start
+        report["stage"] = ""
+        report["nbCE"] = len(basin.carreauxEntiers)
+        report["nbCP"] = len(basin.carreauxPartiels)
+    except Exception:
+        report["status"] = "failed"
+        report["error"] = traceback.format_exc()
+    report["time_total"] = time.perf_counter() - start
+    return report
+
+
+def build_basins(manifest: list | str,
+                 max_workers: int = None,
+                 shared_folder: str = None,
+                 report_file: str = None) -> pd.DataFrame:
+    """Build the bassinVersant structures of several basins in parallel
+
+    Each basin runs the full Basin pipeline in a worker process. The DEM,
+    FAC and LC rasters used by several basins are dumped once and memory
+    mapped by all the workers, so the basins sharing the same sources do
+    not read them again. All the raster reads of the workers (whole rasters,
+    windows and georeference) go through the memory maps.
+    A failure in one basin is reported and does not stop the batch.
+
+    Args:
+        manifest (list | str): List of entries or path to the manifest
+        max_workers (int, optional): Number of processes. Defaults to None.
+        shared_folder (str, optional): Folder for the memory mapped rasters.
+        A temporary folder is used and removed if not given. Defaults to None.
+        report_file (str, optional): csv file to export the report.
+        Defaults to None.
+
+    Returns:
+        pd.DataFrame: Report with one row per basin
+    """
+    if isinstance(manifest, str):
+        manifest = read_manifest(manifest)
+    remove_shared = shared_folder is None
+    if remove_shared:
+        shared_folder = tempfile.mkdtemp(prefix="pycequeau_")
+    elif not os.path.exists(shared_folder):
+        os.makedirs(shared_folder)
+    try:
+        # Dump once the source rasters used by several basins. The others
+        # are read by windows from their file, as in a single basin run
+        users = {}
+        for entry in manifest:
+            for name in __shared__:
+                path = _source_path(entry, __files__.index(name))
+                users[path] = users.get(path, 0) + 1
+        sources = {path: rasters.share_raster(path, shared_folder)
+                   for path, count in users.items()
+                   if count > 1 and os.path.exists(path)}
+        reports = []
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=_init_worker,
+                                 initargs=(sources,)) as executor:
+            futures = {executor.submit(_run_basin, entry): entry
+                       for entry in manifest}
+            for future in as_completed(futures):
+                entry = futures[future]
+                try:
+                    reports.append(future.result())
+                except Exception:
+                    # The worker itself died (i.e. out of memory)
+                    reports.append({"basin_name": entry["basin_name"],
+                                    "project_folder": entry["project_folder"],
+                                    "status": "failed",
+                                    "error": traceback.format_exc()})
+    finally:
+        if remove_shared:
+            shutil.rmtree(shared_folder, ignore_errors=True)
+    report = pd.DataFrame(reports)
+    if report_file is not None:
+        report.to_csv(report_file, index=False)
+    return report
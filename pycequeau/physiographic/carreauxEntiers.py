@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 from pycequeau.core import utils as u
+from pycequeau.physiographic.tables import min_dtype
 import geopandas as gpd
 from osgeo import gdal
 import os
@@ -12,18 +13,20 @@ def find_grid_coordinates(CE_array: np.ndarray) -> pd.DataFrame:
     # CE_array = np.flipud(CE_array)
     i_res = CE_array.shape[1] #columns
     j_res = CE_array.shape[0] #rows
-    i = np.linspace(0, i_res-1, i_res, dtype=int).astype("uint8")
-    j = np.linspace(0, j_res-1, j_res, dtype=int).astype("uint8")
+    # The i,j values are shifted by 10, the type must hold the last one
+    i = np.arange(i_res, dtype=min_dtype(i_res+10))
+    j = np.arange(j_res, dtype=min_dtype(j_res+10))
     # Create mesh grid with the i,j values
     im, jm = np.meshgrid(i,j)
     # Mask array based on the nondata value
     masked_CE = np.ma.masked_where(CE_array==0,CE_array)
     jm = jm[~masked_CE.mask]
     im = im[~masked_CE.mask]
-    data = np.c_[CE_array[jm,im].astype("uint16"),im+10,jm+10]
+    CEids = CE_array[jm,im]
     # Create table t store the coordinates
-    coordinates = pd.DataFrame(columns=["CEid","i","j"],data=data)
-    coordinates["CEid"] = pd.to_numeric(coordinates["CEid"])
+    coordinates = pd.DataFrame({"CEid": CEids.astype(min_dtype(CEids)),
+                                "i": im+10,
+                                "j": jm+10})
     coordinates = coordinates.sort_values(by=["CEid"])
     return coordinates
 
@@ -1,28 +1,26 @@
 import numpy as np
 import pandas as pd
 from pycequeau.core import utils as u
+from pycequeau.physiographic.tables import CarreauxEntiers
 import geopandas as gpd
 from osgeo import gdal
 import os
 
 
-def get_CP_coordinates(carreuxEntiers: pd.DataFrame,
+def get_CP_coordinates(carreuxEntiers: CarreauxEntiers,
                        CPfishnet: gpd.GeoDataFrame)->pd.DataFrame:
     # Create dataset to store the coordinates
-    coordinates = pd.DataFrame(columns=["CPid","i","j"],
+    coordinates = pd.DataFrame({"CPid": CPfishnet["newCPid"].values},
                                index=CPfishnet.index)
-    coordinates["CPid"] = CPfishnet["newCPid"]
-    columns_carreux = coordinates.columns.tolist()
-    # Loop into the carreuxEntiers dataset 
-    for index,carreu in carreuxEntiers.iterrows():
-        # Find the CEid in the CP fisnhet dataframe
-        idx_CEs, = np.where(CPfishnet["newCEid"] == carreu["CEid"])
-        # Place this values in the coordinates dataframe
-        coordinates.iloc[idx_CEs,columns_carreux.index("i")] = carreu["i"]
-        coordinates.iloc[idx_CEs,columns_carreux.index("j")] = carreu["j"]
+    # Look up the i,j of the CE of each CP
+    CE_coords = pd.DataFrame({"i": carreuxEntiers["i"],
+                              "j": carreuxEntiers["j"]},
+                             index=carreuxEntiers["CEid"])
+    coordinates["i"] = CPfishnet["newCEid"].map(CE_coords["i"]).values
+    coordinates["j"] = CPfishnet["newCEid"].map(CE_coords["j"]).values
     # Drop nan if it exist
     coordinates = coordinates.dropna(axis="index")
-    return coordinates
+    return coordinates.astype(np.int64)
 
 def get_codes(CPfishnet: gpd.GeoDataFrame)->pd.DataFrame:
     # Get unique CEids
@@ -60,7 +58,7 @@ def cumulate_variables(outlet_routes: np.ndarray,
         # Drop the downstream values
         temp_df = temp_df[~mask_df]
         # Get the unique values
-        temp_df = np.unique(temp_df).astype("uint16")
+        temp_df = np.unique(temp_df).astype(np.int64)
         # Cumulate all the variables
         cumulates.loc[i,"cumulPctSuperficieLacsAmont"] = np.sum(np.array(pctLacRiviere)[temp_df-1])
         cumulates.loc[i,"cumulPctSuperficieForetAmont"] = np.sum(pctForet[temp_df-1])
@@ -80,9 +78,9 @@ def get_river_geometry(CPfishnet: gpd.GeoDataFrame,
     for i, _ in rtable.iterrows():
         # Check if the values in the table are read as string
         if isinstance(rtable.loc[i,"upstreamCPs"],str):
-            CP_list = np.array(eval(rtable.loc[i,"upstreamCPs"]),dtype=np.int16)
+            CP_list = np.array(eval(rtable.loc[i,"upstreamCPs"]),dtype=np.int64)
         else:
-            CP_list = np.array(rtable.loc[i,"upstreamCPs"],dtype=np.int16)
+            CP_list = np.array(rtable.loc[i,"upstreamCPs"],dtype=np.int64)
         # Drop zero values
         CP_list = np.trim_zeros(CP_list)
         # append the current CP value to sum the area
@@ -98,5 +96,15 @@ def get_river_geometry(CPfishnet: gpd.GeoDataFrame,
     river_geometry["largeurCoursEauPrincipal"] = (0.49*np.power(sum_cp_areas,0.6))*10.0
     # (units = 1/1000 metres/km)
     river_geometry["penteRiviere"] = 1000.0
+    # Use the main channel traced on the stream network when available.
+    # The estimates above are kept for the CPs without a stream
+    if "rivLength" in CPfishnet.columns:
+        length = pd.to_numeric(CPfishnet["rivLength"]).values
+        slope = pd.to_numeric(CPfishnet["rivSlope"]).values
+        traced = (length > 0) & (slope > 0)
+        # m to km
+        river_geometry.loc[traced, "longueurCoursEauPrincipal"] = length[traced]*1.0e-3*10.0
+        # m/m to m/km
+        river_geometry.loc[traced, "penteRiviere"] = slope[traced]*1.0e3*1000.0
     
     return river_geometry
\ No newline at end of file
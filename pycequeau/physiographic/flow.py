@@ -0,0 +1,523 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse import csgraph
+from pycequeau.core.rasters import RasterArray
+
+# D8 directions. Code k (1..8) points to the neighbour at
+# (row + __d8_rows__[k-1], col + __d8_cols__[k-1]): N, NE, E, SE, S, SW, W, NW.
+# Code 0 is an outlet: the cell drains out of the grid or into no data.
+__d8_rows__ = np.array([-1, -1, 0, 1, 1, 1, 0, -1])
+__d8_cols__ = np.array([0, 1, 1, 1, 0, -1, -1, -1])
+# Directions E, SE, S and SW (0-based): each pair of neighbours is seen once
+__d8_half__ = (2, 3, 4, 5)
+
+
+def _neighbour_distances(geotransform: tuple) -> np.ndarray:
+    dx = abs(geotransform[1])
+    dy = abs(geotransform[5])
+    return np.sqrt((__d8_rows__*dy)**2 + (__d8_cols__*dx)**2)
+
+
+def _padded(array: np.ndarray, valid: np.ndarray, fill: float) -> np.ndarray:
+    # One cell border around the array. The border and the no data cells
+    # get the fill value
+    padded = np.full((array.shape[0]+2, array.shape[1]+2), fill, dtype=np.float64)
+    padded[1:-1, 1:-1] = np.where(valid, array, fill)
+    return padded
+
+
+def _neighbour(padded: np.ndarray, k: int) -> np.ndarray:
+    # View of the neighbour in the direction k of every cell of the grid
+    # inside the one cell border
+    rows, cols = padded.shape
+    r, c = 1 + __d8_rows__[k], 1 + __d8_cols__[k]
+    return padded[r:rows-2+r, c:cols-2+c]
+
+
+def _roots(parent: np.ndarray) -> np.ndarray:
+    # Root of each node of a forest given by its parent (pointer jumping)
+    parent = parent.copy()
+    while True:
+        grand = parent[parent]
+        if np.array_equal(grand, parent):
+            return parent
+        parent = grand
+
+
+def _components(size: int, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    # Connected component of each node of an undirected graph
+    graph = sparse.coo_matrix((np.ones(first.size, dtype=np.int8), (first, second)),
+                              shape=(size, size))
+    return csgraph.connected_components(graph, directed=False)[1]
+
+
+def _spill_levels(ocean: np.ndarray,
+                  first: np.ndarray,
+                  second: np.ndarray,
+                  height: np.ndarray) -> np.ndarray:
+    """Lowest level at which each basin overflows to the outlets. This is
+    the highest pass on the path to the outlets along the minimum spanning
+    tree of the basin graph.
+
+    Args:
+        ocean (np.ndarray): Basins draining out of the grid
+        first (np.ndarray): First basin of each pass
+        second (np.ndarray): Second basin of each pass
+        height (np.ndarray): Height of each pass
+
+    Returns:
+        np.ndarray: Spill level of each basin (-inf for the ocean basins)
+    """
+    # Node `nodes` is the outside of the grid. The tree only depends on the
+    # order of the pass heights, so the ranks are used as (positive) weights
+    nodes = ocean.size
+    levels, rank = np.unique(height, return_inverse=True)
+    outlets = np.flatnonzero(ocean)
+    rows = np.concatenate([first, outlets])
+    cols = np.concatenate([second, np.full(outlets.size, nodes)])
+    weights = np.concatenate([rank + 1.0, np.full(outlets.size, 0.5)])
+    graph = sparse.coo_matrix((weights, (rows, cols)), shape=(nodes + 1, nodes + 1))
+    tree = csgraph.minimum_spanning_tree(graph.tocsr()).tocoo()
+    _, parent = csgraph.breadth_first_order(tree, nodes, directed=False,
+                                            return_predecessors=True)
+    # Height of the edge to the parent of each basin (the weight 0.5 of
+    # the edges to the outside is truncated to the rank 0)
+    edge = np.full(nodes + 1, -np.inf)
+    child = np.where(parent[tree.col] == tree.row, tree.col, tree.row)
+    edge[child] = np.r_[-np.inf, levels][tree.data.astype(np.int64)]
+    parent[nodes] = nodes
+    parent[parent < 0] = nodes
+    # Highest edge up to the root, by pointer jumping
+    while True:
+        grand = parent[parent]
+        edge = np.maximum(edge, edge[parent])
+        if np.array_equal(grand, parent):
+            return edge[:nodes]
+        parent = grand
+
+
+def _flat_gradient(W: np.ndarray,
+                   valid: np.ndarray,
+                   outlets: np.ndarray,
+                   epsilon: float) -> np.ndarray:
+    """Raise the flat cells (no lower neighbour) by epsilon times their
+    number of steps to the edge of the flat where the water leaves it. The
+    increment of each flat is limited to half of its height below the
+    neighbour cells, so no cell around the flat loses its lower neighbour.
+
+    Args:
+        W (np.ndarray): Filled elevations with the one cell border (inf on
+            the border and the no data cells)
+        valid (np.ndarray): Mask of the cells with data
+        outlets (np.ndarray): Mask of the outlet cells
+        epsilon (float): Imposed slope
+
+    Returns:
+        np.ndarray: Filled elevations with the imposed slope on the flats
+    """
+    inner = W[1:-1, 1:-1]
+    lower = np.zeros(valid.shape, dtype=bool)
+    for k in range(8):
+        lower |= _neighbour(W, k) < inner
+    flat = valid & ~lower & ~outlets
+    if not flat.any() or epsilon <= 0:
+        return W
+    width = W.shape[1]
+    index = np.arange(W.size).reshape(W.shape)[1:-1, 1:-1]
+    is_flat = np.zeros(W.shape, dtype=bool)
+    is_flat[1:-1, 1:-1] = flat
+    # Breadth first search from the cells where the flats drain
+    seeds = np.zeros(valid.shape, dtype=bool)
+    for k in range(8):
+        seeds |= _neighbour(is_flat, k) & (_neighbour(W, k) == inner)
+    seeds &= valid & ~flat
+    offsets = __d8_rows__*width + __d8_cols__
+    Wf = W.ravel()
+    flat_f = is_flat.ravel()
+    steps = np.full(W.size, -1, dtype=np.int64)
+    claim = np.zeros(W.size, dtype=np.int64)
+    front = index[seeds]
+    steps[front] = 0
+    step = 0
+    while front.size:
+        step += 1
+        reached = []
+        for offset in offsets:
+            other = front + offset
+            keep = flat_f[other] & (steps[other] < 0) & (Wf[other] == Wf[front])
+            reached.append(other[keep])
+        front = np.concatenate(reached)
+        # Keep each cell once
+        order = np.arange(front.size)
+        claim[front] = order
+        front = front[claim[front] == order]
+        steps[front] = step
+    steps = steps.reshape(W.shape)[1:-1, 1:-1]
+    # Flats (same level) and their height below the neighbour cells
+    ids = np.full(W.shape, -1, dtype=np.int64)
+    ids[1:-1, 1:-1][flat] = np.arange(np.count_nonzero(flat))
+    first, second = [], []
+    gap = np.full(np.count_nonzero(flat), np.inf)
+    for k in range(8):
+        other = _neighbour(W, k)
+        higher = other[flat] - inner[flat]
+        gap = np.minimum(gap, np.where(higher > 0, higher, np.inf))
+        if k in __d8_half__:
+            pair = flat & (_neighbour(ids, k) >= 0) & (other == inner)
+            first.append(ids[1:-1, 1:-1][pair])
+            second.append(_neighbour(ids, k)[pair])
+    label = _components(np.count_nonzero(flat),
+                        np.concatenate(first), np.concatenate(second))
+    nlabels = label.max() + 1
+    lowest_gap = np.full(nlabels, np.inf)
+    np.minimum.at(lowest_gap, label, gap)
+    longest = np.zeros(nlabels, dtype=np.int64)
+    np.maximum.at(longest, label, steps[flat])
+    eps = np.minimum(epsilon, lowest_gap/(2.0*(longest + 1)))
+    W = W.copy()
+    W[1:-1, 1:-1][flat] += eps[label]*np.maximum(steps[flat], 0)
+    return W
+
+
+def fill_depressions(dem: np.ndarray,
+                     valid: np.ndarray,
+                     epsilon: float = 1e-5) -> np.ndarray:
+    """Fill the depressions of the DEM. A small slope (epsilon per cell step)
+    is imposed on the filled areas and on the flats, so every cell has a
+    downslope path to an outlet.
+
+    The cells on the raster border and next to no data are the outlets. The
+    fill is done on the graph of the D8 basins (Cordonnier et al., 2019;
+    Barnes et al., 2014) with array operations only: each cell is sent
+    down to the bottom of its basin by pointer jumping, the spill level of
+    each basin is the highest pass on its path to the outlets along the
+    minimum spanning tree of the passes, and the flats are then given a
+    slope towards the cells where they drain with a breadth first search.
+    The cost is linear in the number of cells, times the log of the flow
+    path lengths and the number of steps across the widest flat.
+
+    Args:
+        dem (np.ndarray): Elevations
+        valid (np.ndarray): Mask of the cells with data
+        epsilon (float, optional): Imposed slope. Defaults to 1e-5.
+
+    Returns:
+        np.ndarray: Filled DEM (float64, nan on the no data cells)
+    """
+    if not valid.any():
+        return np.full(dem.shape, np.nan)
+    # The border and the no data cells are closed
+    Z = _padded(dem, valid, np.inf)
+    inner = Z[1:-1, 1:-1]
+    width = Z.shape[1]
+    index = np.arange(Z.size).reshape(Z.shape)[1:-1, 1:-1]
+    offsets = __d8_rows__*width + __d8_cols__
+    # The outlets have a closed neighbour. The other cells drain to their
+    # lowest neighbour if it is lower than the cell
+    outlets = np.zeros(dem.shape, dtype=bool)
+    lowest = inner.copy()
+    receiver = index.copy()
+    for k in range(8):
+        other = _neighbour(Z, k)
+        outlets |= np.isinf(other)
+        lower = other < lowest
+        lowest = np.where(lower, other, lowest)
+        receiver = np.where(lower, index + offsets[k], receiver)
+    outlets &= valid
+    receiver[outlets | ~valid] = index[outlets | ~valid]
+    parent = np.arange(Z.size)
+    parent[index.ravel()] = receiver.ravel()
+    bottom = _roots(parent)
+    # Bottoms of the same level next to each other (flat bottoms and
+    # outlets) are a single basin
+    is_bottom = valid & (receiver == index)
+    nbottoms = np.count_nonzero(is_bottom)
+    ids = np.full(Z.shape, -1, dtype=np.int64)
+    ids[1:-1, 1:-1][is_bottom] = np.arange(nbottoms)
+    first, second = [], []
+    for k in __d8_half__:
+        pair = is_bottom & (_neighbour(ids, k) >= 0) & (_neighbour(Z, k) == inner)
+        first.append(ids[1:-1, 1:-1][pair])
+        second.append(_neighbour(ids, k)[pair])
+    label = _components(nbottoms, np.concatenate(first), np.concatenate(second))
+    basin = np.full(Z.shape, -1, dtype=np.int64)
+    basin[1:-1, 1:-1][valid] = label[ids.ravel()[bottom[index[valid]]]]
+    nbasins = label.max() + 1
+    # Passes between the basins: lowest height between each pair of basins
+    keys, heights = [], []
+    for k in __d8_half__:
+        other = _neighbour(basin, k)
+        pair = valid & (other >= 0) & (other != basin[1:-1, 1:-1])
+        a, b = basin[1:-1, 1:-1][pair], other[pair]
+        keys.append(np.minimum(a, b)*nbasins + np.maximum(a, b))
+        heights.append(np.maximum(inner[pair], _neighbour(Z, k)[pair]))
+    keys = np.concatenate(keys)
+    heights = np.concatenate(heights)
+    order = np.argsort(keys)
+    keys, heights = keys[order], heights[order]
+    start = np.flatnonzero(np.diff(keys, prepend=-1))
+    keys = keys[start]
+    heights = np.minimum.reduceat(heights, start) if start.size else heights
+    ocean = np.zeros(nbasins, dtype=bool)
+    ocean[basin[1:-1, 1:-1][outlets]] = True
+    spill = _spill_levels(ocean, keys // nbasins, keys % nbasins, heights)
+    W = np.full(Z.shape, np.inf)
+    W[1:-1, 1:-1][valid] = np.maximum(inner[valid],
+                                      spill[basin[1:-1, 1:-1][valid]])
+    W = _flat_gradient(W, valid, outlets, epsilon)[1:-1, 1:-1].copy()
+    W[~valid] = np.nan
+    return W
+
+
+def flow_direction(filled: np.ndarray,
+                   valid: np.ndarray,
+                   geotransform: tuple) -> np.ndarray:
+    """D8 flow direction: each cell drains to the neighbour with the steepest
+    descent. The cells without a lower neighbour are outlets (code 0).
+
+    Args:
+        filled (np.ndarray): Filled DEM
+        valid (np.ndarray): Mask of the cells with data
+        geotransform (tuple): GDAL geotransform (gives the cell size)
+
+    Returns:
+        np.ndarray: D8 codes (uint8)
+    """
+    rows, cols = filled.shape
+    Z = _padded(filled, valid, np.nan)
+    center = Z[1:-1, 1:-1]
+    distances = _neighbour_distances(geotransform)
+    best = np.zeros(filled.shape, dtype=np.float64)
+    direction = np.zeros(filled.shape, dtype=np.uint8)
+    for k in range(8):
+        r = 1 + __d8_rows__[k]
+        c = 1 + __d8_cols__[k]
+        slope = (center - Z[r:r+rows, c:c+cols])/distances[k]
+        # No data neighbours give nan and are never chosen
+        steeper = slope > best
+        best[steeper] = slope[steeper]
+        direction[steeper] = k + 1
+    direction[~valid] = 0
+    return direction
+
+
+def receivers(direction: np.ndarray) -> np.ndarray:
+    """Flat index of the cell receiving the flow of each cell (-1 for the
+    outlets)
+
+    Args:
+        direction (np.ndarray): D8 codes
+
+    Returns:
+        np.ndarray: Receiver of each cell in the flattened array
+    """
+    rows, cols = direction.shape
+    code = direction.ravel().astype(np.int64)
+    idx = np.arange(code.size)
+    drains = code > 0
+    k = code[drains] - 1
+    row = idx[drains]//cols + __d8_rows__[k]
+    col = idx[drains] % cols + __d8_cols__[k]
+    inside = (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+    rec = np.full(code.size, -1, dtype=np.int64)
+    rec[np.flatnonzero(drains)[inside]] = row[inside]*cols + col[inside]
+    return rec
+
+
+def flow_order(rec: np.ndarray, valid: np.ndarray) -> list:
+    """Topological order of the flow graph (Kahn's algorithm). Each level
+    holds the cells whose donors are all in the previous levels, so the
+    levels can be processed with vectorized operations. The total work is
+    linear in the number of cells.
+
+    Args:
+        rec (np.ndarray): Receivers given by receivers()
+        valid (np.ndarray): Flattened mask of the cells with data
+
+    Returns:
+        list: Flat indices of the cells at each level, from the sources
+    """
+    drains = rec >= 0
+    indegree = np.bincount(rec[drains], minlength=rec.size)
+    frontier = np.flatnonzero((indegree == 0) & valid)
+    levels = []
+    while frontier.size:
+        levels.append(frontier)
+        r = rec[frontier]
+        r = r[r >= 0]
+        np.subtract.at(indegree, r, 1)
+        r = np.unique(r)
+        frontier = r[indegree[r] == 0]
+    return levels
+
+
+def flow_accumulation(direction: np.ndarray,
+                      valid: np.ndarray,
+                      weights: np.ndarray = None) -> np.ndarray:
+    """Number of cells draining through each cell, the cell included (same
+    definition as r.watershed). With weights, the weights are accumulated
+    instead.
+
+    Args:
+        direction (np.ndarray): D8 codes
+        valid (np.ndarray): Mask of the cells with data
+        weights (np.ndarray, optional): Weight of each cell. Defaults to None.
+
+    Returns:
+        np.ndarray: Flow accumulation (int32, or float64 with weights)
+    """
+    rec = receivers(direction)
+    valid = valid.ravel()
+    if weights is None:
+        acc = valid.astype(np.int64)
+    else:
+        acc = np.where(valid, weights.ravel(), 0.0).astype(np.float64)
+    for level in flow_order(rec, valid):
+        r = rec[level]
+        drains = r >= 0
+        np.add.at(acc, r[drains], acc[level[drains]])
+    if weights is None:
+        acc = acc.astype(np.int32)
+    return acc.reshape(direction.shape)
+
+
+def compute_flow(dem: RasterArray,
+                 mask: np.ndarray = None,
+                 epsilon: float = 1e-5) -> tuple:
+    """Flow direction and flow accumulation from a DEM
+
+    Args:
+        dem (RasterArray): DEM (or a window of it)
+        mask (np.ndarray, optional): Cells to route (i.e. the watershed).
+        Defaults to None (all the cells with data).
+        epsilon (float, optional): Imposed slope on the filled areas.
+        Defaults to 1e-5.
+
+    Returns:
+        tuple: D8 codes and flow accumulation as RasterArray with the
+        georeference of the DEM. The accumulation is -1 out of the mask.
+    """
+    valid = dem.valid
+    if mask is not None:
+        valid = valid & mask
+    filled = fill_depressions(np.asarray(dem.array, dtype=np.float64), valid, epsilon)
+    direction = flow_direction(filled, valid, dem.geotransform)
+    acc = flow_accumulation(direction, valid)
+    acc[~valid] = -1
+    return (RasterArray(direction, dem.geotransform, dem.projection, None),
+            RasterArray(acc, dem.geotransform, dem.projection, -1))
+
+
+def direction_from_accumulation(acc: np.ndarray,
+                                valid: np.ndarray) -> np.ndarray:
+    """D8 flow direction recovered from a flow accumulation raster (i.e. the
+    FAC computed with GRASS): each cell drains to the neighbour with the
+    largest accumulation, if it is larger than its own.
+
+    Args:
+        acc (np.ndarray): Flow accumulation
+        valid (np.ndarray): Mask of the cells with data
+
+    Returns:
+        np.ndarray: D8 codes (uint8)
+    """
+    rows, cols = acc.shape
+    A = _padded(acc, valid, np.nan)
+    best = np.where(valid, acc, np.nan).astype(np.float64)
+    direction = np.zeros(acc.shape, dtype=np.uint8)
+    for k in range(8):
+        r = 1 + __d8_rows__[k]
+        c = 1 + __d8_cols__[k]
+        neighbour = A[r:r+rows, c:c+cols]
+        larger = neighbour > best
+        best[larger] = neighbour[larger]
+        direction[larger] = k + 1
+    return direction
+
+
+def stream_network(acc: np.ndarray, flow_th: float) -> np.ndarray:
+    """Cells of the stream network (flow accumulation >= flow_th)"""
+    return acc >= flow_th
+
+
+def outlet_cells(labels: np.ndarray, acc: np.ndarray) -> tuple:
+    """Cell with the largest accumulation in each label (CP outlet)
+
+    Args:
+        labels (np.ndarray): Labels (0 is no data)
+        acc (np.ndarray): Flow accumulation
+
+    Returns:
+        tuple: Labels and flat index of their outlet cell
+    """
+    lab = labels.ravel()
+    cells = np.flatnonzero(lab > 0)
+    # Sort by label and then by accumulation, the outlet is the last cell
+    cells = cells[np.lexsort((acc.ravel()[cells], lab[cells]))]
+    last = np.r_[lab[cells][1:] != lab[cells][:-1], True]
+    return lab[cells][last], cells[last]
+
+
+def main_channels(direction: np.ndarray,
+                  acc: np.ndarray,
+                  elevation: np.ndarray,
+                  labels: np.ndarray,
+                  geotransform: tuple,
+                  flow_th: float) -> pd.DataFrame:
+    """Length and slope of the main channel in each label (CP)
+
+    The main channel starts at the outlet of the label and goes upstream
+    through the stream cells of the same label, always following the donor
+    with the largest accumulation. The main donor of every stream cell is
+    found with a single sort of the stream cells, and the channels of all
+    the labels are then traced at the same time.
+
+    Args:
+        direction (np.ndarray): D8 codes
+        acc (np.ndarray): Flow accumulation
+        elevation (np.ndarray): Elevations on the same grid
+        labels (np.ndarray): Labels (0 is no data)
+        geotransform (tuple): GDAL geotransform of the grid
+        flow_th (float): Flow accumulation threshold of the streams
+
+    Returns:
+        pd.DataFrame: Channel length (m), drop (m) and slope (m/m) indexed
+        by label. The labels whose outlet is not a stream cell are not
+        included.
+    """
+    rec = receivers(direction)
+    lab = labels.ravel()
+    a = acc.ravel()
+    z = np.asarray(elevation, dtype=np.float64).ravel()
+    stream = stream_network(a, flow_th) & (lab > 0)
+    # Stream cells draining into a stream cell of the same label
+    donors = np.flatnonzero(stream & (rec >= 0))
+    donors = donors[stream[rec[donors]] & (lab[rec[donors]] == lab[donors])]
+    # Main donor of each cell: the donor with the largest accumulation
+    donors = donors[np.lexsort((-a[donors], rec[donors]))]
+    first = np.r_[True, rec[donors][1:] != rec[donors][:-1]]
+    main_donor = np.full(a.size, -1, dtype=np.int64)
+    main_donor[rec[donors[first]]] = donors[first]
+    # Trace the channels from the outlets
+    ids, outlets = outlet_cells(labels, acc)
+    keep = stream[outlets]
+    ids, outlets = ids[keep], outlets[keep]
+    distances = _neighbour_distances(geotransform)
+    code = direction.ravel()
+    length = np.zeros(outlets.size)
+    current = outlets.copy()
+    active = np.arange(outlets.size)
+    while active.size:
+        donor = main_donor[current[active]]
+        active = active[donor >= 0]
+        donor = donor[donor >= 0]
+        length[active] += distances[code[donor].astype(np.int64) - 1]
+        current[active] = donor
+    drop = z[current] - z[outlets]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(length > 0, drop/length, np.nan)
+    return pd.DataFrame({"length": length, "drop": drop, "slope": slope},
+                        index=ids)
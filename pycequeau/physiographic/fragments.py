@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+
+def fishnet_shape(extent: tuple,
+                  dx: float,
+                  dy: float,
+                  xoffset: float = 0.0,
+                  yoffset: float = 0.0) -> tuple:
+    """Number of rows and columns of the fishnet with origin
+    (xmin - xoffset, ymax - yoffset). The fishnet is extended down to ymin
+    and right to xmax, so it covers the basin when xoffset >= 0 and
+    yoffset <= 0. Without offset this is the ceil of the extent.
+
+    Args:
+        extent (tuple): Basin extent (xmin, xmax, ymin, ymax)
+        dx (float): CE width
+        dy (float): CE height
+        xoffset (float, optional): Fishnet x offset. Defaults to 0.0.
+        yoffset (float, optional): Fishnet y offset. Defaults to 0.0.
+
+    Returns:
+        tuple: Number of rows and columns
+    """
+    xmin, xmax, ymin, ymax = extent
+    rows = int(np.ceil(((ymax - yoffset) - ymin)/dy))
+    cols = int(np.ceil((xmax - (xmin - xoffset))/dx))
+    return max(rows, 1), max(cols, 1)
+
+
+def pixel_blocks(geotransform: tuple,
+                 shape: tuple,
+                 extent: tuple,
+                 dx: float,
+                 dy: float,
+                 xoffset: float = 0.0,
+                 yoffset: float = 0.0) -> tuple:
+    """Find the CE (fishnet cell) in which the center of each raster row and
+    column falls. The fishnet origin is the same one used by
+    Basin._create_CEfishnet: (xmin - xoffset, ymax - yoffset).
+
+    Args:
+        geotransform (tuple): GDAL geotransform of the label raster
+        shape (tuple): Shape of the label raster
+        extent (tuple): Basin extent (xmin, xmax, ymin, ymax)
+        dx (float): CE width
+        dy (float): CE height
+        xoffset (float, optional): Fishnet x offset. Defaults to 0.0.
+        yoffset (float, optional): Fishnet y offset. Defaults to 0.0.
+
+    Returns:
+        tuple: CE row of each raster row, CE column of each raster column and
+        the number of CE rows and columns
+    """
+    xmin, xmax, ymin, ymax = extent
+    x = geotransform[0] + (np.arange(shape[1]) + 0.5)*geotransform[1]
+    y = geotransform[3] + (np.arange(shape[0]) + 0.5)*geotransform[5]
+    # Same number of rows and cols than the fishnet
+    rows, cols = fishnet_shape(extent, dx, dy, xoffset, yoffset)
+    col_idx = np.floor((x - (xmin - xoffset))/dx).astype(np.int64)
+    row_idx = np.floor(((ymax - yoffset) - y)/dy).astype(np.int64)
+    # Pixels outside the fishnet are flagged with -1
+    col_idx[(col_idx < 0) | (col_idx >= cols)] = -1
+    row_idx[(row_idx < 0) | (row_idx >= rows)] = -1
+    return row_idx, col_idx, rows, cols
+
+
+def fragment_areas(labels: np.ndarray,
+                   geotransform: tuple,
+                   extent: tuple,
+                   dx: float,
+                   dy: float,
+                   xoffset: float = 0.0,
+                   yoffset: float = 0.0,
+                   chunk_rows: int = 1024) -> tuple:
+    """Area of each CE x sub-basin fragment computed from the rasterized
+    sub-basins with block reductions. The raster is processed by chunks of
+    rows to keep the memory bounded.
+
+    Args:
+        labels (np.ndarray): Sub-basin labels (0 is no data)
+        geotransform (tuple): GDAL geotransform of the label raster
+        extent (tuple): Basin extent (xmin, xmax, ymin, ymax)
+        dx (float): CE width
+        dy (float): CE height
+        xoffset (float, optional): Fishnet x offset. Defaults to 0.0.
+        yoffset (float, optional): Fishnet y offset. Defaults to 0.0.
+        chunk_rows (int, optional): Rows processed at once. Defaults to 1024.
+
+    Returns:
+        tuple: Area of the non empty fragments and basin area that is not
+        covered by the fishnet
+    """
+    row_idx, col_idx, rows, cols = pixel_blocks(geotransform, labels.shape,
+                                                extent, dx, dy, xoffset, yoffset)
+    nlabels = int(labels.max()) + 1
+    counts = np.zeros(rows*cols*nlabels, dtype=np.int64)
+    uncovered = 0
+    for start in range(0, labels.shape[0], chunk_rows):
+        sub = np.asarray(labels[start:start+chunk_rows])
+        r = row_idx[start:start+chunk_rows][:, None]
+        inside = (r >= 0) & (col_idx[None, :] >= 0)
+        mask = (sub > 0) & inside
+        uncovered += np.count_nonzero((sub > 0) & ~inside)
+        keys = ((r*cols + col_idx[None, :])*nlabels + sub)[mask]
+        counts += np.bincount(keys.astype(np.int64), minlength=counts.size)
+    pixel_area = float(abs(geotransform[1]*geotransform[5]))
+    return counts[counts > 0]*pixel_area, uncovered*pixel_area
+
+
+def fragment_statistics(labels: np.ndarray,
+                        geotransform: tuple,
+                        extent: tuple,
+                        dx: float,
+                        dy: float,
+                        xoffset: float = 0.0,
+                        yoffset: float = 0.0,
+                        area_th: float = 0.05) -> dict:
+    """Statistics of the CE x sub-basin fragments for a given fishnet. These
+    are the CPs before the polishing process. The small fragments are the
+    ones with an area lower than area_th*CE area.
+
+    Args:
+        labels (np.ndarray): Sub-basin labels (0 is no data)
+        geotransform (tuple): GDAL geotransform of the label raster
+        extent (tuple): Basin extent (xmin, xmax, ymin, ymax)
+        dx (float): CE width
+        dy (float): CE height
+        xoffset (float, optional): Fishnet x offset. Defaults to 0.0.
+        yoffset (float, optional): Fishnet y offset. Defaults to 0.0.
+        area_th (float, optional): Area threshold. Defaults to 0.05.
+
+    Returns:
+        dict: Number of fragments, number and fraction of small fragments,
+        the area of the small fragments and the area not covered by the
+        fishnet as percentage of the basin
+    """
+    areas, uncovered = fragment_areas(labels, geotransform, extent,
+                                      dx, dy, xoffset, yoffset)
+    return _statistics(areas, uncovered, dx*dy*area_th)
+
+
+def _statistics(areas: np.ndarray,
+                uncovered: float,
+                small_area: float) -> dict:
+    small = areas < small_area
+    total = max(areas.sum() + uncovered, 1.0)
+    return {"nbFragments": int(areas.size),
+            "nbSmallFragments": int(np.count_nonzero(small)),
+            "fractionSmallFragments": float(np.count_nonzero(small)/max(areas.size, 1)),
+            "pctAreaSmallFragments": float(areas[small].sum()/total*100.0),
+            "pctAreaUncovered": float(uncovered/total*100.0)}
+
+
+def micro_blocks(labels: np.ndarray,
+                 geotransform: tuple,
+                 extent: tuple,
+                 sx: float,
+                 sy: float,
+                 xorigin: float,
+                 yorigin: float,
+                 chunk_rows: int = 1024) -> tuple:
+    """Reduce the label raster into micro blocks of size sx, sy. Only the non
+    empty (micro block, label) pairs are returned with their pixel count.
+
+    Args:
+        labels (np.ndarray): Sub-basin labels (0 is no data)
+        geotransform (tuple): GDAL geotransform of the label raster
+        extent (tuple): Basin extent (xmin, xmax, ymin, ymax)
+        sx (float): Micro block width
+        sy (float): Micro block height
+        xorigin (float): Left border of the micro blocks
+        yorigin (float): Top border of the micro blocks
+
+    Returns:
+        tuple: Micro block row, micro block column, label and pixel count
+    """
+    xmin, xmax, ymin, ymax = extent
+    x = geotransform[0] + (np.arange(labels.shape[1]) + 0.5)*geotransform[1]
+    y = geotransform[3] + (np.arange(labels.shape[0]) + 0.5)*geotransform[5]
+    mcol = np.floor((x - xorigin)/sx).astype(np.int64)
+    mrow = np.floor((yorigin - y)/sy).astype(np.int64)
+    mcols = int(mcol.max()) + 1
+    nlabels = int(labels.max()) + 1
+    counts = {}
+    for start in range(0, labels.shape[0], chunk_rows):
+        sub = np.asarray(labels[start:start+chunk_rows])
+        r = mrow[start:start+chunk_rows][:, None]
+        mask = (sub > 0) & (r >= 0) & (mcol[None, :] >= 0)
+        keys = ((r*mcols + mcol[None, :])*nlabels + sub)[mask]
+        uniques, count = np.unique(keys, return_counts=True)
+        for key, value in zip(uniques.tolist(), count.tolist()):
+            counts[key] = counts.get(key, 0) + value
+    keys = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+    label = keys % nlabels
+    cell = keys // nlabels
+    return cell // mcols, cell % mcols, label, values
+
+
+def score_offsets(labels: np.ndarray,
+                  geotransform: tuple,
+                  extent: tuple,
+                  dx: float,
+                  dy: float,
+                  area_th: float = 0.05,
+                  nx: int = 10,
+                  ny: int = 10) -> pd.DataFrame:
+    """Score nx*ny fishnet offsets (multiples of dx/nx and dy/ny) by the
+    number of small CE x sub-basin fragments they produce. The fishnet
+    origin is (xmin - xoffset, ymax - yoffset), so the candidates are the
+    xoffsets in [0, dx) and the yoffsets in (-dy, 0], which move the
+    fishnet left and up and keep the whole basin covered.
+
+    The label raster is reduced once into micro blocks of dx/nx by dy/ny.
+    Each offset then only regroups the micro blocks into CEs, so the cost of
+    a candidate depends on the number of non empty micro blocks and not on
+    the number of pixels.
+
+    Args:
+        labels (np.ndarray): Sub-basin labels (0 is no data)
+        geotransform (tuple): GDAL geotransform of the label raster
+        extent (tuple): Basin extent (xmin, xmax, ymin, ymax)
+        dx (float): CE width
+        dy (float): CE height
+        area_th (float, optional): Small fragment threshold as fraction of the
+        CE area. Defaults to 0.05.
+        nx (int, optional): Number of x offsets. Defaults to 10.
+        ny (int, optional): Number of y offsets. Defaults to 10.
+
+    Returns:
+        pd.DataFrame: Statistics of each offset sorted from best to worst
+    """
+    xmin, xmax, ymin, ymax = extent
+    sx = dx/nx
+    sy = dy/ny
+    # The micro blocks start one CE to the left and one CE above so all the
+    # fishnet origins (xmin - xoffset, ymax - yoffset) fall on the micro
+    # block borders
+    mrow, mcol, label, count = micro_blocks(labels, geotransform, extent,
+                                            sx, sy, xmin - dx, ymax + dy)
+    nlabels = int(label.max()) + 1 if label.size else 1
+    pixel_area = float(abs(geotransform[1]*geotransform[5]))
+    scores = []
+    for k in range(nx):
+        ce_col = (mcol + k)//nx - 1
+        for l in range(ny):
+            ce_row = (mrow + l)//ny - 1
+            rows, cols = fishnet_shape(extent, dx, dy, k*sx, -l*sy)
+            inside = (ce_col >= 0) & (ce_col < cols) & (ce_row >= 0) & (ce_row < rows)
+            keys = (ce_row[inside]*cols + ce_col[inside])*nlabels + label[inside]
+            areas = np.bincount(keys, weights=count[inside])
+            areas = areas[areas > 0]*pixel_area
+            uncovered = count[~inside].sum()*pixel_area
+            row = {"xoffset": k*sx, "yoffset": -l*sy}
+            row.update(_statistics(areas, uncovered, dx*dy*area_th))
+            scores.append(row)
+    scores = pd.DataFrame(scores)
+    # Never choose an offset that leaves part of the basin outside the fishnet
+    scores["covered"] = scores["pctAreaUncovered"] == 0
+    scores = scores.sort_values(by=["covered", "nbSmallFragments", "pctAreaSmallFragments"],
+                                ascending=[False, True, True])
+    return scores.drop(columns="covered").reset_index(drop=True)
@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+# Integer types tried (smallest first) for the columns with automatic type
+__int_types__ = {
+    "uint": [np.uint8, np.uint16, np.uint32, np.uint64],
+    "int": [np.int8, np.int16, np.int32, np.int64],
+}
+
+
+def min_dtype(values: np.ndarray | int,
+              kind: str = "uint",
+              max_bits: int = 64) -> np.dtype:
+    """Smallest integer type that holds all the values. A signed type is
+    used if there are negative values.
+
+    Args:
+        values (np.ndarray | int): Values (or the largest value) to store
+        kind (str, optional): "uint" or "int". Defaults to "uint".
+        max_bits (int, optional): Largest type allowed (i.e. 32 for the
+        rasters, GDAL < 3.5 has no 64 bits type). Defaults to 64.
+
+    Returns:
+        np.dtype: Integer type
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == "f" and not np.isfinite(values).all():
+        raise ValueError("Missing (NaN) or infinite values can not be stored as integers")
+    low = int(values.min()) if values.size else 0
+    high = int(values.max()) if values.size else 0
+    if low < 0:
+        kind = "int"
+    for dtype in __int_types__[kind]:
+        info = np.iinfo(dtype)
+        if info.bits <= max_bits and info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    raise OverflowError(f"The values [{low}, {high}] do not fit in a {max_bits} bits integer")
+
+
+def _check_finite(name: str, values: np.ndarray) -> None:
+    # NaN or infinite values can not be cast to an integer column
+    if values.dtype.kind == "f" and not np.isfinite(values).all():
+        raise ValueError(
+            f"The column {name} has missing (NaN) or infinite values and can not be stored as integers")
+
+
+def _check_fits(name: str, values: np.ndarray, dtype: np.dtype) -> None:
+    # Raise instead of wrapping around silently when the values do not fit
+    if not np.issubdtype(dtype, np.integer) or values.size == 0:
+        return
+    info = np.iinfo(dtype)
+    low, high = np.nanmin(values), np.nanmax(values)
+    if low < info.min or high > info.max:
+        raise OverflowError(
+            f"The column {name} has values in [{low}, {high}] that do not fit in {np.dtype(dtype).name}")
+
+
+class RaggedArray:
+    def __init__(self,
+                 values: np.ndarray,
+                 offsets: np.ndarray) -> None:
+        """List of variable length lists stored as CSR: the values of all
+        the rows one after the other and the offset where each row starts.
+        Row k is values[offsets[k]:offsets[k+1]].
+
+        Args:
+            values (np.ndarray): Values of all the rows
+            offsets (np.ndarray): Start of each row (len(rows) + 1 values)
+        """
+        self.values = np.asarray(values)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_padded(cls,
+                    array: np.ndarray,
+                    dtype: str | np.dtype = None,
+                    fill: int = 0) -> RaggedArray:
+        """Create the CSR arrays from a zero padded matrix (i.e. the
+        upstream CPs in the routing table)
+
+        Args:
+            array (np.ndarray): One row per list, padded with fill
+            dtype (str | np.dtype, optional): Type of the values.
+            Defaults to None (same as the array).
+            fill (int, optional): Padding value. Defaults to 0.
+
+        Returns:
+            RaggedArray: Lists without the padding
+        """
+        array = np.asarray(array)
+        if array.ndim == 1:
+            array = array.reshape(-1, 1)
+        mask = array != fill
+        offsets = np.r_[0, np.cumsum(mask.sum(axis=1))]
+        return cls(array[mask].astype(dtype or array.dtype), offsets)
+
+    @classmethod
+    def from_lists(cls,
+                   lists: list,
+                   dtype: str | np.dtype = np.int64,
+                   fill: int = 0) -> RaggedArray:
+        """Create the CSR arrays from a list of lists. The padding values are
+        dropped. Any element that is not a list (i.e. nan) is an empty row.
+
+        Args:
+            lists (list): List of lists
+            dtype (str | np.dtype, optional): Type of the values.
+            Defaults to np.int64.
+            fill (int, optional): Padding value. Defaults to 0.
+
+        Returns:
+            RaggedArray: Lists without the padding
+        """
+        rows = [np.asarray(row).ravel() if isinstance(row, (list, tuple, np.ndarray))
+                else np.empty(0) for row in lists]
+        rows = [row[row != fill] for row in rows]
+        offsets = np.r_[0, np.cumsum([row.size for row in rows])]
+        values = np.concatenate(rows) if rows else np.empty(0)
+        return cls(values.astype(dtype), offsets)
+
+    def __len__(self) -> int:
+        return self.offsets.size - 1
+
+    def __getitem__(self, k: int) -> np.ndarray:
+        return self.values[self.offsets[k]:self.offsets[k+1]]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.offsets.nbytes
+
+    def astype(self, dtype: str | np.dtype) -> RaggedArray:
+        return RaggedArray(self.values.astype(dtype), self.offsets)
+
+    def to_padded(self, width: int = None, fill: int = 0) -> np.ndarray:
+        """Zero padded matrix with one row per list
+
+        Args:
+            width (int, optional): Number of columns. Defaults to None (the
+            longest list, at least 1).
+            fill (int, optional): Padding value. Defaults to 0.
+
+        Returns:
+            np.ndarray: Padded matrix
+        """
+        lengths = self.lengths
+        if width is None:
+            width = max(int(lengths.max()) if lengths.size else 0, 1)
+        padded = np.full((len(self), width), fill, dtype=self.values.dtype)
+        rows = np.repeat(np.arange(len(self)), lengths)
+        cols = np.arange(self.values.size) - np.repeat(self.offsets[:-1], lengths)
+        padded[rows, cols] = self.values
+        return padded
+
+    def tolist(self) -> list:
+        """Padded lists, as stored in the json structure"""
+        return self.to_padded().tolist()
+
+
+class Table:
+    # Column names and types, in the order of the bassinVersant structure.
+    # The integer columns given as "uint" or "int" get the smallest type
+    # that holds their values
+    __columns__ = {}
+    # Columns holding one list per row
+    __ragged__ = ()
+
+    def __init__(self, data: dict) -> None:
+        """Struct of arrays with a fixed type for each column. The columns
+        holding lists (i.e. the upstream CPs) are stored as RaggedArray.
+        The values are checked against the column types, so an overflow
+        raises an error instead of wrapping around.
+
+        Args:
+            data (dict): Values of each column in __columns__
+        """
+        self._data = {}
+        for name in self.__columns__:
+            self[name] = data[name]
+        lengths = {len(column) for column in self._data.values()}
+        if len(lengths) > 1:
+            raise ValueError(
+                f"The columns of {type(self).__name__} have different lengths")
+
+    def __setitem__(self, name: str, values) -> None:
+        dtype = self.__columns__[name]
+        if name in self.__ragged__:
+            if not isinstance(values, RaggedArray):
+                values = np.asarray(values)
+                if values.dtype == object:
+                    values = RaggedArray.from_lists(values)
+                else:
+                    values = RaggedArray.from_padded(values)
+            raw = values.values
+        else:
+            values = np.asarray(values)
+            raw = values
+        if dtype in __int_types__:
+            _check_finite(name, raw)
+            dtype = min_dtype(raw, dtype)
+        elif np.issubdtype(dtype, np.integer):
+            _check_finite(name, raw)
+        _check_fits(name, raw, dtype)
+        self._data[name] = values.astype(dtype)
+
+    def __getitem__(self, name: str) -> np.ndarray | RaggedArray:
+        return self._data[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._data
+
+    def __len__(self) -> int:
+        return len(next(iter(self._data.values()))) if self._data else 0
+
+    @property
+    def columns(self) -> list:
+        return list(self.__columns__)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self._data.values())
+
+    def to_dict(self) -> dict:
+        """Columns as python lists (the lists are padded), as stored in the
+        json structure"""
+        return {name: self._data[name].tolist() for name in self.columns}
+
+    def to_frame(self) -> pd.DataFrame:
+        """Table as DataFrame. The list columns hold one array per row"""
+        data = {}
+        for name in self.columns:
+            column = self._data[name]
+            if isinstance(column, RaggedArray):
+                column = [column[k] for k in range(len(column))]
+            data[name] = column
+        return pd.DataFrame(data)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> Table:
+        return cls(data)
+
+
+class CarreauxEntiers(Table):
+    __columns__ = {
+        "CEid": "uint",
+        "i": "uint",
+        "j": "uint",
+        "pctLacRiviere": np.float64,
+        "pctForet": np.float64,
+        "pctMarais": np.float64,
+        "pctSolNu": np.float64,
+        "altitude": np.float64,
+    }
+
+
+class CarreauxPartiels(Table):
+    __columns__ = {
+        "CPid": "int",
+        "i": "int",
+        "j": "int",
+        "code": "int",
+        "pctSurface": np.float64,
+        "idCPAval": "int",
+        "idCPsAmont": "int",
+        "CEid": "int",
+        "pctEau": np.float64,
+        "pctForet": np.float64,
+        "pctMarais": np.float64,
+        "pctSolNu": np.float64,
+        "altitudeMoy": np.float64,
+        "profondeurMin": np.float64,
+        "longueurCoursEauPrincipal": np.float64,
+        "largeurCoursEauPrincipal": np.float64,
+        "penteRiviere": np.float32,
+        "cumulPctSuperficieCPAmont": np.float64,
+        "cumulPctSuperficieLacsAmont": np.float64,
+        "cumulPctSuperficieMaraisAmont": np.float64,
+        "cumulPctSuperficieForetAmont": np.float64,
+    }
+    __ragged__ = ("idCPsAmont",)
@@ -6,6 +6,7 @@ import json
 import geopandas as gpd
 from pycequeau.physiographic.base import Basin
 from pycequeau.core import projections
+from pycequeau.core import matlab
 
 
 class Parameters:
@@ -16,7 +17,7 @@ class Parameters:
         self.basin_structure = bassinVersant
         pass
 
-    def create_parameter_structure(self):
+    def create_parameter_structure(self, mat: bool = False):
         self.parametres = {"option": self.option,
                            "sol": self.sol,
                            "solInitial": self.solInitial,
@@ -30,6 +31,10 @@ class Parameters:
         with open(os.path.join(self.basin_structure._project_path, "results", "parameters.json"), "w") as outfile:
             json.dump(self.parametres, outfile, indent=4, default=tuple)
         outfile.close()
+        # Same structure as the params_struct variable of a MATLAB file
+        if mat:
+            matlab.write_mat(os.path.join(self.basin_structure._project_path, "results", "parameters.mat"),
+                             {"params_struct": self.parametres})
 
     def set_option(self, values: np.ndarray):
         # The default values can be changed using the method set_maximum_insolation_day
@@ -136,7 +141,7 @@ class Parameters:
                 "CTg": values[0],
                 "theta": values[0],
                 "QNBV": values[0],
-                "Zmed": np.array(self.basin_structure.carreauxPartiels["altitudeMoy"], dtype=np.float32).tolist()
+                "Zmed": np.array(self.basin_structure.bassinVersant["carreauxPartiels"]["altitudeMoy"], dtype=np.float32).tolist()
             }
             }
 
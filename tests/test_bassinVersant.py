@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import json
+import numpy as np
+import pytest
+from pycequeau.physiographic import bassinVersant as bv
+from pycequeau.physiographic.tables import (
+    CarreauxEntiers,
+    CarreauxPartiels,
+    RaggedArray
+)
+
+
+@pytest.fixture
+def structure() -> dict:
+    n_ce, n_cp = 3, 5
+    ce = {name: np.linspace(0.5, 99.5, n_ce) for name in CarreauxEntiers.__columns__}
+    ce.update(CEid=[1, 2, 3], i=[1, 1, 2], j=[1, 2, 1])
+    cp = {name: np.linspace(0.0, 1.0, n_cp) for name in CarreauxPartiels.__columns__}
+    cp.update(CPid=[1, 2, 3, 4, 5], i=[1, 1, 2, 2, 1], j=[1, 2, 1, 2, 2],
+              code=[1, 2, 3, 4, 1], idCPAval=[0, 1, 1, 2, 2],
+              idCPsAmont=RaggedArray.from_lists([[2, 3], [4, 5], [], [], []]),
+              CEid=[1, 2, 3, 3, 2])
+    # Values that need the json representation of the floats
+    cp["pctSurface"] = [100.0, 1/3, 1e-20, 2.5e17, -0.0]
+    return {"nomBassinVersant": "test",
+            "barrage": {},
+            "superficieCE": 4.0,
+            "nbCpCheminLong": 3,
+            "carreauxEntiers": CarreauxEntiers(ce),
+            "carreauxPartiels": CarreauxPartiels(cp)}
+
+
+def _as_lists(structure: dict) -> dict:
+    return {key: value.to_dict() if key in bv.__tables__ else value
+            for key, value in structure.items()}
+
+
+@pytest.mark.parametrize("chunk_size", [2, 65536])
+def test_write_json_matches_json_dump(structure, tmp_path, chunk_size):
+    path = tmp_path / "bassinVersant.json"
+    bv.write_json(structure, str(path), chunk_size=chunk_size)
+    assert path.read_text() == json.dumps(_as_lists(structure), indent=4)
+
+
+def test_write_json_compact(structure, tmp_path):
+    path = tmp_path / "bassinVersant.json"
+    bv.write_json(structure, str(path), compact=True, chunk_size=2)
+    assert path.read_text() == json.dumps(_as_lists(structure), separators=(",", ":"))
+
+
+def test_lazy_json(structure, tmp_path):
+    path = tmp_path / "bassinVersant.json"
+    bv.write_json(structure, str(path))
+    lazy = bv.read_bassinVersant(str(path), lazy=True)
+    expected = _as_lists(structure)
+    assert list(lazy) == list(expected)
+    assert lazy["carreauxPartiels"]["idCPsAmont"] == expected["carreauxPartiels"]["idCPsAmont"]
+    assert lazy["superficieCE"] == 4.0
+
+
+@pytest.mark.parametrize("ext", [".nc", ".npz"])
+def test_binary_round_trip(structure, tmp_path, ext):
+    path = str(tmp_path / f"bassinVersant{ext}")
+    bv.__writers__[ext[1:]](structure, path)
+    copy = bv.read_bassinVersant(path)
+    for table_name in bv.__tables__:
+        assert copy[table_name].to_dict() == structure[table_name].to_dict()
+    for name in bv.__scalars__:
+        assert copy[name] == structure[name]
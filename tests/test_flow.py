@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+from pycequeau.physiographic import flow  # noqa: E402
+
+__geotransform__ = (0.0, 10.0, 0.0, 0.0, 0.0, -10.0)
+
+
+def _reference_fill(dem: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    # Planchon & Darboux fill (no epsilon) by plain relaxation
+    rows, cols = dem.shape
+    Z = flow._padded(dem, valid, np.nan)
+    outlets = np.zeros(dem.shape, dtype=bool)
+    for k in range(8):
+        outlets |= np.isnan(flow._neighbour(Z, k))
+    W = np.where(valid & ~outlets, np.inf, dem)
+    while True:
+        P = flow._padded(W, valid, np.nan)
+        lowest = np.full(dem.shape, np.inf)
+        for k in range(8):
+            lowest = np.fmin(lowest, flow._neighbour(P, k))
+        new = np.where(valid & ~outlets, np.maximum(dem, np.minimum(W, lowest)), W)
+        if np.array_equal(new, W):
+            return np.where(valid, W, np.nan)
+        W = new
+
+
+def _sinks(filled: np.ndarray, valid: np.ndarray) -> int:
+    # Valid cells with neither a lower neighbour nor a no data neighbour
+    Z = flow._padded(filled, valid, np.nan)
+    lower = np.zeros(filled.shape, dtype=bool)
+    edge = np.zeros(filled.shape, dtype=bool)
+    for k in range(8):
+        neighbour = flow._neighbour(Z, k)
+        lower |= neighbour < filled
+        edge |= np.isnan(neighbour)
+    return int(np.count_nonzero(valid & ~lower & ~edge))
+
+
+@pytest.fixture
+def dem() -> tuple:
+    # Bowl with noise, a flat bottom and a no data strip
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:60, 0:50]/50.0
+    dem = 100*((x - 0.5)**2 + (y - 0.6)**2) + rng.normal(0, 0.5, (60, 50))
+    dem[20:30, 20:30] = dem.min()
+    valid = np.ones(dem.shape, dtype=bool)
+    valid[:3, :3] = False
+    valid[40:42, :12] = False
+    return dem, valid
+
+
+def test_fill_levels(dem):
+    dem, valid = dem
+    filled = flow.fill_depressions(dem, valid, epsilon=0.0)
+    np.testing.assert_allclose(filled, _reference_fill(dem, valid), equal_nan=True)
+
+
+def test_fill_drains(dem):
+    dem, valid = dem
+    filled = flow.fill_depressions(dem, valid)
+    assert np.array_equal(np.isnan(filled), ~valid)
+    assert (filled[valid] >= dem[valid]).all()
+    assert _sinks(filled, valid) == 0
+
+
+def test_fill_keeps_a_plane():
+    y, x = np.mgrid[0:20, 0:30]
+    dem = 2.0*x + 0.5*y
+    valid = np.ones(dem.shape, dtype=bool)
+    np.testing.assert_array_equal(flow.fill_depressions(dem, valid), dem)
+
+
+def test_fill_without_data():
+    valid = np.zeros((4, 4), dtype=bool)
+    assert np.isnan(flow.fill_depressions(np.ones((4, 4)), valid)).all()
+
+
+def test_flow_accumulation_plane():
+    # Every cell drains east: the accumulation is the column number
+    dem = -np.tile(np.arange(8.0), (5, 1))
+    valid = np.ones(dem.shape, dtype=bool)
+    direction = flow.flow_direction(dem, valid, __geotransform__)
+    assert (direction[:, :-1] == 3).all()
+    acc = flow.flow_accumulation(direction, valid)
+    np.testing.assert_array_equal(acc, np.tile(np.arange(1, 9), (5, 1)))
+
+
+def test_flow_accumulation_brute_force(dem):
+    dem, valid = dem
+    filled = flow.fill_depressions(dem, valid)
+    direction = flow.flow_direction(filled, valid, __geotransform__)
+    acc = flow.flow_accumulation(direction, valid)
+    # Follow the receivers from every cell
+    rec = flow.receivers(direction)
+    expected = np.zeros(rec.size, dtype=np.int64)
+    for cell in np.flatnonzero(valid.ravel()):
+        while cell >= 0:
+            expected[cell] += 1
+            cell = rec[cell]
+    np.testing.assert_array_equal(acc.ravel()[valid.ravel()],
+                                  expected[valid.ravel()])
+    # Every valid cell reaches exactly one outlet
+    outlets = valid.ravel() & (rec < 0)
+    assert acc.ravel()[outlets].sum() == np.count_nonzero(valid)
+
+
+def test_weighted_accumulation(dem):
+    dem, valid = dem
+    filled = flow.fill_depressions(dem, valid)
+    direction = flow.flow_direction(filled, valid, __geotransform__)
+    counts = flow.flow_accumulation(direction, valid)
+    weighted = flow.flow_accumulation(direction, valid, np.full(dem.shape, 0.5))
+    np.testing.assert_allclose(weighted[valid], 0.5*counts[valid])
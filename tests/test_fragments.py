@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+from pycequeau.physiographic import fragments
+
+
+@pytest.fixture
+def labels() -> tuple:
+    # Sub-basins as blocky random labels on a 1 m raster whose extent is not
+    # a multiple of the CE size
+    rng = np.random.default_rng(42)
+    coarse = rng.integers(0, 5, size=(12, 16))
+    labels = np.kron(coarse, np.ones((4, 4), dtype=np.int64))[:47, :63]
+    geotransform = (100.0, 1.0, 0.0, 247.0, 0.0, -1.0)
+    extent = (100.0, 163.0, 200.0, 247.0)
+    return labels, geotransform, extent
+
+
+def test_fishnet_shape():
+    assert fragments.fishnet_shape((0.0, 25.0, 0.0, 20.0), 10.0, 10.0) == (2, 3)
+    assert fragments.fishnet_shape((0.0, 25.0, 0.0, 20.0), 10.0, 10.0, 6.0, -2.0) == (3, 4)
+    assert fragments.fishnet_shape((0.0, 0.0, 0.0, 0.0), 10.0, 10.0) == (1, 1)
+
+
+def test_fragment_areas_cover_the_basin(labels):
+    labels, geotransform, extent = labels
+    areas, uncovered = fragments.fragment_areas(labels, geotransform, extent,
+                                                10.0, 10.0, chunk_rows=7)
+    assert uncovered == 0
+    assert areas.sum() == np.count_nonzero(labels)
+
+
+def test_score_offsets_brute_force(labels):
+    labels, geotransform, extent = labels
+    dx, dy, nx, ny = 10.0, 8.0, 5, 4
+    scores = fragments.score_offsets(labels, geotransform, extent, dx, dy,
+                                     area_th=0.2, nx=nx, ny=ny)
+    assert len(scores) == nx*ny
+    scores = scores.set_index(["xoffset", "yoffset"])
+    for k in range(nx):
+        for l in range(ny):
+            xoffset, yoffset = k*dx/nx, -l*dy/ny
+            expected = fragments.fragment_statistics(labels, geotransform, extent,
+                                                     dx, dy, xoffset, yoffset,
+                                                     area_th=0.2)
+            row = scores.loc[(xoffset, yoffset)]
+            for name, value in expected.items():
+                assert row[name] == pytest.approx(value), (xoffset, yoffset, name)
+            assert expected["pctAreaUncovered"] == 0
+
+
+def test_score_offsets_sorted(labels):
+    labels, geotransform, extent = labels
+    scores = fragments.score_offsets(labels, geotransform, extent, 10.0, 10.0,
+                                     area_th=0.2, nx=4, ny=4)
+    assert scores["nbSmallFragments"].is_monotonic_increasing
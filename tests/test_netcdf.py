@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import netCDF4
+import numpy as np
+import pytest
+import xarray as xr
+from pycequeau.core import netcdf
+
+
+def _grid(days: np.ndarray, CEs: np.ndarray = None) -> xr.Dataset:
+    CEs = np.arange(1, 5) if CEs is None else CEs
+    values = days[:, None] + CEs[None, :]/10.0
+    return xr.Dataset(
+        {"tMax": (("pasTemp", "CEid"), values, {"units": "C"}),
+         "pTot": (("pasTemp", "CEid"), 2*values, {"units": "mm"})},
+        coords={"pasTemp": ("pasTemp", days.astype(np.float32), {"units": "datenum"}),
+                "CEid": CEs},
+        attrs={"remap_method": "nearest"})
+
+
+def _read(path: str) -> dict:
+    with netCDF4.Dataset(path, "r") as nc:
+        return {name: var[:].data for name, var in nc.variables.items()}
+
+
+def test_stream_in_blocks(tmp_path):
+    path = str(tmp_path / "meteo.nc")
+    grid = _grid(np.arange(730000.0, 730010.0))
+    netcdf.write_meteo_stream(path, grid, block=3)
+    data = _read(path)
+    np.testing.assert_array_equal(data["pasTemp"], grid["pasTemp"].values)
+    np.testing.assert_allclose(data["tMax"], grid["tMax"].values.astype(np.float32))
+    assert netcdf.get_attribute(path, "remap_method") == "nearest"
+    assert netcdf.get_attribute(path, "missing", "default") == "default"
+
+
+def test_last_datenum(tmp_path):
+    path = str(tmp_path / "meteo.nc")
+    grid = _grid(np.arange(730000.0, 730005.0))
+    netcdf.create_meteo_file(path, grid)
+    assert netcdf.last_datenum(path) is None
+    netcdf.append_meteo(path, grid)
+    assert netcdf.last_datenum(path) == 730004.0
+
+
+def test_append_only_new_days(tmp_path):
+    days = np.arange(730000.0, 730020.0)
+    full = _grid(days)
+    whole, updated = str(tmp_path / "whole.nc"), str(tmp_path / "updated.nc")
+    netcdf.write_meteo_stream(whole, full, block=7)
+    # First run, then an update with the days after the last one of the file
+    netcdf.write_meteo_stream(updated, full.isel(pasTemp=slice(0, 12)), block=7)
+    with netCDF4.Dataset(updated, "r") as nc:
+        first = nc.variables["tMax"][:12].data.copy()
+    new = full["pasTemp"].values > netcdf.last_datenum(updated)
+    netcdf.write_meteo_stream(updated, full.isel(pasTemp=new), block=7, append=True)
+    data, expected = _read(updated), _read(whole)
+    for name in expected:
+        np.testing.assert_array_equal(data[name], expected[name])
+    # The first days are left untouched
+    np.testing.assert_array_equal(data["tMax"][:12], first)
+
+
+def test_append_other_CEs(tmp_path):
+    path = str(tmp_path / "meteo.nc")
+    netcdf.write_meteo_stream(path, _grid(np.arange(730000.0, 730003.0)))
+    with pytest.raises(ValueError):
+        netcdf.append_meteo(path, _grid(np.arange(730003.0, 730005.0), np.arange(2, 6)))
+    assert netcdf.last_datenum(path) == 730002.0
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+import xarray as xr
+
+pytest.importorskip("osgeo")
+from pycequeau.meteo import regrid  # noqa: E402
+
+
+@pytest.fixture
+def targets() -> regrid.CETargets:
+    # 2 km CEs (UTM 18N) around 45N, 75W
+    cols, rows = np.meshgrid(np.arange(6), np.arange(5))
+    gt = (480000.0, 2000.0, 0.0, 4990000.0, 0.0, -2000.0)
+    return regrid.CETargets(np.arange(1, cols.size + 1),
+                            gt[0] + (cols.ravel() + 0.5)*gt[1],
+                            gt[3] + (rows.ravel() + 0.5)*gt[5],
+                            gt[1], gt[5], "EPSG:32618", gt)
+
+
+@pytest.fixture
+def grid() -> tuple:
+    # 0.05 degree grid with descending latitudes
+    lat = np.round(np.arange(45.5, 44.49, -0.05), 6)
+    lon = np.round(np.arange(-75.5, -74.49, 0.05), 6)
+    return lat, lon
+
+
+@pytest.mark.parametrize("method", list(regrid.__methods__))
+def test_weights_rows_sum_to_one(targets, grid, method):
+    lat, lon = grid
+    weights = regrid.__methods__[method](lat, lon, targets)
+    assert weights.shape == (len(targets), lat.size*lon.size)
+    assert (weights.data >= 0).all()
+    np.testing.assert_allclose(np.asarray(weights.sum(axis=1)).ravel(), 1.0, atol=1e-9)
+
+
+def test_nearest_weights(targets, grid):
+    lat, lon = grid
+    weights = regrid.nearest_weights(lat, lon, targets)
+    ce_lat, ce_lon = targets.latlon
+    cells = weights.indices
+    np.testing.assert_allclose(lat[cells // lon.size], ce_lat, atol=0.025 + 1e-9)
+    np.testing.assert_allclose(lon[cells % lon.size], ce_lon, atol=0.025 + 1e-9)
+
+
+def test_bilinear_keeps_a_linear_field(targets, grid):
+    lat, lon = grid
+    weights = regrid.bilinear_weights(lat, lon, targets)
+    lat_grid, lon_grid = np.meshgrid(lat, lon, indexing="ij")
+    field = 2.0*lat_grid - 3.0*lon_grid
+    ce_lat, ce_lon = targets.latlon
+    np.testing.assert_allclose(weights @ field.ravel(), 2.0*ce_lat - 3.0*ce_lon)
+
+
+def test_apply_weights_skips_missing_cells(targets, grid):
+    lat, lon = grid
+    weights = regrid.bilinear_weights(lat, lon, targets)
+    values = np.full((2, lat.size, lon.size), 5.0)
+    values[1, :, :lon.size//2] = np.nan
+    ds = xr.Dataset({"tasmax": (("time", "lat", "lon"), values)},
+                    coords={"time": np.array(["2000-01-01", "2000-01-02"], dtype="datetime64[ns]"),
+                            "lat": lat, "lon": lon})
+    remapped = regrid.apply_weights(ds, weights, targets)
+    assert remapped["tasmax"].dims == ("time", "CEid")
+    assert remapped["tasmax"].dtype == np.float32
+    np.testing.assert_allclose(remapped["tasmax"].values[0], 5.0)
+    np.testing.assert_allclose(remapped["tasmax"].values[1][np.isfinite(remapped["tasmax"].values[1])], 5.0)
+
+
+def test_weights_key(targets, grid):
+    lat, lon = grid
+    ds = xr.Dataset(coords={"lat": lat, "lon": lon})
+    assert regrid.weights_key(ds, targets, "nearest") == regrid.weights_key(ds, targets, "nearest")
+    assert regrid.weights_key(ds, targets, "nearest") != regrid.weights_key(ds, targets, "bilinear")
+    shifted = xr.Dataset(coords={"lat": lat + 0.01, "lon": lon})
+    assert regrid.weights_key(ds, targets, "nearest") != regrid.weights_key(shifted, targets, "nearest")
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import os
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import box
+
+pytest.importorskip("osgeo")
+from pycequeau.core import storage  # noqa: E402
+from pycequeau.core.storage import FishnetStorage  # noqa: E402
+
+
+def _formats() -> list:
+    formats = []
+    for fmt in storage.__formats__:
+        if fmt == "fgb" and not storage._flatgeobuf:
+            formats.append(pytest.param(fmt, marks=pytest.mark.skip("GDAL < 3.1")))
+        else:
+            formats.append(fmt)
+    return formats
+
+
+@pytest.fixture
+def fishnet() -> gpd.GeoDataFrame:
+    cells = [box(x, y, x + 10, y + 10) for y in (0, 10) for x in (0, 10, 20)]
+    return gpd.GeoDataFrame({"CEid": np.arange(1, 7, dtype=np.int64),
+                             "area": np.linspace(10.0, 60.0, 6)},
+                            geometry=cells, crs="EPSG:32618")
+
+
+def _assert_same(result: gpd.GeoDataFrame, expected: gpd.GeoDataFrame) -> None:
+    assert list(result.columns) == list(expected.columns)
+    np.testing.assert_array_equal(result["CEid"].values, expected["CEid"].values)
+    np.testing.assert_allclose(result["area"].values, expected["area"].values)
+    assert result.geometry.geom_equals(expected.geometry).all()
+    assert result.crs == expected.crs
+
+
+@pytest.mark.parametrize("fmt", _formats())
+def test_write_read(tmp_path, fishnet, fmt):
+    fishnets = FishnetStorage(str(tmp_path), fmt)
+    assert not fishnets.exists("CE_fishnet")
+    fishnets.write(fishnet, "CE_fishnet")
+    assert fishnets.exists("CE_fishnet")
+    _assert_same(fishnets.read("CE_fishnet"), fishnet)
+    # Writing again replaces the fishnet
+    fishnets.write(fishnet.iloc[:2], "CE_fishnet")
+    assert len(fishnets.read("CE_fishnet")) == 2
+    fishnets.remove("CE_fishnet")
+    assert not fishnets.exists("CE_fishnet")
+    with pytest.raises(FileNotFoundError):
+        fishnets.read("CE_fishnet")
+
+
+@pytest.mark.parametrize("fmt", _formats())
+def test_export(tmp_path, fishnet, fmt):
+    fishnets = FishnetStorage(str(tmp_path / "storage"), fmt)
+    os.makedirs(fishnets.folder, exist_ok=True)
+    fishnets.write(fishnet, "CE_fishnet")
+    out_path = str(tmp_path / "CE_fishnet.shp")
+    fishnets.export("CE_fishnet", out_path)
+    _assert_same(gpd.read_file(out_path), fishnet)
+    # Exporting again overwrites the shapefile
+    fishnets.write(fishnet.iloc[:3], "CE_fishnet")
+    fishnets.export("CE_fishnet", out_path)
+    assert len(gpd.read_file(out_path)) == 3
+
+
+def test_export_in_place(tmp_path, fishnet):
+    fishnets = FishnetStorage(str(tmp_path), "shp")
+    fishnets.write(fishnet, "CE_fishnet")
+    fishnets.export("CE_fishnet", fishnets.path("CE_fishnet"))
+    _assert_same(fishnets.read("CE_fishnet"), fishnet)
+
+
+def test_memory_returns_copies(tmp_path, fishnet):
+    fishnets = FishnetStorage(str(tmp_path), "memory")
+    fishnets.write(fishnet, "CE_fishnet")
+    fishnets.read("CE_fishnet")["area"] = 0.0
+    _assert_same(fishnets.read("CE_fishnet"), fishnet)
+    assert not os.listdir(tmp_path)
+
+
+def test_read_exported_fishnet(tmp_path, fishnet):
+    # Project built with shapefiles: the fishnet is only in the export
+    fishnet.to_file(str(tmp_path / "CE_fishnet.shp"))
+    fishnets = FishnetStorage(str(tmp_path), "parquet")
+    assert fishnets.exists("CE_fishnet")
+    _assert_same(fishnets.read("CE_fishnet"), fishnet)
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        FishnetStorage(str(tmp_path), "csv")
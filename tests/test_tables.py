@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+from pycequeau.physiographic.tables import (
+    CarreauxEntiers,
+    RaggedArray,
+    min_dtype,
+)
+
+
+@pytest.mark.parametrize("values, kind, expected", [
+    ([0, 255], "uint", np.uint8),
+    ([0, 256], "uint", np.uint16),
+    ([0, 2**32], "uint", np.uint64),
+    ([-1, 127], "uint", np.int8),
+    ([-129, 0], "int", np.int16),
+    ([], "uint", np.uint8),
+    (70000, "uint", np.uint32),
+])
+def test_min_dtype(values, kind, expected):
+    assert min_dtype(np.array(values), kind) == np.dtype(expected)
+
+
+def test_min_dtype_max_bits():
+    assert min_dtype(np.array([2**31]), max_bits=32) == np.dtype(np.uint32)
+    with pytest.raises(OverflowError):
+        min_dtype(np.array([2**32]), max_bits=32)
+
+
+def test_min_dtype_nan():
+    with pytest.raises(ValueError):
+        min_dtype(np.array([1.0, np.nan]))
+
+
+def test_ragged_padded_round_trip():
+    padded = np.array([[3, 4, 0], [0, 0, 0], [7, 0, 0], [1, 2, 5]])
+    ragged = RaggedArray.from_padded(padded)
+    assert len(ragged) == 4
+    np.testing.assert_array_equal(ragged.lengths, [2, 0, 1, 3])
+    np.testing.assert_array_equal(ragged[3], [1, 2, 5])
+    np.testing.assert_array_equal(ragged.to_padded(), padded)
+    np.testing.assert_array_equal(ragged.to_padded(width=5)[:, :3], padded)
+
+
+def test_ragged_lists_round_trip():
+    lists = [[3, 4], np.nan, [7, 0], [1, 2, 5]]
+    ragged = RaggedArray.from_lists(lists, dtype=np.uint16)
+    assert ragged.values.dtype == np.uint16
+    assert ragged.tolist() == [[3, 4, 0], [0, 0, 0], [7, 0, 0], [1, 2, 5]]
+    copy = RaggedArray.from_padded(np.array(ragged.tolist()))
+    np.testing.assert_array_equal(copy.values, ragged.values)
+    np.testing.assert_array_equal(copy.offsets, ragged.offsets)
+
+
+def test_table_round_trip():
+    data = {
+        "CEid": [1, 2, 300],
+        "i": [1, 1, 2],
+        "j": [1, 2, 1],
+        "pctLacRiviere": [0.0, 10.0, 5.5],
+        "pctForet": [50.0, 40.0, 44.5],
+        "pctMarais": [0.0, 0.0, 0.0],
+        "pctSolNu": [50.0, 50.0, 50.0],
+        "altitude": [100.0, 120.5, 90.0],
+    }
+    table = CarreauxEntiers(data)
+    assert len(table) == 3
+    assert table["CEid"].dtype == np.uint16
+    assert table["i"].dtype == np.uint8
+    copy = CarreauxEntiers.from_dict(table.to_dict())
+    for name in table.columns:
+        np.testing.assert_array_equal(copy[name], table[name])
+    assert copy.to_dict() == table.to_dict()
+
+
+def test_table_rejects_nan_ids():
+    data = dict.fromkeys(CarreauxEntiers.__columns__, [1.0, 2.0])
+    data["CEid"] = [1.0, np.nan]
+    with pytest.raises(ValueError):
+        CarreauxEntiers(data)